@@ -1,39 +1,241 @@
+import os
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.utils import get_last_value_from_parameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import HttpResponse
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from .message_cache import invalidate_after_commit
 from .models import Conversation, Membership, Message, Contact, GroupInvitation
+from .profiler import ProfilerBusy, collapsed, profile
+
+# Paramètre de pagination par clé : `?before=<id>` affiche les lignes d'id inférieur
+KEYSET_VAR = "before"
+
+
+class EstimatedCountPaginator(Paginator):
+	"""Ne compte jamais toute la table.
+
+	Liste non filtrée sous PostgreSQL : estimation du planificateur (pg_class.reltuples).
+	Sinon : comptage plafonné à `max_count` lignes.
+	"""
+	max_count = 10000
+
+	@cached_property
+	def count(self):
+		queryset = self.object_list
+		if not queryset.query.where:
+			estimate = self._estimated_rows(queryset)
+			if estimate is not None and estimate > self.max_count:
+				self.approximate = True
+				return estimate
+		count = queryset.order_by()[:self.max_count].count()
+		self.approximate = count >= self.max_count
+		return count
+
+	@staticmethod
+	def _estimated_rows(queryset):
+		connection = connections[queryset.db]
+		if connection.vendor != "postgresql":
+			return None
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+			row = cursor.fetchone()
+		# -1 tant que la table n'a jamais été analysée
+		return row[0] if row and row[0] >= 0 else None
+
+
+class KeysetChangeList(ChangeList):
+	"""Pagination par clé tant que la liste suit l'ordre par défaut (id décroissant).
+
+	La page suivante filtre `id < dernier id affiché` au lieu d'un OFFSET :
+	elle coûte autant que la première, quelle que soit la profondeur.
+	Un tri sur une colonne revient à la pagination numérotée habituelle.
+	"""
+
+	def __init__(self, request, *args, **kwargs):
+		try:
+			self.keyset_before = int(request.GET[KEYSET_VAR])
+		except (KeyError, ValueError):
+			self.keyset_before = None
+		self.keyset_active = ORDER_VAR not in request.GET
+		super().__init__(request, *args, **kwargs)
+
+	def get_filters_params(self, params=None):
+		lookup_params = super().get_filters_params(params)
+		lookup_params.pop(KEYSET_VAR, None)
+		return lookup_params
+
+	def get_queryset(self, request, exclude_parameters=None):
+		queryset = super().get_queryset(request, exclude_parameters)
+		if self.keyset_active and self.keyset_before is not None:
+			queryset = queryset.filter(pk__lt=self.keyset_before)
+		return queryset
+
+	def get_results(self, request):
+		if self.keyset_active:
+			self.page_num = 1
+		super().get_results(request)
+
+	@cached_property
+	def keyset_next_url(self):
+		# Évalue la page une seule fois : le gabarit réutilise ce résultat
+		rows = list(self.result_list)
+		if len(rows) < self.list_per_page:
+			return None
+		return self.get_query_string({KEYSET_VAR: rows[-1].pk})
+
+	@cached_property
+	def keyset_first_url(self):
+		return self.get_query_string(remove=[KEYSET_VAR])
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+	"""Filtre sur une clé étrangère via la recherche autocomplete de l'admin,
+	au lieu de lister toutes les valeurs possibles dans la barre latérale.
+
+	Le modèle cible doit avoir un ModelAdmin avec `search_fields`.
+	"""
+	template = "admin/chat/autocomplete_filter.html"
+
+	def __init__(self, field, request, params, model, model_admin, field_path):
+		self.lookup_kwarg = f"{field_path}__{field.target_field.name}__exact"
+		self.lookup_val = get_last_value_from_parameters(params, self.lookup_kwarg)
+		super().__init__(field, request, params, model, model_admin, field_path)
+		self.widget = AutocompleteSelect(field, model_admin.admin_site)
+		# Seule la valeur sélectionnée est chargée au rendu, pas toute la table
+		self.widget.choices = forms.ModelChoiceField(field.remote_field.model._default_manager.all()).choices
+
+	def expected_parameters(self):
+		return [self.lookup_kwarg]
+
+	def choices(self, changelist):
+		yield {
+			"selected": self.lookup_val is not None,
+			"query_string": changelist.get_query_string(remove=[self.lookup_kwarg, KEYSET_VAR]),
+			"widget": self.widget.render(self.lookup_kwarg, self.lookup_val, attrs={"id": f"filter_{self.lookup_kwarg}"}),
+		}
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+	"""Admin pour les grosses tables : nombre de requêtes fixe à l'ouverture de la liste"""
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	show_facets = admin.ShowFacets.NEVER
+	list_per_page = 50
+	# Active la pagination par clé (nécessite ordering = ("-id",))
+	keyset_pagination = False
+
+	def get_changelist(self, request, **kwargs):
+		if self.keyset_pagination:
+			return KeysetChangeList
+		return super().get_changelist(request, **kwargs)
+
+	@property
+	def media(self):
+		media = super().media
+		for spec in self.list_filter:
+			if isinstance(spec, tuple) and issubclass(spec[1], AutocompleteFilter):
+				field = self.model._meta.get_field(spec[0])
+				media += AutocompleteSelect(field, self.admin_site).media
+				media += forms.Media(js=["admin/js/jquery.init.js", "chat/admin/autocomplete_filter.js"])
+				break
+		return media
 
 
 @admin.register(Conversation)
-class ConversationAdmin(admin.ModelAdmin):
+class ConversationAdmin(ScalableModelAdmin):
 	list_display = ("id", "type", "name", "created_by", "created_at")
+	list_select_related = ("created_by",)
 	search_fields = ("name",)
 	list_filter = ("type",)
+	autocomplete_fields = ("created_by",)
+	ordering = ("-id",)
+	keyset_pagination = True
 
 
 @admin.register(Membership)
-class MembershipAdmin(admin.ModelAdmin):
+class MembershipAdmin(ScalableModelAdmin):
 	list_display = ("id", "conversation", "user", "is_admin", "joined_at")
+	list_select_related = ("conversation", "user")
 	search_fields = ("user__username",)
-	list_filter = ("is_admin",)
+	list_filter = ("is_admin", ("conversation", AutocompleteFilter), ("user", AutocompleteFilter))
+	autocomplete_fields = ("conversation", "user")
+	ordering = ("-id",)
+	keyset_pagination = True
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ScalableModelAdmin):
 	list_display = ("id", "conversation", "sender", "created_at")
+	list_select_related = ("conversation", "sender")
 	search_fields = ("content",)
-	list_filter = ("conversation",)
+	list_filter = (("conversation", AutocompleteFilter), ("sender", AutocompleteFilter))
+	autocomplete_fields = ("conversation", "sender")
+	ordering = ("-id",)
+	keyset_pagination = True
+
+	# Pas de signal post_delete sur Message (chat/signals.py) : le cache des messages récents est invalidé ici
+	def delete_model(self, request, obj):
+		super().delete_model(request, obj)
+		invalidate_after_commit([obj.conversation_id])
+
+	def delete_queryset(self, request, queryset):
+		conversation_ids = list(queryset.order_by().values_list("conversation_id", flat=True).distinct())
+		super().delete_queryset(request, queryset)
+		invalidate_after_commit(conversation_ids)
 
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(ScalableModelAdmin):
 	list_display = ("from_user", "to_user", "status", "created_at")
+	list_select_related = ("from_user", "to_user")
 	list_filter = ("status", "created_at")
 	search_fields = ("from_user__username", "to_user__username")
+	autocomplete_fields = ("from_user", "to_user")
 
 
 @admin.register(GroupInvitation)
-class GroupInvitationAdmin(admin.ModelAdmin):
+class GroupInvitationAdmin(ScalableModelAdmin):
 	list_display = ("conversation", "from_user", "to_user", "status", "created_at")
+	list_select_related = ("conversation", "from_user", "to_user")
 	list_filter = ("status", "created_at")
 	search_fields = ("conversation__name", "from_user__username", "to_user__username")
+	autocomplete_fields = ("conversation", "from_user", "to_user")
+
+
+class ProfileForm(forms.Form):
+	seconds = forms.IntegerField(label="Durée (s)", min_value=1, max_value=settings.CHAT_PROFILE_MAX_SECONDS, initial=10)
+	interval_ms = forms.IntegerField(
+		label="Intervalle (ms)", min_value=1, max_value=1000, required=False,
+		help_text=f"Défaut : {settings.CHAT_PROFILE_INTERVAL_MS} ms",
+	)
+	idle = forms.BooleanField(label="Inclure les threads inactifs", required=False)
+
 
+def profile_worker(request):
+	"""Profiler le worker qui sert la requête ; réponse au format collapsed (flamegraph).
 
+	Vue synchrone : elle occupe son propre thread pendant le profil, la boucle
+	d'événements du worker continue de servir les autres requêtes.
+	"""
+	form = ProfileForm(request.GET or None)
+	if form.is_valid():
+		try:
+			sampler = profile(form.cleaned_data["seconds"], form.cleaned_data["interval_ms"], form.cleaned_data["idle"])
+		except ProfilerBusy as exc:
+			return HttpResponse(str(exc), status=409, content_type="text/plain; charset=utf-8")
+		response = HttpResponse(collapsed(sampler.stacks), content_type="text/plain; charset=utf-8")
+		response["Content-Disposition"] = f'attachment; filename="worker-{os.getpid()}.folded"'
+		response["X-Profile-Pid"] = str(os.getpid())
+		response["X-Profile-Samples"] = str(sampler.samples)
+		return response
+	context = {**admin.site.each_context(request), "title": "Profil du worker", "form": form, "pid": os.getpid()}
+	return TemplateResponse(request, "admin/chat/profile.html", context)
@@ -0,0 +1,229 @@
+"""Actions REST les plus sollicitées, en vues Django asynchrones.
+
+Sous ASGI (daphne), ces vues restent sur la boucle d'événements : ORM
+asynchrone et `await channel_layer.group_send` natif, sans le passage
+sync -> async (async_to_sync) qu'imposait la vue DRF synchrone.
+Elles remplacent les actions `messages`, `send`, `mark-read` et
+`unread-count` de `ConversationViewSet`, aux mêmes URLs, avec la même
+authentification que DRF par défaut : session (CSRF exigé pour les méthodes
+non sûres), puis HTTP Basic.
+"""
+import base64
+import binascii
+from functools import wraps
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import aauthenticate
+from django.db.models import Count, F, Q
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import PermissionDenied
+
+from .codecs import HAS_MSGPACK, MSGPACK_MEDIA_TYPE, json_dumps, json_loads, msgpack_dumps, msgpack_loads
+from .membership_cache import memberships
+from .message_cache import recent_messages
+from .models import Contact, Membership, Message
+from .profiler import label, request_label
+from .serializers import MessageSerializer, requested_fields
+from .ws_auth import aissue_token
+
+
+def _wants_msgpack(request):
+	return HAS_MSGPACK and MSGPACK_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+def _render(request, data, status=200):
+	if _wants_msgpack(request):
+		return HttpResponse(msgpack_dumps(data), status=status, content_type=MSGPACK_MEDIA_TYPE)
+	return HttpResponse(json_dumps(data), status=status, content_type="application/json")
+
+
+def _request_data(request):
+	"""Corps de requête JSON, MessagePack ou formulaire"""
+	content_type = request.content_type or ""
+	if content_type == "application/json":
+		return json_loads(request.body) if request.body else {}
+	if content_type == MSGPACK_MEDIA_TYPE and HAS_MSGPACK:
+		return msgpack_loads(request.body) if request.body else {}
+	return request.POST
+
+
+def _basic_credentials(request):
+	"""(identifiant, mot de passe) d'un en-tête `Authorization: Basic`, "" s'il est mal formé, None sans en-tête"""
+	auth = request.headers.get("Authorization", "").split()
+	if not auth or auth[0].lower() != "basic":
+		return None
+	if len(auth) != 2:
+		return ""
+	try:
+		username, separator, password = base64.b64decode(auth[1], validate=True).decode("utf-8").partition(":")
+	except (binascii.Error, UnicodeDecodeError):
+		return ""
+	return (username, password) if separator else ""
+
+
+async def _authenticate(request):
+	"""Utilisateur authentifié et None, ou None et le motif du refus (SessionAuthentication puis BasicAuthentication)"""
+	user = await request.auser()
+	if user.is_authenticated:
+		try:
+			SessionAuthentication().enforce_csrf(request)
+		except PermissionDenied as exc:
+			return None, str(exc.detail)
+		return user, None
+	credentials = _basic_credentials(request)
+	if credentials is None:
+		return None, "Authentication credentials were not provided."
+	if not credentials:
+		return None, "Invalid basic header."
+	user = await aauthenticate(request, username=credentials[0], password=credentials[1])
+	if user is None or not user.is_active:
+		return None, "Invalid username/password."
+	return user, None
+
+
+def _login_required(view):
+	"""Authentification et permission IsAuthenticated de DRF (403 JSON)"""
+	@wraps(view)
+	async def wrapper(request, *args, **kwargs):
+		with label(request_label(request)):
+			user, refusal = await _authenticate(request)
+			if user is None:
+				return _render(request, {"detail": refusal}, status=403)
+			return await view(request, user, *args, **kwargs)
+	# CSRF vérifié par _authenticate pour la seule session, comme DRF : pas pour HTTP Basic
+	return csrf_exempt(wrapper)
+
+
+async def _membership(user, pk):
+	"""MembershipInfo (is_admin, type) depuis le cache des appartenances, ou None"""
+	return (await memberships.aget(user.id)).get(pk)
+
+
+def _not_found(request):
+	return _render(request, {"detail": "Conversation introuvable"}, status=404)
+
+
+async def _contact_refused(user, pk, membership):
+	"""Conversation privée dont les deux utilisateurs ne sont plus en contact"""
+	if membership.type != "direct":
+		return False
+	other_user_id = await (
+		Membership.objects.filter(conversation_id=pk)
+		.exclude(user=user)
+		.values_list("user_id", flat=True)
+		.afirst()
+	)
+	if other_user_id is None:
+		return False
+	return not await Contact.objects.filter(
+		Q(from_user=user, to_user_id=other_user_id, status='accepted') |
+		Q(from_user_id=other_user_id, to_user=user, status='accepted')
+	).aexists()
+
+
+async def _publish(message):
+	"""Sérialiser un nouveau message, l'ajouter au cache et le diffuser ; renvoie le payload"""
+	payload = MessageSerializer(message).data
+	await recent_messages.aappend(message.conversation_id, json_dumps(payload))
+	await get_channel_layer().group_send(
+		f"chat_{message.conversation_id}",
+		{"type": "chat_message", "message": payload},
+	)
+	return payload
+
+
+@require_GET
+@_login_required
+async def list_messages(request, user, pk):
+	if await _membership(user, pk) is None:
+		return _not_found(request)
+	fields = requested_fields(request)
+	if fields is None:
+		cached = await recent_messages.aget(pk)
+		if cached is not None:
+			if _wants_msgpack(request):
+				return _render(request, [json_loads(entry) for entry in cached])
+			return HttpResponse(b"[" + b",".join(cached) + b"]", content_type="application/json")
+		token = await recent_messages.abegin_fill(pk)
+	# Dernière page, renvoyée dans l'ordre chronologique
+	messages = [
+		message async for message in
+		Message.objects.filter(conversation_id=pk)
+		.select_related("sender")
+		.order_by("-created_at", "-id")[:settings.CHAT_RECENT_MESSAGES_SIZE]
+	]
+	messages.reverse()
+	data = MessageSerializer(messages, many=True, fields=fields).data
+	if fields is None:
+		await recent_messages.afill(pk, [json_dumps(item) for item in data], token)
+	return _render(request, data)
+
+
+@require_POST
+@_login_required
+async def send_message(request, user, pk):
+	membership = await _membership(user, pk)
+	if membership is None:
+		return _not_found(request)
+
+	if await _contact_refused(user, pk, membership):
+		return _render(request, {
+			"detail": "Impossible d'envoyer un message : vous n'êtes plus en contact avec cet utilisateur"
+		}, status=403)
+
+	try:
+		data = _request_data(request)
+	except (ValueError, TypeError):
+		return _render(request, {"detail": "Corps de requête invalide"}, status=400)
+	content = (data.get("content", "") or "").strip()
+	attachment = request.FILES.get("attachment")
+	if not content and not attachment:
+		return _render(request, {"detail": "content ou attachment requis"}, status=400)
+	message = await Message.objects.acreate(conversation_id=pk, sender=user, content=content, attachment=attachment)
+
+	payload = await _publish(message)
+	fields = requested_fields(request)
+	if fields:
+		payload = {k: v for k, v in payload.items() if k in fields}
+	return _render(request, payload, status=201)
+
+
+@require_POST
+@_login_required
+async def mark_read(request, user, pk):
+	if await _membership(user, pk) is None:
+		return _not_found(request)
+	now = timezone.now()
+	updated = await Membership.objects.filter(conversation_id=pk, user=user).aupdate(last_read_at=now)
+	if not updated:
+		return _not_found(request)
+	return _render(request, {"status": "ok", "last_read_at": now})
+
+
+@require_GET
+@_login_required
+async def unread_count(request, user):
+	# Une seule requête agrégée au lieu d'un COUNT par conversation
+	unread = Count(
+		"conversation__messages",
+		filter=Q(last_read_at__isnull=True) | Q(conversation__messages__created_at__gt=F("last_read_at")),
+	)
+	counts = {
+		conversation_id: count async for conversation_id, count in
+		Membership.objects.filter(user=user).annotate(unread=unread).values_list("conversation_id", "unread")
+	}
+	return _render(request, {"by_conversation": counts, "total": sum(counts.values())})
+
+
+@require_GET
+@_login_required
+async def ws_token(request, user):
+	"""Jeton d'authentification WebSocket (`ws/chat/<id>/?token=`), réutilisable jusqu'à expiration"""
+	response = _render(request, {"token": await aissue_token(user), "expires_in": settings.CHAT_WS_TOKEN_MAX_AGE})
+	response["Cache-Control"] = "no-store"
+	return response
@@ -0,0 +1,62 @@
+"""Encodage JSON / MessagePack partagé entre l'API REST et les WebSockets.
+
+orjson et msgpack sont optionnels : sans eux on retombe sur le module json
+standard et MessagePack n'est simplement pas proposé aux clients.
+"""
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+	import orjson
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	orjson = None
+
+try:
+	import msgpack
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	msgpack = None
+
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_SUBPROTOCOL = "msgpack"
+HAS_MSGPACK = msgpack is not None
+
+_fallback_encoder = JSONEncoder()
+# Dates confiées à l'encodeur DRF pour garder exactement le même format ("Z" final),
+# clés entières acceptées (ex. compteurs par conversation).
+_ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
+def _default(obj):
+	# Types que orjson/msgpack ne savent pas encoder (Decimal, lazy strings, QuerySet...)
+	return _fallback_encoder.default(obj)
+
+
+def json_dumps(data) -> bytes:
+	if orjson is not None:
+		return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+	return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data):
+	if orjson is not None:
+		return orjson.loads(data)
+	if isinstance(data, (bytes, bytearray, memoryview)):
+		data = bytes(data).decode("utf-8")
+	return json.loads(data)
+
+
+def msgpack_dumps(data) -> bytes:
+	return msgpack.packb(data, default=_msgpack_default, use_bin_type=True, datetime=False)
+
+
+def msgpack_loads(data):
+	return msgpack.unpackb(data, raw=False)
+
+
+def _msgpack_default(obj):
+	value = _default(obj)
+	if isinstance(value, (str, int, float, bool, list, dict)) or value is None:
+		return value
+	return str(value)
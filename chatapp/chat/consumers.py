@@ -1,122 +1,178 @@
-import json
-from channels.db import database_sync_to_async
+import asyncio
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db import router, transaction
+from django.db.models import Exists, OuterRef, Q
 
-from .models import Conversation, Membership, Message
+from .codecs import HAS_MSGPACK, MSGPACK_SUBPROTOCOL, json_dumps, json_loads, msgpack_dumps, msgpack_loads
+from . import draining
+from .profiler import ProfiledConsumerMixin
+from .querybudget import QueryBudgetConsumerMixin
+from .db import chat_database_sync_to_async
+from .membership_cache import memberships
+from .message_cache import recent_messages
+from .models import Contact, Conversation, Membership, Message
+from .serializers import MessageSerializer
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(ProfiledConsumerMixin, QueryBudgetConsumerMixin, AsyncWebsocketConsumer):
 	async def connect(self):
 		user = self.scope.get("user")
 		if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
 			await self.close(code=4401)
 			return
 		self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-		# Accept either numeric conversation id or slug-like
-		self.conversation = await self._get_conversation(self.room_name)
+		membership = (await memberships.aget(user.id)).get(int(self.room_name)) if self.room_name.isdigit() else None
+		if membership is not None:
+			# Cas courant : appartenance et type lus dans le cache, sans requête
+			self.conversation, is_member = Conversation(pk=int(self.room_name), type=membership.type), True
+		else:
+			# Accept either numeric conversation id or slug-like
+			self.conversation, is_member = await self._get_conversation(self.room_name, user.id)
 		if not self.conversation:
 			await self.close(code=4404)
 			return
-		is_member = await self._is_member(self.conversation.id, user.id)
 		if not is_member:
 			await self.close(code=4403)
 			return
 		self.room_group_name = f"chat_{self.conversation.id}"
 
+		# MessagePack en trames binaires si le client le demande via le sous-protocole
+		self.use_msgpack = HAS_MSGPACK and MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", [])
+		# Regroupement des messages (`?batch=1`) : une trame tableau par fenêtre de diffusion
+		query = parse_qs(self.scope.get("query_string", b"").decode("latin-1"))
+		self.batch_window = settings.CHAT_WS_BATCH_WINDOW_MS / 1000 if query.get("batch") == ["1"] else 0
+		self._batch = []
+		self._batch_flush = None
+
 		await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-		await self.accept()
+		await self.accept(subprotocol=MSGPACK_SUBPROTOCOL if self.use_msgpack else None)
+		draining.register(self.channel_name)
 
 	async def disconnect(self, close_code):
+		draining.unregister(self.channel_name)
+		flush = getattr(self, "_batch_flush", None)
+		if flush is not None:
+			flush.cancel()
 		# Guard in case connect was refused before room_group_name was set
 		room = getattr(self, "room_group_name", None)
 		if room:
 			await self.channel_layer.group_discard(room, self.channel_name)
 
-	async def receive(self, text_data):
-		data = json.loads(text_data)
-		content = data.get("message", "").strip()
+	async def receive(self, text_data=None, bytes_data=None):
+		try:
+			data = msgpack_loads(bytes_data) if bytes_data is not None and self.use_msgpack else json_loads(text_data or bytes_data)
+		except Exception:
+			return
+		if not isinstance(data, dict):
+			return
+		content = (data.get("message") or "").strip()
 		if not content:
 			return
 		user = self.scope.get("user")
-		
-		# Vérifier les contacts pour les conversations privées
-		if self.conversation.type == "direct":
-			can_send = await self._check_contact_status(self.conversation.id, user.id)
-			if not can_send:
-				await self.send(text_data=json.dumps({
-					"error": "Impossible d'envoyer un message : vous n'êtes plus en contact avec cet utilisateur"
-				}))
-				return
-		
-		message_obj = await self._create_message(self.conversation.id, user.id, content)
+
+		# Un seul passage en base par message : vérification du contact et insertion
+		message = await self._create_message(self.conversation, user, content)
+		if message is None:
+			await self.send_payload({
+				"error": "Impossible d'envoyer un message : vous n'êtes plus en contact avec cet utilisateur"
+			})
+			return
 		await self.channel_layer.group_send(
 			self.room_group_name,
-			{
-				"type": "chat_message",
-				"message": {
-					"id": message_obj["id"],
-					"conversation": message_obj["conversation"],
-					"sender": message_obj["sender"],
-					"sender_username": message_obj["sender_username"],
-					"content": message_obj["content"],
-					"created_at": message_obj["created_at"],
-				},
-			},
+			{"type": "chat_message", "message": message},
 		)
 
 	async def chat_message(self, event):
-		await self.send(text_data=json.dumps({"message": event["message"]}))
+		payload = {"message": event["message"]}
+		if not self.batch_window:
+			await self.send_payload(payload)
+			return
+		self._batch.append(payload)
+		if len(self._batch) >= settings.CHAT_WS_BATCH_MAX:
+			await self.flush_batch()
+		elif self._batch_flush is None:
+			self._batch_flush = asyncio.ensure_future(self._flush_batch_later())
 
-	@database_sync_to_async
-	def _get_conversation(self, room_name):
-		try:
-			if room_name.isdigit():
-				return Conversation.objects.get(pk=int(room_name))
-			# fallback: allow using name for group rooms if unique
-			return Conversation.objects.filter(name=room_name).first()
-		except Conversation.DoesNotExist:
-			return None
+	async def _flush_batch_later(self):
+		await asyncio.sleep(self.batch_window)
+		self._batch_flush = None
+		await self.flush_batch()
 
-	@database_sync_to_async
-	def _is_member(self, conversation_id: int, user_id: int) -> bool:
-		return Membership.objects.filter(conversation_id=conversation_id, user_id=user_id).exists()
+	async def flush_batch(self):
+		"""Envoyer les messages en attente en une seule trame (tableau de payloads)"""
+		if self._batch_flush is not None:
+			self._batch_flush.cancel()
+			self._batch_flush = None
+		if self._batch:
+			batch, self._batch = self._batch, []
+			await self._send_frame(batch)
+
+	async def chat_event(self, event):
+		# Événement de la conversation (ex. nouveaux membres), envoyé par une tâche différée
+		await self.send_payload({"event": event["event"]})
+
+	async def server_drain(self, event):
+		# Le worker s'arrête : le client se reconnectera (après un délai aléatoire) sur un autre worker
+		await self.send_payload(draining.reconnect_hint())
+		await self.close(code=draining.SERVICE_RESTART)
+
+	async def send_payload(self, payload):
+		# Les messages en attente partent d'abord, pour conserver l'ordre
+		if getattr(self, "_batch", None):
+			await self.flush_batch()
+		await self._send_frame(payload)
+
+	async def _send_frame(self, payload):
+		if self.use_msgpack:
+			await self.send(bytes_data=msgpack_dumps(payload))
+		else:
+			await self.send(text_data=json_dumps(payload).decode("utf-8"))
+
+	@chat_database_sync_to_async
+	def _get_conversation(self, room_name, user_id: int):
+		"""Conversation et appartenance de l'utilisateur, en une seule requête"""
+		conversations = Conversation.objects.annotate(
+			is_member=Exists(Membership.objects.filter(conversation=OuterRef("pk"), user_id=user_id))
+		)
+		if room_name.isdigit():
+			conversation = conversations.filter(pk=int(room_name)).first()
+		else:
+			# fallback: allow using name for group rooms if unique
+			conversation = conversations.filter(name=room_name).first()
+		if conversation is None:
+			return None, False
+		return conversation, conversation.is_member
 
-	@database_sync_to_async
 	def _check_contact_status(self, conversation_id: int, user_id: int) -> bool:
 		"""Vérifier si les utilisateurs sont toujours en contact pour une conversation privée"""
-		from django.db.models import Q
-		from .models import Contact
-		
-		# Récupérer l'autre utilisateur de la conversation
-		other_membership = Membership.objects.filter(
+		other_user_ids = Membership.objects.filter(
 			conversation_id=conversation_id
-		).exclude(user_id=user_id).first()
-		
-		if not other_membership:
-			return False
-		
-		other_user_id = other_membership.user_id
-		
+		).exclude(user_id=user_id).values("user_id")
+
 		# Vérifier si les utilisateurs sont toujours en contact
 		return Contact.objects.filter(
-			Q(from_user_id=user_id, to_user_id=other_user_id, status='accepted') |
-			Q(from_user_id=other_user_id, to_user_id=user_id, status='accepted')
+			Q(from_user_id=user_id, to_user_id__in=other_user_ids) |
+			Q(from_user_id__in=other_user_ids, to_user_id=user_id),
+			status='accepted',
 		).exists()
 
-	@database_sync_to_async
-	def _create_message(self, conversation_id: int, user_id: int, content: str):
-		msg = Message.objects.create(conversation_id=conversation_id, sender_id=user_id, content=content)
-		# Récupérer le nom d'utilisateur
-		from django.contrib.auth import get_user_model
-		User = get_user_model()
-		sender = User.objects.get(id=user_id)
-		return {
-			"id": msg.id,
-			"conversation": msg.conversation_id,
-			"sender": user_id,
-			"sender_username": sender.username,
-			"content": msg.content,
-			"created_at": msg.created_at.isoformat(),
-		}
+	@chat_database_sync_to_async
+	def _create_message(self, conversation, user, content: str):
+		"""Vérifier le contact (conversations privées) puis insérer, dans une même transaction.
+
+		Renvoie le message sérialisé, ou None si l'envoi est refusé.
+		"""
+		# Alias de l'exécuteur (chat.db.ExecutorRouter), pas celui par défaut
+		with transaction.atomic(using=router.db_for_write(Message)):
+			if conversation.type == "direct" and not self._check_contact_status(conversation.id, user.id):
+				return None
+			# L'expéditeur est déjà dans le scope : pas de relecture de la table des utilisateurs
+			msg = Message.objects.create(conversation=conversation, sender=user, content=content)
+		data = MessageSerializer(msg).data
+		recent_messages.append(conversation.id, json_dumps(data))
+		return data
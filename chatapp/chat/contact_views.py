@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
@@ -7,21 +9,37 @@ from rest_framework.response import Response
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
+from .jobs import notify_members_joined
+from .membership_cache import invalidate_after_commit, memberships
 from .models import Contact, GroupInvitation, Conversation, Membership
+from .profiler import ProfiledViewMixin
 from .serializers import ContactSerializer, GroupInvitationSerializer, ConversationSerializer
 
 User = get_user_model()
 
+# Nombre maximal d'éléments traités par une action groupée
+BULK_MAX_ITEMS = 500
+
+
+def _bulk_ids(value):
+    """Liste d'identifiants (dédoublonnée, ordre conservé) ou None si invalide"""
+    if not isinstance(value, list) or not value or len(value) > BULK_MAX_ITEMS:
+        return None
+    try:
+        return list(dict.fromkeys(int(v) for v in value))
+    except (TypeError, ValueError):
+        return None
+
 
 @method_decorator(csrf_exempt, name="dispatch")
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(ProfiledViewMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ContactSerializer
 
     def get_queryset(self):
         return Contact.objects.filter(
             Q(from_user=self.request.user) | Q(to_user=self.request.user)
-        ).distinct()
+        ).select_related("from_user", "to_user").distinct()
 
     @action(detail=False, methods=["post"], url_path="send-request")
     def send_request(self, request):
@@ -76,13 +94,46 @@ class ContactViewSet(viewsets.ModelViewSet):
         contact.save()
         return Response(ContactSerializer(contact).data)
 
+    @action(detail=False, methods=["post"], url_path="accept-bulk")
+    def accept_bulk(self, request):
+        """Accepter plusieurs demandes de contact"""
+        return self._set_status_bulk(request, 'accepted')
+
+    @action(detail=False, methods=["post"], url_path="decline-bulk")
+    def decline_bulk(self, request):
+        """Refuser plusieurs demandes de contact"""
+        return self._set_status_bulk(request, 'blocked')
+
+    def _set_status_bulk(self, request, new_status):
+        ids = _bulk_ids(request.data.get("ids"))
+        if ids is None:
+            return Response({"detail": f"ids requis (liste de {BULK_MAX_ITEMS} identifiants au plus)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Une requête pour résoudre toutes les demandes, une pour les mettre à jour
+        recipients = dict(
+            self.get_queryset().filter(pk__in=ids).values_list("id", "to_user_id")
+        )
+        allowed = [pk for pk in ids if recipients.get(pk) == request.user.id]
+        if allowed:
+            Contact.objects.filter(pk__in=allowed).update(status=new_status, updated_at=timezone.now())
+
+        results = []
+        for pk in ids:
+            if pk not in recipients:
+                results.append({"id": pk, "status": "not_found", "detail": "Demande introuvable"})
+            elif recipients[pk] != request.user.id:
+                results.append({"id": pk, "status": "forbidden", "detail": "Accès refusé"})
+            else:
+                results.append({"id": pk, "status": new_status})
+        return Response({"results": results})
+
     @action(detail=False, methods=["get"], url_path="accepted")
     def accepted_contacts(self, request):
         """Liste des contacts acceptés"""
         contacts = Contact.objects.filter(
             Q(from_user=request.user, status='accepted') | 
             Q(to_user=request.user, status='accepted')
-        ).distinct()
+        ).select_related("from_user", "to_user").distinct()
         return Response(ContactSerializer(contacts, many=True).data)
 
     @action(detail=False, methods=["get"], url_path="pending")
@@ -91,7 +142,7 @@ class ContactViewSet(viewsets.ModelViewSet):
         contacts = Contact.objects.filter(
             to_user=request.user,
             status='pending'
-        )
+        ).select_related("from_user", "to_user")
         return Response(ContactSerializer(contacts, many=True).data)
 
     @action(detail=True, methods=["delete"], url_path="delete")
@@ -108,12 +159,12 @@ class ContactViewSet(viewsets.ModelViewSet):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class GroupInvitationViewSet(viewsets.ModelViewSet):
+class GroupInvitationViewSet(ProfiledViewMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = GroupInvitationSerializer
 
     def get_queryset(self):
-        return GroupInvitation.objects.filter(to_user=self.request.user)
+        return GroupInvitation.objects.filter(to_user=self.request.user).select_related("conversation", "from_user", "to_user")
 
     @action(detail=False, methods=["post"], url_path="invite")
     def invite_user(self, request):
@@ -131,13 +182,9 @@ class GroupInvitationViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Conversation ou utilisateur introuvable"}, status=status.HTTP_404_NOT_FOUND)
         
         # Vérifier que l'utilisateur est admin du groupe
-        membership = Membership.objects.filter(
-            conversation=conversation,
-            user=request.user,
-            is_admin=True
-        ).first()
+        membership = memberships.get(request.user.id).get(conversation.id)
         
-        if not membership:
+        if not membership or not membership.is_admin:
             return Response({"detail": "Seuls les admins peuvent inviter"}, status=status.HTTP_403_FORBIDDEN)
         
         # Vérifier si l'utilisateur est déjà membre
@@ -156,7 +203,80 @@ class GroupInvitationViewSet(viewsets.ModelViewSet):
         )
         return Response(GroupInvitationSerializer(invitation).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["post"], url_path="invite-bulk")
+    def invite_users_bulk(self, request):
+        """Inviter plusieurs utilisateurs dans un groupe en une requête"""
+        conversation_id = request.data.get("conversation_id")
+        usernames = request.data.get("usernames")
+
+        if not conversation_id or not isinstance(usernames, list) or not usernames or len(usernames) > BULK_MAX_ITEMS:
+            return Response(
+                {"detail": f"conversation_id et usernames requis (liste de {BULK_MAX_ITEMS} noms au plus)"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        usernames = list(dict.fromkeys(str(u) for u in usernames))
+
+        # Vérifier que l'utilisateur est admin du groupe (et charger la conversation au passage)
+        membership = Membership.objects.filter(
+            conversation_id=conversation_id,
+            user=request.user,
+            is_admin=True
+        ).select_related("conversation").first()
+
+        if not membership:
+            if not Conversation.objects.filter(pk=conversation_id).exists():
+                return Response({"detail": "Conversation introuvable"}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"detail": "Seuls les admins peuvent inviter"}, status=status.HTTP_403_FORBIDDEN)
+        conversation = membership.conversation
+
+        # Une requête IN par ensemble : utilisateurs, membres existants, invitations existantes
+        users = {u.username: u for u in User.objects.filter(username__in=usernames).only("id", "username")}
+        user_ids = [u.id for u in users.values()]
+        member_ids = set(
+            Membership.objects.filter(conversation=conversation, user_id__in=user_ids).values_list("user_id", flat=True)
+        )
+        invited_ids = set(
+            GroupInvitation.objects.filter(conversation=conversation, to_user_id__in=user_ids).values_list("to_user_id", flat=True)
+        )
+
+        results = []
+        to_create = {}  # to_user_id -> (invitation, résultat)
+        for username in usernames:
+            target_user = users.get(username)
+            if target_user is None:
+                results.append({"username": username, "status": "not_found", "detail": "Utilisateur introuvable"})
+            elif target_user.id in member_ids:
+                results.append({"username": username, "status": "already_member", "detail": "L'utilisateur est déjà membre"})
+            elif target_user.id in invited_ids:
+                results.append({"username": username, "status": "already_invited", "detail": "Une invitation existe déjà"})
+            else:
+                invitation = GroupInvitation(
+                    conversation=conversation,
+                    from_user=request.user,
+                    to_user=target_user,
+                    status='pending'
+                )
+                result = {"username": username, "status": "invited"}
+                to_create[target_user.id] = (invitation, result)
+                results.append(result)
+
+        if to_create:
+            # Une invitation concurrente a pu être créée depuis la vérification : ignorée à
+            # l'insertion, puis relue (ignore_conflicts ne renseigne pas les clés primaires)
+            GroupInvitation.objects.bulk_create([invitation for invitation, _ in to_create.values()], ignore_conflicts=True)
+            rows = GroupInvitation.objects.filter(
+                conversation=conversation, to_user_id__in=list(to_create)
+            ).values_list("to_user_id", "id", "from_user_id")
+            for to_user_id, pk, from_user_id in rows:
+                result = to_create[to_user_id][1]
+                if from_user_id == request.user.id:
+                    result["invitation"] = pk
+                else:
+                    result.update(status="already_invited", detail="Une invitation existe déjà")
+        return Response({"results": results})
+
     @action(detail=True, methods=["post"], url_path="accept")
+    @transaction.atomic
     def accept_invitation(self, request, pk=None):
         """Accepter une invitation de groupe"""
         invitation = self.get_object()
@@ -167,11 +287,16 @@ class GroupInvitationViewSet(viewsets.ModelViewSet):
         invitation.save()
         
         # Ajouter l'utilisateur au groupe
-        Membership.objects.get_or_create(
+        _, joined = Membership.objects.get_or_create(
             conversation=invitation.conversation,
             user=request.user,
             defaults={'is_admin': False}
         )
+        if joined:
+            # Annonce aux membres connectés faite par le worker, hors requête
+            notify_members_joined.defer(
+                conversation_id=invitation.conversation_id, user_id=request.user.id, username=request.user.username
+            )
         
         return Response(GroupInvitationSerializer(invitation).data)
 
@@ -186,11 +311,60 @@ class GroupInvitationViewSet(viewsets.ModelViewSet):
         invitation.save()
         return Response(GroupInvitationSerializer(invitation).data)
 
+    @action(detail=False, methods=["post"], url_path="accept-bulk")
+    def accept_invitations_bulk(self, request):
+        """Accepter plusieurs invitations de groupe"""
+        ids = _bulk_ids(request.data.get("ids"))
+        if ids is None:
+            return Response({"detail": f"ids requis (liste de {BULK_MAX_ITEMS} identifiants au plus)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        conversation_ids = dict(
+            self.get_queryset().filter(pk__in=ids).values_list("id", "conversation_id")
+        )
+        with transaction.atomic():
+            GroupInvitation.objects.filter(pk__in=conversation_ids).update(status='accepted', updated_at=timezone.now())
+            # Ajouter l'utilisateur aux groupes dont il n'est pas déjà membre, et n'annoncer que ceux-là
+            joined = set(conversation_ids.values()) - set(
+                Membership.objects.filter(user=request.user, conversation_id__in=conversation_ids.values())
+                .values_list("conversation_id", flat=True)
+            )
+            Membership.objects.bulk_create(
+                [
+                    Membership(conversation_id=conversation_id, user=request.user, is_admin=False)
+                    for conversation_id in joined
+                ],
+                ignore_conflicts=True,
+            )
+            invalidate_after_commit([request.user.id])
+            for conversation_id in joined:
+                notify_members_joined.defer(
+                    conversation_id=conversation_id, user_id=request.user.id, username=request.user.username
+                )
+        return Response({"results": self._bulk_results(ids, conversation_ids, 'accepted')})
+
+    @action(detail=False, methods=["post"], url_path="decline-bulk")
+    def decline_invitations_bulk(self, request):
+        """Refuser plusieurs invitations de groupe"""
+        ids = _bulk_ids(request.data.get("ids"))
+        if ids is None:
+            return Response({"detail": f"ids requis (liste de {BULK_MAX_ITEMS} identifiants au plus)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = set(self.get_queryset().filter(pk__in=ids).values_list("id", flat=True))
+        GroupInvitation.objects.filter(pk__in=found).update(status='declined', updated_at=timezone.now())
+        return Response({"results": self._bulk_results(ids, found, 'declined')})
+
+    def _bulk_results(self, ids, found, new_status):
+        return [
+            {"id": pk, "status": new_status} if pk in found
+            else {"id": pk, "status": "not_found", "detail": "Invitation introuvable"}
+            for pk in ids
+        ]
+
     @action(detail=False, methods=["get"], url_path="pending")
     def pending_invitations(self, request):
         """Invitations en attente"""
         invitations = GroupInvitation.objects.filter(
             to_user=request.user,
             status='pending'
-        )
+        ).select_related("conversation", "from_user", "to_user")
         return Response(GroupInvitationSerializer(invitations, many=True).data)
@@ -0,0 +1,88 @@
+"""Exécuteur dédié aux accès base de données du ChatConsumer.
+
+`database_sync_to_async` exécute tout sur l'exécuteur partagé par défaut
+(thread_sensitive), où les hops du consumer attendent derrière le reste de
+l'application. Ici le consumer dispose de son propre pool de threads, de
+taille `CHAT_DB_EXECUTOR_WORKERS`.
+
+Dans ces threads, `ExecutorRouter` dirige les requêtes vers l'alias
+`chat_executor` : même base que `default`, mais avec des connexions
+persistantes (`CHAT_DB_EXECUTOR_CONN_MAX_AGE`). Chaque thread garde la sienne
+d'un hop à l'autre ; `DatabaseSyncToAsync` appelle `close_old_connections`
+avant et après chaque hop, ce qui ferme une connexion expirée ou inutilisable.
+Les autres threads (vues, exécuteur par défaut d'asgiref) restent sur
+`default`, sans connexion persistante par défaut (`DB_CONN_MAX_AGE=0`) : sous
+ASGI, ces threads changent d'une requête à l'autre et laisseraient des
+connexions ouvertes derrière eux.
+
+Une transaction ouverte dans un hop doit viser le même alias :
+`transaction.atomic(using=router.db_for_write(Model))`.
+"""
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+from .profiler import inherit
+
+EXECUTOR_DB = "chat_executor"
+
+_executor = None
+_executor_lock = threading.Lock()
+_thread = threading.local()
+
+
+def _mark_executor_thread():
+	_thread.executor = True
+
+
+class ExecutorRouter:
+	"""Requêtes des threads de l'exécuteur du chat sur l'alias `chat_executor`"""
+
+	def db_for_read(self, model, **hints):
+		return EXECUTOR_DB if getattr(_thread, "executor", False) else None
+
+	db_for_write = db_for_read
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# Deux alias d'une même base
+		return True
+
+	def allow_migrate(self, db, app_label, **hints):
+		return False if db == EXECUTOR_DB else None
+
+
+def get_db_executor():
+	global _executor
+	if _executor is None:
+		with _executor_lock:
+			if _executor is None:
+				_executor = ThreadPoolExecutor(
+					max_workers=settings.CHAT_DB_EXECUTOR_WORKERS,
+					thread_name_prefix="chat-db",
+					initializer=_mark_executor_thread,
+				)
+	return _executor
+
+
+def _reset_after_fork():
+	# Les threads du pool ne survivent pas à un fork : le processus fils recrée le sien
+	global _executor, _executor_lock
+	_executor = None
+	_executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def chat_database_sync_to_async(func):
+	"""Comme `database_sync_to_async`, mais sur l'exécuteur dédié du chat"""
+	@functools.wraps(func)
+	async def wrapper(*args, **kwargs):
+		# inherit : les échantillons du hop restent attribués à l'événement appelant
+		return await DatabaseSyncToAsync(inherit(func), thread_sensitive=False, executor=get_db_executor())(*args, **kwargs)
+	return wrapper
@@ -0,0 +1,38 @@
+"""Fermeture propre des WebSockets de chat lors de l'arrêt d'un worker.
+
+Chaque `ChatConsumer` ouvert s'enregistre ici. Quand le worker doit s'arrêter
+(rechargement ou arrêt via `runchat`), un événement `server.drain` est envoyé
+à chacun : le consumer le traite après le message en cours (les handlers d'un
+consumer s'exécutent l'un après l'autre), prévient le client puis ferme avec
+le code 1012 « Service Restart ».
+"""
+import random
+
+from channels.layers import get_channel_layer
+
+# Code de fermeture WebSocket standard : le service redémarre, se reconnecter
+SERVICE_RESTART = 1012
+# Les clients étalent leurs reconnexions sur cette fenêtre (millisecondes)
+RECONNECT_WINDOW_MS = 5000
+
+_active_channels = set()
+
+
+def register(channel_name):
+	_active_channels.add(channel_name)
+
+
+def unregister(channel_name):
+	_active_channels.discard(channel_name)
+
+
+def reconnect_hint():
+	return {"reconnect": {"retry_after_ms": random.randint(0, RECONNECT_WINDOW_MS)}}
+
+
+async def drain_consumers():
+	"""Demander à tous les consumers de ce processus de fermer leur connexion"""
+	channel_layer = get_channel_layer()
+	for channel_name in list(_active_channels):
+		await channel_layer.send(channel_name, {"type": "server.drain"})
+	return len(_active_channels)
@@ -0,0 +1,27 @@
+"""Tâches différées de l'application (exécutées par `manage.py run_chat_worker`)"""
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .tasks import task
+from .upload_views import purge_stale_uploads
+
+
+@task(batch=True)
+def notify_members_joined(payloads):
+	"""Annoncer les nouveaux membres : un seul événement par conversation pour tout le lot"""
+	joined = defaultdict(list)
+	for payload in payloads:
+		joined[payload["conversation_id"]].append({"id": payload["user_id"], "username": payload["username"]})
+	channel_layer = get_channel_layer()
+	for conversation_id, users in joined.items():
+		async_to_sync(channel_layer.group_send)(
+			f"chat_{conversation_id}",
+			{"type": "chat_event", "event": {"type": "members_joined", "conversation_id": conversation_id, "users": users}},
+		)
+
+
+@task(every=3600)
+def purge_uploads():
+	purge_stale_uploads()
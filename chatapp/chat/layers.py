@@ -0,0 +1,398 @@
+"""Channel layer local : les workers d'une même machine communiquent via un
+petit broker sur socket Unix, sans Redis.
+
+- `LocalBroker` tient les files, les groupes et leurs expirations. Il est lancé
+  par `manage.py runchatbroker`, ou automatiquement par `manage.py runchat`.
+- `UnixSocketChannelLayer` est le backend à déclarer dans `CHANNEL_LAYERS`.
+
+Les messages destinés aux canaux propres à un processus (`specific...!xxx`,
+ceux des consumers) sont poussés immédiatement par le broker vers le processus
+concerné, qui les met en tampon localement : pas d'aller-retour de lecture
+comme avec Redis. Les autres canaux sont conservés par le broker et relevés
+par `receive()`.
+
+Protocole : trames `longueur (4 octets) + msgpack`. Requête
+`[op, id, *args]`, réponse `[id, ok, résultat]`, message poussé
+`[0, canal, message]`. Le corps des messages est encodé une seule fois par
+l'émetteur et relayé tel quel par le broker.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+import string
+import struct
+import time
+import uuid
+from collections import defaultdict, deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+
+from .codecs import HAS_MSGPACK, msgpack_dumps, msgpack_loads
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+_PUSH = 0
+# Au-delà, un processus qui ne lit plus ses messages cesse d'en recevoir
+_MAX_WRITE_BUFFER = 16 * 1024 * 1024
+
+
+def _frame(payload):
+	body = msgpack_dumps(payload)
+	return _HEADER.pack(len(body)) + body
+
+
+async def _read_frame(reader):
+	(size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+	return msgpack_loads(await reader.readexactly(size))
+
+
+def _process_id(channel):
+	"""Identifiant du processus propriétaire d'un canal local (`...<id>!xxx`), sinon None"""
+	if "!" not in channel:
+		return None
+	return channel[:channel.index("!")].rsplit(".", 1)[-1]
+
+
+class LocalBroker:
+	def __init__(self, path, group_expiry=86400):
+		self.path = path
+		self.group_expiry = group_expiry
+		self.queues = defaultdict(deque)  # canal -> deque[(expire_à, message)]
+		self.groups = defaultdict(dict)  # groupe -> {canal: ajouté_à}
+		self.processes = {}  # identifiant de processus -> writer
+
+	async def serve(self):
+		if os.path.exists(self.path):
+			# Socket laissé par un broker précédent
+			os.unlink(self.path)
+		server = await asyncio.start_unix_server(self._handle, path=self.path)
+		os.chmod(self.path, 0o600)
+		cleaner = asyncio.ensure_future(self._clean_periodically())
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			cleaner.cancel()
+			if os.path.exists(self.path):
+				os.unlink(self.path)
+
+	async def _handle(self, reader, writer):
+		registered = set()
+		try:
+			while True:
+				op, req_id, *args = await _read_frame(reader)
+				try:
+					result = self._dispatch(writer, registered, op, args)
+				except ChannelFull:
+					writer.write(_frame([req_id, False, "full"]))
+				else:
+					writer.write(_frame([req_id, True, result]))
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+			pass
+		finally:
+			for process_id in registered:
+				if self.processes.get(process_id) is writer:
+					del self.processes[process_id]
+					self._forget_process(process_id)
+			writer.close()
+
+	def _dispatch(self, writer, registered, op, args):
+		if op == "send":
+			channel, body, capacity, expiry = args
+			self._deliver(channel, body, capacity, expiry)
+		elif op == "pop":
+			return self._pop(args[0])
+		elif op == "register":
+			self.processes[args[0]] = writer
+			registered.add(args[0])
+		elif op == "group_add":
+			group, channel = args
+			self.groups[group][channel] = time.time()
+		elif op == "group_discard":
+			group, channel = args
+			members = self.groups.get(group)
+			if members is not None:
+				members.pop(channel, None)
+				if not members:
+					del self.groups[group]
+		elif op == "group_send":
+			group, body, capacity, expiry = args
+			for channel in list(self.groups.get(group, ())):
+				try:
+					self._deliver(channel, body, capacity, expiry)
+				except ChannelFull:
+					pass
+		elif op == "flush":
+			self.queues.clear()
+			self.groups.clear()
+		else:
+			raise ValueError(f"Opération inconnue : {op}")
+		return None
+
+	def _deliver(self, channel, body, capacity, expiry):
+		process_id = _process_id(channel)
+		if process_id is not None:
+			writer = self.processes.get(process_id)
+			# Processus disparu, ou trop lent à lire : le message est perdu, comme à l'expiration
+			if writer is not None and writer.transport.get_write_buffer_size() < _MAX_WRITE_BUFFER:
+				writer.write(_frame([_PUSH, channel, body]))
+			return
+		queue = self.queues[channel]
+		self._drop_expired(queue)
+		if len(queue) >= capacity:
+			raise ChannelFull(channel)
+		queue.append((time.time() + expiry, body))
+
+	def _pop(self, channel):
+		queue = self.queues.get(channel)
+		if not queue:
+			return None
+		self._drop_expired(queue)
+		body = queue.popleft()[1] if queue else None
+		if not queue:
+			del self.queues[channel]
+		return body
+
+	def _drop_expired(self, queue):
+		now = time.time()
+		while queue and queue[0][0] < now:
+			queue.popleft()
+
+	def _forget_process(self, process_id):
+		# Le processus s'est déconnecté : ses canaux quittent tous les groupes
+		for group, members in list(self.groups.items()):
+			for channel in [c for c in members if _process_id(c) == process_id]:
+				del members[channel]
+			if not members:
+				del self.groups[group]
+
+	async def _clean_periodically(self, interval=30):
+		while True:
+			await asyncio.sleep(interval)
+			for channel, queue in list(self.queues.items()):
+				self._drop_expired(queue)
+				if not queue:
+					del self.queues[channel]
+			limit = time.time() - self.group_expiry
+			for group, members in list(self.groups.items()):
+				for channel in [c for c, added in members.items() if added < limit]:
+					del members[channel]
+				if not members:
+					del self.groups[group]
+
+
+class _BrokerConnection:
+	def __init__(self, layer, reader, writer):
+		self.layer = layer
+		self.reader = reader
+		self.writer = writer
+		self.ids = itertools.count(1)
+		self.pending = {}
+		self.registered = False
+		self.closed = False
+		self.reader_task = asyncio.ensure_future(self._read_loop())
+
+	async def request(self, op, *args):
+		if self.closed:
+			raise ConnectionError("Connexion au broker fermée")
+		req_id = next(self.ids)
+		future = asyncio.get_running_loop().create_future()
+		self.pending[req_id] = future
+		self.writer.write(_frame([op, req_id, *args]))
+		await self.writer.drain()
+		return await future
+
+	async def _read_loop(self):
+		try:
+			while True:
+				frame = await _read_frame(self.reader)
+				if frame[0] == _PUSH:
+					self.layer._on_push(frame[1], frame[2])
+					continue
+				future = self.pending.pop(frame[0], None)
+				if future is None or future.done():
+					continue
+				if frame[1]:
+					future.set_result(frame[2])
+				else:
+					future.set_exception(ChannelFull())
+		except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+			pass
+		finally:
+			self.closed = True
+			for future in self.pending.values():
+				if not future.done():
+					future.set_exception(ConnectionError("Connexion au broker perdue"))
+			self.pending.clear()
+			self.layer._on_connection_lost(self)
+
+	def close(self):
+		self.closed = True
+		self.registered = False
+		self.reader_task.cancel()
+		self.writer.close()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+	"""Channel layer multi-processus pour une seule machine, via `LocalBroker`"""
+
+	extensions = ["groups", "flush"]
+
+	def __init__(self, path, expiry=60, capacity=100, channel_capacity=None):
+		if not HAS_MSGPACK:
+			raise ImproperlyConfigured("UnixSocketChannelLayer nécessite le paquet msgpack")
+		super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+		self.channel_capacity = self.compile_capacities(channel_capacity or {})
+		self.path = path
+		self.client_prefix = uuid.uuid4().hex[:12]
+		self._connections = {}  # boucle -> _BrokerConnection
+		self._connect_locks = {}  # boucle -> asyncio.Lock
+		self._buffers = {}  # canal local -> asyncio.Queue[(expire_à, message)]
+		self._receivers = defaultdict(int)
+		self._last_clean = time.monotonic()
+
+	async def _connection(self, register=False):
+		loop = asyncio.get_running_loop()
+		conn = self._connections.get(loop)
+		if conn is not None and not conn.closed and (conn.registered or not register):
+			return conn
+		# Oublier les connexions des boucles fermées (appels via async_to_sync)
+		for other in [other for other in self._connections if other.is_closed()]:
+			del self._connections[other]
+		for other in [other for other in self._connect_locks if other.is_closed()]:
+			del self._connect_locks[other]
+		lock = self._connect_locks.get(loop)
+		if lock is None:
+			lock = self._connect_locks[loop] = asyncio.Lock()
+		# Une seule ouverture par boucle : deux coroutines concurrentes partagent la même connexion
+		async with lock:
+			conn = self._connections.get(loop)
+			if conn is None or conn.closed:
+				reader, writer = await asyncio.open_unix_connection(self.path)
+				conn = self._connections[loop] = _BrokerConnection(self, reader, writer)
+			if register and not conn.registered:
+				conn.registered = True
+				await conn.request("register", self.client_prefix)
+		return conn
+
+	def _on_connection_lost(self, conn):
+		# Broker redémarré : se réenregistrer pour que les consumers en attente reçoivent à nouveau
+		if conn.registered:
+			asyncio.ensure_future(self._reregister())
+
+	async def _reregister(self):
+		delay = 0.1
+		while True:
+			try:
+				await self._connection(register=True)
+				return
+			except OSError:
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 5)
+
+	# Channel layer API
+
+	async def send(self, channel, message):
+		assert isinstance(message, dict), "message is not a dict"
+		self.require_valid_channel_name(channel)
+		assert "__asgi_channel__" not in message
+		conn = await self._connection()
+		await conn.request("send", channel, msgpack_dumps(message), self.get_capacity(channel), self.expiry)
+
+	async def receive(self, channel):
+		self.require_valid_channel_name(channel)
+		if "!" not in channel:
+			return await self._poll(channel)
+		await self._connection(register=True)
+		queue = self._buffers.get(channel)
+		if queue is None:
+			queue = self._buffers[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+		self._receivers[channel] += 1
+		try:
+			while True:
+				expires_at, message = await queue.get()
+				if expires_at >= time.time():
+					return message
+		finally:
+			self._receivers[channel] -= 1
+			if not self._receivers[channel]:
+				del self._receivers[channel]
+				if queue.empty():
+					self._buffers.pop(channel, None)
+
+	async def _poll(self, channel):
+		delay = 0.01
+		while True:
+			conn = await self._connection()
+			body = await conn.request("pop", channel)
+			if body is not None:
+				return msgpack_loads(body)
+			await asyncio.sleep(delay)
+			delay = min(delay * 2, 0.2)
+
+	async def new_channel(self, prefix="specific"):
+		# Enregistré dès la création : un message poussé avant le premier receive() n'est pas perdu
+		await self._connection(register=True)
+		suffix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+		return f"{prefix}.{self.client_prefix}!{suffix}"
+
+	def _on_push(self, channel, body):
+		queue = self._buffers.get(channel)
+		if queue is None:
+			queue = self._buffers[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+		try:
+			queue.put_nowait((time.time() + self.expiry, msgpack_loads(body)))
+		except asyncio.QueueFull:
+			logger.warning("Tampon du canal %s plein, message ignoré", channel)
+		if time.monotonic() - self._last_clean > 10:
+			self._clean_buffers()
+
+	def _clean_buffers(self):
+		# Tampons de canaux dont plus personne ne lit les messages (consumer fermé)
+		self._last_clean = time.monotonic()
+		now = time.time()
+		for channel, queue in list(self._buffers.items()):
+			if channel in self._receivers:
+				continue
+			while not queue.empty() and queue._queue[0][0] < now:
+				queue.get_nowait()
+			if queue.empty():
+				del self._buffers[channel]
+
+	# Flush extension
+
+	async def flush(self):
+		conn = await self._connection()
+		await conn.request("flush")
+		self._buffers.clear()
+
+	async def close(self):
+		conn = self._connections.pop(asyncio.get_running_loop(), None)
+		if conn is not None:
+			conn.close()
+
+	# Groups extension
+
+	async def group_add(self, group, channel):
+		self.require_valid_group_name(group)
+		self.require_valid_channel_name(channel)
+		conn = await self._connection()
+		await conn.request("group_add", group, channel)
+
+	async def group_discard(self, group, channel):
+		self.require_valid_channel_name(channel)
+		self.require_valid_group_name(group)
+		conn = await self._connection()
+		await conn.request("group_discard", group, channel)
+
+	async def group_send(self, group, message):
+		assert isinstance(message, dict), "Message is not a dict"
+		self.require_valid_group_name(group)
+		conn = await self._connection()
+		await conn.request("group_send", group, msgpack_dumps(message), self.capacity, self.expiry)
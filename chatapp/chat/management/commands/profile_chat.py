@@ -0,0 +1,98 @@
+import json
+import os
+import signal
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.profiler import collapsed
+
+
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+class Command(BaseCommand):
+	help = (
+		"Profile à chaud les workers de `runchat` / `run_chat_worker` pendant N secondes "
+		"et écrit les piles au format collapsed (flamegraph), sans redémarrage."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("--pid", type=int, action="append", help="Worker à profiler (répétable ; défaut : tous)")
+		parser.add_argument("--seconds", type=int, default=10)
+		parser.add_argument("--interval-ms", type=int, default=None, help=f"Défaut : {settings.CHAT_PROFILE_INTERVAL_MS} ms")
+		parser.add_argument("--idle", action="store_true", help="Inclure les threads inactifs (attente réseau, verrous)")
+		parser.add_argument("--by-worker", action="store_true", help="Préfixer chaque pile par le pid du worker au lieu de les fusionner")
+		parser.add_argument("--output", "-o", help="Fichier de sortie (défaut : sortie standard)")
+
+	def workers(self):
+		"""{pid: ligne de commande} des processus profilables, fichiers périmés supprimés"""
+		directory = settings.CHAT_PROFILE_DIR
+		found = {}
+		for name in os.listdir(directory) if os.path.isdir(directory) else ():
+			stem, suffix = os.path.splitext(name)
+			if suffix != ".pid" or not stem.isdigit():
+				continue
+			path = os.path.join(directory, name)
+			if not _alive(int(stem)):
+				os.unlink(path)
+				continue
+			with open(path) as pid_file:
+				found[int(stem)] = pid_file.read()
+		return found
+
+	def handle(self, *args, **options):
+		if not 1 <= options["seconds"] <= settings.CHAT_PROFILE_MAX_SECONDS:
+			raise CommandError(f"--seconds doit être compris entre 1 et {settings.CHAT_PROFILE_MAX_SECONDS}")
+		workers = self.workers()
+		targets = options["pid"] or sorted(workers)
+		# SIGUSR2 arrête un processus qui n'a pas installé le gestionnaire : uniquement les workers inscrits
+		unknown = [pid for pid in targets if pid not in workers]
+		if unknown:
+			raise CommandError(f"Processus non profilables (pas de fichier .pid dans {settings.CHAT_PROFILE_DIR}) : {unknown}")
+		if not targets:
+			raise CommandError(f"Aucun worker profilable dans {settings.CHAT_PROFILE_DIR}")
+
+		request = {"seconds": options["seconds"], "interval_ms": options["interval_ms"], "idle": options["idle"]}
+		for pid in targets:
+			base = os.path.join(settings.CHAT_PROFILE_DIR, str(pid))
+			if os.path.exists(base + ".folded"):
+				os.unlink(base + ".folded")
+			with open(base + ".request", "w") as request_file:
+				json.dump(request, request_file)
+			os.kill(pid, signal.SIGUSR2)
+			self.stderr.write(f"Profil de {pid} ({workers[pid]}) pendant {options['seconds']} s")
+
+		stacks = Counter()
+		pending = set(targets)
+		deadline = time.monotonic() + options["seconds"] + 10
+		while pending and time.monotonic() < deadline:
+			time.sleep(0.2)
+			for pid in list(pending):
+				path = os.path.join(settings.CHAT_PROFILE_DIR, f"{pid}.folded")
+				if not os.path.exists(path):
+					continue
+				pending.discard(pid)
+				with open(path) as folded:
+					for line in folded:
+						stack, _, count = line.rstrip("\n").rpartition(" ")
+						stacks[f"pid:{pid};{stack}" if options["by_worker"] else stack] += int(count)
+				os.unlink(path)
+		if pending:
+			self.stderr.write(self.style.WARNING(f"Sans réponse (profil déjà en cours ?) : {sorted(pending)}"))
+
+		if options["output"]:
+			with open(options["output"], "w") as output:
+				output.write(collapsed(stacks))
+		else:
+			self.stdout.write(collapsed(stacks), ending="")
+		self.stderr.write(self.style.SUCCESS(f"{len(targets) - len(pending)} worker(s), {sum(stacks.values())} échantillons"))
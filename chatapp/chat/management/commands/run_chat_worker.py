@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import jobs  # noqa: F401 - enregistre les tâches de l'application
+from chat import profiler
+from chat.tasks import Worker, registry
+
+
+class Command(BaseCommand):
+	help = "Exécute les tâches différées (chat/tasks.py) dans un pool de threads"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--concurrency", type=int, default=settings.CHAT_TASK_WORKERS, help="Nombre de threads d'exécution")
+		parser.add_argument("--batch-size", type=int, default=100, help="Nombre maximal de tâches réclamées à la fois")
+		parser.add_argument("--poll-interval", type=float, default=1.0, help="Attente (secondes) quand la file est vide")
+		parser.add_argument("--lease", type=int, default=300, help="Durée (secondes) après laquelle une tâche non terminée est reprise")
+		parser.add_argument("--once", action="store_true", help="Vider la file puis s'arrêter")
+
+	def handle(self, *args, **options):
+		if options["concurrency"] < 1:
+			raise CommandError("--concurrency doit être au moins 1")
+		worker = Worker(
+			concurrency=options["concurrency"],
+			batch_size=options["batch_size"],
+			poll_interval=options["poll_interval"],
+			lease=options["lease"],
+			log=self.stdout.write,
+		)
+		worker.install_signal_handlers()
+		self.stdout.write(f"Worker de tâches : {options['concurrency']} threads, {len(registry)} tâches ({settings.CHAT_TASK_BACKEND})")
+		pid_file = profiler.install_signal_handler()
+		try:
+			worker.run(once=options["once"])
+		finally:
+			profiler.remove_signal_handler(pid_file)
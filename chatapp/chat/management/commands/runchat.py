@@ -0,0 +1,220 @@
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+	help = (
+		"Lance plusieurs workers daphne partageant un même socket d'écoute. "
+		"SIGHUP recharge les workers sans coupure, SIGTERM/SIGINT les arrête proprement."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("--bind", default="0.0.0.0", help="Adresse IPv4 d'écoute")
+		parser.add_argument("--port", type=int, default=8001)
+		parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Nombre de workers (défaut : nombre de cœurs)")
+		parser.add_argument(
+			"--drain-timeout", type=float, default=30,
+			help="Délai maximal (secondes) laissé à un worker pour terminer ses connexions avant arrêt",
+		)
+		parser.add_argument("--no-task-worker", action="store_true", help="Ne pas lancer run_chat_worker (tâches différées)")
+		# Usage interne : lancement d'un worker sur le socket hérité du superviseur
+		parser.add_argument("--worker-fd", type=int, help=argparse.SUPPRESS)
+
+	def handle(self, *args, **options):
+		if options["worker_fd"] is not None:
+			self.run_worker(options["worker_fd"], options["drain_timeout"])
+			return
+		if ":" in options["bind"]:
+			raise CommandError("Seules les adresses IPv4 sont prises en charge")
+		if options["workers"] < 1:
+			raise CommandError("--workers doit être au moins 1")
+		from chat.membership_cache import LocalMembershipCache, memberships
+		if options["workers"] > 1 and isinstance(memberships, LocalMembershipCache):
+			# Les contrôles d'accès lisent ce cache : une invalidation n'atteindrait que son propre worker
+			raise CommandError(
+				"Le cache local (CHAT_CACHE_BACKEND=local, ou paquet redis absent) ne vaut que pour un seul "
+				"processus : utilisez CHAT_CACHE_BACKEND=redis ou --workers 1"
+			)
+
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		try:
+			sock.bind((options["bind"], options["port"]))
+		except OSError as exc:
+			raise CommandError(f"Impossible d'écouter sur {options['bind']}:{options['port']} : {exc}")
+		sock.listen(2048)
+		# Aucune connexion base de données ne doit être partagée avec les workers
+		connections.close_all()
+
+		supervisor = Supervisor(self, sock, options["workers"], options["drain_timeout"], task_worker=not options["no_task_worker"])
+		self.stdout.write(f"Écoute sur {options['bind']}:{options['port']} avec {options['workers']} workers (pid {os.getpid()})")
+		supervisor.run()
+
+	def run_worker(self, fd, drain_timeout):
+		# Importé ici, et en premier : daphne installe le réacteur asyncio de Twisted à l'import
+		from chat.server import DrainingServer
+		from chat import profiler
+		from channels.routing import get_default_application
+		from twisted.internet import reactor
+
+		server = DrainingServer(
+			application=get_default_application(),
+			endpoints=[f"fd:fileno={fd}"],
+			signal_handlers=False,
+			drain_timeout=drain_timeout,
+			ws_deflate=settings.CHAT_WS_DEFLATE,
+		)
+
+		def on_signal(signum, frame):
+			reactor.callFromThread(server.drain)
+
+		signal.signal(signal.SIGTERM, on_signal)
+		signal.signal(signal.SIGINT, on_signal)
+		# Profilable à chaud par `manage.py profile_chat`
+		pid_file = profiler.install_signal_handler()
+		try:
+			server.run()
+		finally:
+			profiler.remove_signal_handler(pid_file)
+
+
+class Supervisor:
+	"""Garde `size` workers en vie sur le socket partagé et orchestre les rechargements"""
+
+	def __init__(self, command, sock, size, drain_timeout, task_worker=True):
+		self.command = command
+		self.sock = sock
+		self.size = size
+		self.drain_timeout = drain_timeout
+		self.broker = None
+		self.task_worker_enabled = task_worker
+		self.task_worker = None
+		self.workers = {}  # pid -> Popen, génération courante
+		self.retiring = {}  # pid -> (Popen, échéance), génération en cours d'arrêt
+		self.stopping = False
+		self.reload_requested = False
+
+	def log(self, message):
+		self.command.stdout.write(message)
+
+	def _manage_command(self, *args):
+		return [sys.executable, os.path.abspath(sys.argv[0]), *args]
+
+	def start_broker(self):
+		"""Démarrer le broker du channel layer local, si c'est lui qui est configuré"""
+		layer = settings.CHANNEL_LAYERS.get("default", {})
+		if layer.get("BACKEND") != "chat.layers.UnixSocketChannelLayer":
+			return
+		path = layer["CONFIG"]["path"]
+		if os.path.exists(path):
+			os.unlink(path)
+		self.broker = subprocess.Popen(self._manage_command("runchatbroker", "--path", path))
+		deadline = time.monotonic() + 5
+		while not os.path.exists(path) and time.monotonic() < deadline:
+			time.sleep(0.05)
+
+	def start_task_worker(self):
+		if self.task_worker_enabled:
+			self.task_worker = subprocess.Popen(self._manage_command("run_chat_worker"))
+
+	def stop_task_worker(self):
+		# SIGTERM : le worker termine les tâches en cours avant de sortir
+		if self.task_worker is not None:
+			self.task_worker.terminate()
+			self.task_worker.wait()
+			self.task_worker = None
+
+	def spawn(self):
+		fd = self.sock.fileno()
+		# Nouveau processus (et non fork) : un rechargement charge le code à jour
+		proc = subprocess.Popen(
+			self._manage_command("runchat", "--worker-fd", str(fd), "--drain-timeout", str(self.drain_timeout)),
+			pass_fds=(fd,),
+		)
+		self.workers[proc.pid] = proc
+		return proc
+
+	def retire(self, procs):
+		deadline = time.monotonic() + self.drain_timeout + 5
+		for proc in procs:
+			if proc.poll() is None:
+				proc.send_signal(signal.SIGTERM)
+			self.retiring[proc.pid] = (proc, deadline)
+
+	def run(self):
+		signal.signal(signal.SIGTERM, self._on_stop)
+		signal.signal(signal.SIGINT, self._on_stop)
+		signal.signal(signal.SIGHUP, self._on_reload)
+
+		self.start_broker()
+		self.start_task_worker()
+		for _ in range(self.size):
+			self.spawn()
+
+		while not self.stopping:
+			time.sleep(0.5)
+			if self.reload_requested:
+				self.reload_requested = False
+				self.reload()
+			self.reap()
+
+		self.log("Arrêt : vidage des workers en cours")
+		self.retire(list(self.workers.values()))
+		self.workers = {}
+		while self.retiring:
+			time.sleep(0.5)
+			self.reap()
+		self.stop_task_worker()
+		if self.broker is not None:
+			self.broker.terminate()
+			self.broker.wait()
+		self.sock.close()
+
+	def reload(self):
+		self.log(f"Rechargement : démarrage de {self.size} nouveaux workers")
+		old = list(self.workers.values())
+		self.workers = {}
+		for _ in range(self.size):
+			self.spawn()
+		# Le socket reste ouvert : ce que les anciens n'acceptent plus attend les nouveaux dans la file
+		self.retire(old)
+		# Worker de tâches relancé avec le code à jour ; l'ancien termine ses tâches en cours
+		if self.task_worker is not None:
+			self.retire([self.task_worker])
+			self.start_task_worker()
+
+	def reap(self):
+		if self.broker is not None and self.broker.poll() is not None and not self.stopping:
+			self.log(f"Broker du channel layer arrêté (code {self.broker.returncode}), redémarrage")
+			self.start_broker()
+		if self.task_worker is not None and self.task_worker.poll() is not None and not self.stopping:
+			self.log(f"Worker de tâches arrêté (code {self.task_worker.returncode}), redémarrage")
+			self.start_task_worker()
+		for pid, proc in list(self.workers.items()):
+			if proc.poll() is not None:
+				del self.workers[pid]
+				if not self.stopping:
+					self.log(f"Worker {pid} arrêté (code {proc.returncode}), redémarrage")
+					self.spawn()
+		now = time.monotonic()
+		for pid, (proc, deadline) in list(self.retiring.items()):
+			if proc.poll() is not None:
+				del self.retiring[pid]
+			elif now > deadline:
+				self.log(f"Worker {pid} toujours actif après le délai de vidage, arrêt forcé")
+				proc.kill()
+
+	def _on_stop(self, signum, frame):
+		self.stopping = True
+
+	def _on_reload(self, signum, frame):
+		self.reload_requested = True
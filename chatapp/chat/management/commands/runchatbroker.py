@@ -0,0 +1,27 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import LocalBroker
+
+
+class Command(BaseCommand):
+	help = "Lance le broker local (socket Unix) utilisé par chat.layers.UnixSocketChannelLayer"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--path", help="Chemin du socket (défaut : celui de CHANNEL_LAYERS)")
+		parser.add_argument("--group-expiry", type=int, default=86400, help="Durée de vie d'une appartenance à un groupe (secondes)")
+
+	def handle(self, *args, **options):
+		path = options["path"] or settings.CHANNEL_LAYERS["default"].get("CONFIG", {}).get("path")
+		if not path:
+			raise CommandError("Aucun chemin de socket : utilisez --path ou CHANNEL_LAYER=local")
+		self.stdout.write(f"Broker du channel layer sur {path}")
+		# SIGTERM (envoyé par runchat) traité comme Ctrl-C pour retirer le socket en sortant
+		signal.signal(signal.SIGTERM, signal.default_int_handler)
+		try:
+			asyncio.run(LocalBroker(path, group_expiry=options["group_expiry"]).serve())
+		except KeyboardInterrupt:
+			pass
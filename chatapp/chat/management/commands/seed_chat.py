@@ -0,0 +1,264 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.models import Contact, Conversation, Membership, Message
+
+WORDS = (
+	"salut ça va oui non merci demain ce soir réunion projet photo lien appel "
+	"ok super d'accord bientôt pourquoi quand où voilà bonne journée à plus"
+).split()
+
+# Modèles remplis par la commande : index secondaires différés et horodatages explicites
+SEEDED_MODELS = (Conversation, Membership, Contact, Message)
+
+
+def _power_law(rng, alpha, minimum, maximum):
+	"""Tirage borné d'une loi de puissance de densité ~ x^-alpha (alpha > 1)"""
+	return max(minimum, min(maximum, int(minimum * rng.paretovariate(alpha - 1))))
+
+
+@contextmanager
+def _explicit_timestamps(models):
+	"""Désactiver auto_now / auto_now_add : la commande date elle-même les lignes"""
+	saved = []
+	for model in models:
+		for field in model._meta.concrete_fields:
+			if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+				saved.append((field, field.auto_now, field.auto_now_add))
+				field.auto_now = field.auto_now_add = False
+	try:
+		yield
+	finally:
+		for field, auto_now, auto_now_add in saved:
+			field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+@contextmanager
+def _deferred_indexes(models, enabled):
+	"""Supprimer les index secondaires (Meta.indexes) pendant le chargement, les recréer ensuite.
+
+	Les contraintes d'unicité restent en place.
+	"""
+	indexes = [(model, index) for model in models for index in model._meta.indexes] if enabled else []
+	with connection.schema_editor() as editor:
+		for model, index in indexes:
+			editor.remove_index(model, index)
+	try:
+		yield
+	finally:
+		with connection.schema_editor() as editor:
+			for model, index in indexes:
+				editor.add_index(model, index)
+
+
+class Command(BaseCommand):
+	help = (
+		"Génère un jeu de données volumineux et réaliste (utilisateurs, groupes, contacts, messages) "
+		"pour les mesures de performance. Déterministe pour une même graine."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("--users", type=int, default=10000)
+		parser.add_argument("--groups", type=int, default=500)
+		parser.add_argument("--messages", type=int, default=1000000)
+		parser.add_argument("--group-alpha", type=float, default=2.0, help="Exposant de la loi de puissance des tailles de groupe")
+		parser.add_argument("--group-min-size", type=int, default=3)
+		parser.add_argument("--group-max-size", type=int, default=5000)
+		parser.add_argument("--contacts", type=float, default=10, help="Nombre moyen de contacts par utilisateur")
+		parser.add_argument("--contact-alpha", type=float, default=2.5, help="Exposant de la loi des degrés de contact (> 2)")
+		parser.add_argument("--direct-ratio", type=float, default=0.3, help="Part des contacts acceptés ayant une conversation privée")
+		parser.add_argument("--hot-skew", type=float, default=1.1, help="Concentration des messages sur les conversations chaudes (loi de Zipf)")
+		parser.add_argument("--attachment-ratio", type=float, default=0.02, help="Part des messages avec pièce jointe (chemin fictif)")
+		parser.add_argument("--days", type=int, default=365, help="Période couverte par les messages")
+		parser.add_argument("--batch-size", type=int, default=10000)
+		parser.add_argument("--seed", type=int, default=0)
+		parser.add_argument("--prefix", default="seed_", help="Préfixe des noms d'utilisateur générés")
+		parser.add_argument("--password", default="seed", help="Mot de passe commun des utilisateurs générés")
+		parser.add_argument("--keep-indexes", action="store_true", help="Ne pas différer la création des index secondaires")
+
+	def handle(self, *args, **options):
+		if options["users"] < 2 or options["group_min_size"] < 2:
+			raise CommandError("--users et --group-min-size doivent valoir au moins 2")
+		if options["group_alpha"] <= 1 or options["contact_alpha"] <= 2:
+			raise CommandError("--group-alpha doit dépasser 1 et --contact-alpha 2")
+		if get_user_model().objects.filter(username__startswith=options["prefix"]).exists():
+			raise CommandError(f"Des utilisateurs « {options['prefix']}… » existent déjà : choisissez un autre --prefix")
+
+		self.rng = random.Random(options["seed"])
+		self.total_rows = 0
+		self.batch_size = options["batch_size"]
+		self.now = timezone.now()
+		self.start = self.now - timedelta(days=options["days"])
+		started = time.monotonic()
+		if connection.vendor == "sqlite":
+			with connection.cursor() as cursor:
+				# Chargement jetable : pas de synchronisation disque à chaque transaction
+				cursor.execute("PRAGMA synchronous = OFF")
+				cursor.execute("PRAGMA journal_mode = MEMORY")
+
+		with _explicit_timestamps(SEEDED_MODELS), _deferred_indexes(SEEDED_MODELS, not options["keep_indexes"]):
+			user_ids = self.create_users(options)
+			members = self.create_groups(user_ids, options)
+			members.update(self.create_contacts(user_ids, options))
+			self.create_messages(members, options)
+			self.stdout.write("Recréation des index…")
+
+		elapsed = time.monotonic() - started
+		self.stdout.write(self.style.SUCCESS(f"Terminé en {elapsed:.0f} s ({self.total_rows / max(elapsed, 1e-3) * 60:,.0f} lignes/min)"))
+
+	def stream(self, model, objects, total=None):
+		"""Insérer un flux d'instances par lots, une transaction par lot ; renvoie les clés créées.
+
+		PostgreSQL et SQLite >= 3.35 renvoient les clés à l'insertion : pas de relecture.
+		"""
+		label = model._meta.verbose_name_plural
+		pks = []
+		count = 0
+		objects = iter(objects)
+		while True:
+			batch = list(itertools.islice(objects, self.batch_size))
+			if not batch:
+				break
+			with transaction.atomic():
+				model.objects.bulk_create(batch)
+			pks.extend(obj.pk for obj in batch)
+			count += len(batch)
+			self.stdout.write(f"\r{label} : {count:,}" + (f"/{total:,}" if total else ""), ending="")
+		self.stdout.write(f"\r{label} : {count:,}")
+		self.total_rows += count
+		return pks
+
+	def stream_rows(self, model, field_names, rows, total=None):
+		"""Insérer des tuples de valeurs par lots avec executemany, sans instancier de modèles.
+
+		Réservé aux messages : l'instanciation et la préparation champ par champ de
+		bulk_create y coûteraient plus que l'écriture elle-même.
+		"""
+		quote = connection.ops.quote_name
+		columns = ", ".join(quote(model._meta.get_field(name).column) for name in field_names)
+		sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({', '.join(['%s'] * len(field_names))})"
+		label = model._meta.verbose_name_plural
+		count = 0
+		rows = iter(rows)
+		while True:
+			batch = list(itertools.islice(rows, self.batch_size))
+			if not batch:
+				break
+			with transaction.atomic(), connection.cursor() as cursor:
+				cursor.executemany(sql, batch)
+			count += len(batch)
+			self.stdout.write(f"\r{label} : {count:,}" + (f"/{total:,}" if total else ""), ending="")
+		self.stdout.write(f"\r{label} : {count:,}")
+		self.total_rows += count
+
+	def timestamp(self, position, total):
+		"""Date croissante avec la position, répartie sur la période"""
+		return self.start + (self.now - self.start) * (position / max(total, 1))
+
+	def create_users(self, options):
+		User = get_user_model()
+		# Un seul hachage pour tous : le coût d'un hachage par ligne dominerait le chargement
+		password = make_password(options["password"])
+		prefix, total = options["prefix"], options["users"]
+		return self.stream(User, (
+			User(username=f"{prefix}{i}", password=password, date_joined=self.timestamp(i, total))
+			for i in range(total)
+		), total)
+
+	def create_groups(self, user_ids, options):
+		"""Groupes aux tailles en loi de puissance ; renvoie {conversation_id: [membres]}"""
+		rng, total = self.rng, options["groups"]
+		maximum = min(options["group_max_size"], len(user_ids))
+		sizes = [_power_law(rng, options["group_alpha"], options["group_min_size"], maximum) for _ in range(total)]
+		groups_members = [rng.sample(user_ids, size) for size in sizes]
+		conversation_ids = self.stream(Conversation, (
+			Conversation(type="group", name=f"{options['prefix']}group_{i}", created_by_id=group[0], created_at=self.timestamp(i, total))
+			for i, group in enumerate(groups_members)
+		), total)
+		members = dict(zip(conversation_ids, groups_members))
+		self.stream(Membership, (
+			Membership(conversation_id=conversation_id, user_id=user_id, is_admin=position == 0, joined_at=self.timestamp(i, total))
+			for i, (conversation_id, group) in enumerate(members.items())
+			for position, user_id in enumerate(group)
+		), sum(sizes))
+		return members
+
+	def contact_pairs(self, user_ids, options):
+		"""(de, vers, statut) avec des degrés en loi de puissance.
+
+		Une paire n'est émise que par le plus petit de ses deux indices : pas de doublon
+		ni de contact dans les deux sens, sans garder l'ensemble des paires en mémoire.
+		"""
+		rng = self.rng
+		count = len(user_ids)
+		alpha = options["contact_alpha"]
+		# Chaque tirage est gardé une fois sur deux en moyenne et compte pour deux utilisateurs
+		minimum = max(1, round(options["contacts"] * (alpha - 2) / (alpha - 1)))
+		for index, user_id in enumerate(user_ids):
+			degree = _power_law(rng, alpha, minimum, count - 1)
+			for target in sorted({rng.randrange(count) for _ in range(degree)}):
+				if target <= index:
+					continue
+				status = rng.choices(("accepted", "pending", "blocked"), weights=(85, 10, 5))[0]
+				if rng.random() < 0.5:
+					yield user_id, user_ids[target], status
+				else:
+					yield user_ids[target], user_id, status
+
+	def create_contacts(self, user_ids, options):
+		"""Contacts et conversations privées ; renvoie {conversation_id: [deux membres]}"""
+		rng = self.rng
+		pairs = []
+
+		def contacts():
+			for from_id, to_id, status in self.contact_pairs(user_ids, options):
+				when = self.timestamp(rng.random(), 1)
+				if status == "accepted" and rng.random() < options["direct_ratio"]:
+					pairs.append((from_id, to_id, when))
+				yield Contact(from_user_id=from_id, to_user_id=to_id, status=status, created_at=when, updated_at=when)
+
+		self.stream(Contact, contacts())
+		conversation_ids = self.stream(Conversation, (
+			Conversation(type="direct", created_by_id=from_id, created_at=when) for from_id, _, when in pairs
+		), len(pairs))
+		self.stream(Membership, (
+			Membership(conversation_id=conversation_id, user_id=user_id, is_admin=True, joined_at=when)
+			for conversation_id, (from_id, to_id, when) in zip(conversation_ids, pairs)
+			for user_id in (from_id, to_id)
+		), 2 * len(pairs))
+		return {conversation_id: [from_id, to_id] for conversation_id, (from_id, to_id, _) in zip(conversation_ids, pairs)}
+
+	def create_messages(self, members, options):
+		rng, total = self.rng, options["messages"]
+		conversation_ids = list(members)
+		if not conversation_ids:
+			return
+		# Conversations chaudes réparties au hasard entre groupes et conversations privées
+		rng.shuffle(conversation_ids)
+		cum_weights = list(itertools.accumulate(1 / (rank + 1) ** options["hot_skew"] for rank in range(len(conversation_ids))))
+		attachment_ratio = options["attachment_ratio"]
+		adapt_datetime = connection.ops.adapt_datetimefield_value
+
+		def messages():
+			for start in range(0, total, self.batch_size):
+				size = min(self.batch_size, total - start)
+				for offset, conversation_id in enumerate(rng.choices(conversation_ids, cum_weights=cum_weights, k=size)):
+					position = start + offset
+					yield (
+						conversation_id,
+						rng.choice(members[conversation_id]),
+						" ".join(rng.choices(WORDS, k=min(40, int(rng.expovariate(1 / 6)) + 1))),
+						f"chat_attachments/seed/{position}.bin" if rng.random() < attachment_ratio else None,
+						adapt_datetime(self.timestamp(position, total)),
+					)
+
+		self.stream_rows(Message, ("conversation", "sender", "content", "attachment", "created_at"), messages(), total)
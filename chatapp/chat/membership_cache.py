@@ -0,0 +1,215 @@
+"""Cache, par utilisateur, des conversations dont il est membre.
+
+Pour chaque utilisateur : `{conversation_id: MembershipInfo(is_admin, type)}`.
+Les vues l'utilisent pour filtrer leurs querysets et vérifier l'appartenance
+ou le rôle d'admin sans requête SQL.
+
+Ce cache sert aux contrôles d'accès : une entrée périmée donnerait encore
+accès à un membre retiré. Invalidation versionnée, en deux temps
+(`invalidate_after_commit`, à appeler dans la transaction de l'écriture) :
+1. avant commit, `prepare` incrémente la version des utilisateurs concernés et
+   compte un changement en cours ; si Redis ne répond pas, l'exception annule
+   la transaction : l'écriture échoue plutôt que de laisser des droits en cache ;
+2. après commit, `invalidate` incrémente de nouveau la version et décompte
+   le changement. Tant qu'il en reste un en cours, les lectures vont en base sans remplir le
+   cache : un remplissage concurrent ne peut pas figer l'état d'avant commit,
+   même si cette seconde étape échoue ou si la transaction est annulée (le
+   compteur expire de lui-même).
+
+Une entrée n'est servie que si elle a été calculée pour la version courante.
+Redis indisponible en lecture : lecture en base, sans cache.
+
+Même choix de backend que `message_cache` (`CHAT_CACHE_BACKEND`). Le backend
+`local` n'est cohérent que dans un seul processus : `runchat` le refuse avec
+plusieurs workers.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .codecs import json_dumps, json_loads
+from .models import Membership
+
+try:
+	import redis
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	redis = None
+
+logger = logging.getLogger(__name__)
+
+MembershipInfo = namedtuple("MembershipInfo", ("is_admin", "type"))
+
+
+def _load(user_id):
+	return {
+		conversation_id: MembershipInfo(is_admin, conversation_type)
+		for conversation_id, is_admin, conversation_type in
+		Membership.objects.filter(user_id=user_id).values_list("conversation_id", "is_admin", "conversation__type")
+	}
+
+
+class _MembershipCache:
+	# Appels réseau : hors de la boucle d'événements dans `aget`
+	blocking = False
+
+	def get(self, user_id):
+		entries, token = self.lookup(user_id)
+		if entries is None:
+			entries = _load(user_id)
+			self.store(user_id, token, entries)
+		return entries
+
+	async def aget(self, user_id):
+		if not self.blocking:
+			entries, token = self.lookup(user_id)
+			if entries is None:
+				entries = await sync_to_async(_load)(user_id)
+				self.store(user_id, token, entries)
+			return entries
+		entries, token = await sync_to_async(self.lookup, thread_sensitive=False)(user_id)
+		if entries is None:
+			entries = await sync_to_async(_load)(user_id)
+			await sync_to_async(self.store, thread_sensitive=False)(user_id, token, entries)
+		return entries
+
+
+class LocalMembershipCache(_MembershipCache):
+	def __init__(self, max_users=4096, ttl=300):
+		self.max_users = max_users
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._entries = OrderedDict()  # user_id -> (expires_at, version, entries)
+		self._versions = {}
+
+	def lookup(self, user_id):
+		with self._lock:
+			version = self._versions.get(user_id, 0)
+			item = self._entries.get(user_id)
+			if item is None:
+				return None, version
+			expires_at, entry_version, entries = item
+			if entry_version != version or expires_at < time.monotonic():
+				del self._entries[user_id]
+				return None, version
+			self._entries.move_to_end(user_id)
+			return entries, version
+
+	def store(self, user_id, token, entries):
+		with self._lock:
+			if self._versions.get(user_id, 0) != token:
+				return
+			self._entries[user_id] = (time.monotonic() + self.ttl, token, entries)
+			self._entries.move_to_end(user_id)
+			while len(self._entries) > self.max_users:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, user_ids):
+		with self._lock:
+			for user_id in user_ids:
+				self._versions[user_id] = self._versions.get(user_id, 0) + 1
+				self._entries.pop(user_id, None)
+
+	# Même processus : la seconde invalidation, après commit, ne peut pas échouer
+	prepare = invalidate
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+
+class RedisMembershipCache(_MembershipCache):
+	blocking = True
+	# Durée du compteur de changements en cours : au-delà de la plus longue transaction
+	PENDING_TTL = 300
+
+	def __init__(self, host, port, db=0, ttl=3600):
+		self.ttl = ttl
+		# La version doit survivre aux entrées : sinon un compteur expiré repartirait
+		# de zéro et pourrait retrouver une ancienne entrée de même numéro
+		self.version_ttl = ttl * 24
+		self.client = redis.Redis(host=host, port=port, db=db)
+
+	def _key(self, user_id):
+		return f"chat:members:{user_id}"
+
+	def _version_key(self, user_id):
+		return f"chat:members:{user_id}:version"
+
+	def _pending_key(self, user_id):
+		return f"chat:members:{user_id}:pending"
+
+	def lookup(self, user_id):
+		try:
+			version, pending, raw = self.client.mget(
+				self._version_key(user_id), self._pending_key(user_id), self._key(user_id)
+			)
+		except redis.RedisError:
+			logger.warning("Cache des appartenances indisponible", exc_info=True)
+			return None, None
+		if int(pending or 0) > 0:
+			# Changement en cours de validation : lecture en base, sans remplissage
+			return None, None
+		version = int(version or 0)
+		if raw is None:
+			return None, version
+		data = json_loads(raw)
+		if data["v"] != version:
+			return None, version
+		return {conversation_id: MembershipInfo(is_admin, type_) for conversation_id, is_admin, type_ in data["c"]}, version
+
+	def store(self, user_id, token, entries):
+		if token is None:
+			return
+		data = {"v": token, "c": [[conversation_id, info.is_admin, info.type] for conversation_id, info in entries.items()]}
+		try:
+			self.client.set(self._key(user_id), json_dumps(data), ex=self.ttl)
+		except redis.RedisError:
+			logger.warning("Cache des appartenances indisponible", exc_info=True)
+
+	def prepare(self, user_ids):
+		"""Avant commit ; une RedisError remonte et annule l'écriture"""
+		with self.client.pipeline() as pipe:
+			for user_id in user_ids:
+				pipe.incr(self._version_key(user_id))
+				pipe.expire(self._version_key(user_id), self.version_ttl)
+				pipe.incr(self._pending_key(user_id))
+				pipe.expire(self._pending_key(user_id), self.PENDING_TTL)
+			pipe.execute()
+
+	def invalidate(self, user_ids):
+		try:
+			with self.client.pipeline() as pipe:
+				for user_id in user_ids:
+					pipe.incr(self._version_key(user_id))
+					pipe.expire(self._version_key(user_id), self.version_ttl)
+					pipe.decr(self._pending_key(user_id))
+				pipe.execute()
+		except redis.RedisError:
+			# Sans danger : les entrées d'avant `prepare` sont déjà périmées et le compteur
+			# en cours empêche tout remplissage jusqu'à son expiration
+			logger.warning("Cache des appartenances indisponible", exc_info=True)
+
+
+def _build_cache():
+	if settings.CHAT_CACHE_BACKEND == "redis" and redis is not None:
+		return RedisMembershipCache(settings.REDIS_HOST, settings.REDIS_PORT)
+	return LocalMembershipCache()
+
+
+memberships = _build_cache()
+
+
+def invalidate_after_commit(user_ids):
+	"""Invalider les appartenances des utilisateurs modifiées par la transaction en cours.
+
+	À appeler dans `transaction.atomic()` : hors transaction, l'écriture est
+	déjà validée quand `prepare` peut échouer.
+	"""
+	user_ids = list(user_ids)
+	memberships.prepare(user_ids)
+	transaction.on_commit(lambda: memberships.invalidate(user_ids))
@@ -0,0 +1,242 @@
+"""Cache des derniers messages de chaque conversation.
+
+Les entrées sont stockées déjà sérialisées (octets JSON produits par
+`MessageSerializer`), de sorte que l'ouverture d'une conversation n'exécute
+ni requête ni sérialiseur tant que le cache est chaud.
+
+Deux implémentations :
+- Redis (une liste par conversation), partagée entre tous les workers ;
+- LRU en mémoire du processus, utilisée si Redis n'est pas disponible ou si
+  `CHAT_CACHE_BACKEND=local`. Elle n'est cohérente qu'avec un seul worker.
+
+Les vues asynchrones passent par `aget`, `abegin_fill`, `afill` et `aappend`,
+qui sortent les appels Redis de la boucle d'événements.
+
+Le remplissage après un défaut de cache est protégé par un numéro de séquence :
+si un message est ajouté pendant la requête de remplissage, le remplissage
+est abandonné plutôt que d'écrire une liste à laquelle il manquerait ce message.
+À l'inverse, un remplissage fait entre l'insertion d'un message et son ajout
+le contient déjà : `append` ignore un message dont l'id est déjà en cache.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .codecs import json_loads
+
+try:
+	import redis
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	redis = None
+
+logger = logging.getLogger(__name__)
+
+
+def _entry_id(entry):
+	return json_loads(entry)["id"]
+
+
+class _RecentMessages:
+	# Appels réseau : hors de la boucle d'événements dans les variantes asynchrones
+	blocking = False
+
+	async def _call(self, method, *args):
+		if not self.blocking:
+			return method(*args)
+		return await sync_to_async(method, thread_sensitive=False)(*args)
+
+	async def aget(self, conversation_id):
+		return await self._call(self.get, conversation_id)
+
+	async def abegin_fill(self, conversation_id):
+		return await self._call(self.begin_fill, conversation_id)
+
+	async def afill(self, conversation_id, entries, token):
+		return await self._call(self.fill, conversation_id, entries, token)
+
+	async def aappend(self, conversation_id, entry):
+		return await self._call(self.append, conversation_id, entry)
+
+
+class LocalRecentMessages(_RecentMessages):
+	def __init__(self, size, max_conversations=1024, ttl=60):
+		self.size = size
+		self.max_conversations = max_conversations
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._entries = OrderedDict()  # conversation_id -> (expires_at, deque d'entrées, deque d'ids)
+		# Numéros de séquence : valeur d'un compteur global au dernier changement de chaque
+		# conversation, bornés en LRU. Une conversation oubliée prend le plancher, la plus
+		# grande valeur évincée : un remplissage commencé avant son dernier changement échoue.
+		self.max_sequences = 4 * max_conversations
+		self._seq = OrderedDict()
+		self._counter = 0
+		self._floor = 0
+
+	def _current(self, conversation_id):
+		return self._seq.get(conversation_id, self._floor)
+
+	def _changed(self, conversation_id):
+		self._counter += 1
+		self._seq[conversation_id] = self._counter
+		self._seq.move_to_end(conversation_id)
+		while len(self._seq) > self.max_sequences:
+			self._floor = self._seq.popitem(last=False)[1]
+
+	def get(self, conversation_id):
+		with self._lock:
+			item = self._entries.get(conversation_id)
+			if item is None:
+				return None
+			expires_at, entries, _ = item
+			if expires_at < time.monotonic():
+				del self._entries[conversation_id]
+				return None
+			self._entries.move_to_end(conversation_id)
+			return list(entries)
+
+	def begin_fill(self, conversation_id):
+		with self._lock:
+			return self._current(conversation_id)
+
+	def fill(self, conversation_id, entries, token):
+		with self._lock:
+			if self._current(conversation_id) != token:
+				return
+			entries = entries[-self.size:]
+			self._entries[conversation_id] = (
+				time.monotonic() + self.ttl,
+				deque(entries, maxlen=self.size),
+				deque(map(_entry_id, entries), maxlen=self.size),
+			)
+			self._entries.move_to_end(conversation_id)
+			while len(self._entries) > self.max_conversations:
+				self._entries.popitem(last=False)
+
+	def append(self, conversation_id, entry):
+		message_id = _entry_id(entry)
+		with self._lock:
+			self._changed(conversation_id)
+			item = self._entries.get(conversation_id)
+			if item is not None and message_id not in item[2]:
+				item[1].append(entry)
+				item[2].append(message_id)
+
+	def invalidate(self, conversation_id):
+		with self._lock:
+			self._changed(conversation_id)
+			self._entries.pop(conversation_id, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+
+class RedisRecentMessages(_RecentMessages):
+	blocking = True
+
+	# KEYS : liste, séquence, ids de la liste ; ARGV : entrée, id, taille, ttl.
+	# RPUSHX : on ne complète qu'une liste déjà remplie, jamais une liste partielle.
+	APPEND_SCRIPT = """
+		redis.call('INCR', KEYS[2])
+		redis.call('EXPIRE', KEYS[2], ARGV[4])
+		if redis.call('LPOS', KEYS[3], ARGV[2]) then
+			return 0
+		end
+		if redis.call('RPUSHX', KEYS[1], ARGV[1]) > 0 then
+			redis.call('LTRIM', KEYS[1], -tonumber(ARGV[3]), -1)
+			redis.call('RPUSHX', KEYS[3], ARGV[2])
+			redis.call('LTRIM', KEYS[3], -tonumber(ARGV[3]), -1)
+		end
+		return 1
+	"""
+
+	def __init__(self, size, host, port, db=0, ttl=3600):
+		self.size = size
+		self.ttl = ttl
+		self.client = redis.Redis(host=host, port=port, db=db)
+		self._append = self.client.register_script(self.APPEND_SCRIPT)
+
+	def _key(self, conversation_id):
+		return f"chat:recent:{conversation_id}"
+
+	def _seq_key(self, conversation_id):
+		return f"chat:recent:{conversation_id}:seq"
+
+	def _ids_key(self, conversation_id):
+		return f"chat:recent:{conversation_id}:ids"
+
+	def get(self, conversation_id):
+		try:
+			entries = self.client.lrange(self._key(conversation_id), 0, -1)
+		except redis.RedisError:
+			logger.warning("Cache des messages récents indisponible", exc_info=True)
+			return None
+		return entries or None
+
+	def begin_fill(self, conversation_id):
+		try:
+			return self.client.get(self._seq_key(conversation_id))
+		except redis.RedisError:
+			return None
+
+	def fill(self, conversation_id, entries, token):
+		if not entries:
+			return
+		entries = entries[-self.size:]
+		key, seq_key, ids_key = self._key(conversation_id), self._seq_key(conversation_id), self._ids_key(conversation_id)
+		try:
+			with self.client.pipeline() as pipe:
+				pipe.watch(seq_key)
+				if pipe.get(seq_key) != token:
+					return
+				pipe.multi()
+				pipe.delete(key, ids_key)
+				pipe.rpush(key, *entries)
+				pipe.rpush(ids_key, *map(_entry_id, entries))
+				pipe.expire(key, self.ttl)
+				pipe.expire(ids_key, self.ttl)
+				pipe.execute()
+		except redis.WatchError:
+			pass
+		except redis.RedisError:
+			logger.warning("Cache des messages récents indisponible", exc_info=True)
+
+	def append(self, conversation_id, entry):
+		keys = [self._key(conversation_id), self._seq_key(conversation_id), self._ids_key(conversation_id)]
+		try:
+			self._append(keys=keys, args=[entry, _entry_id(entry), self.size, self.ttl])
+		except redis.RedisError:
+			logger.warning("Cache des messages récents indisponible", exc_info=True)
+
+	def invalidate(self, conversation_id):
+		key, seq_key = self._key(conversation_id), self._seq_key(conversation_id)
+		try:
+			with self.client.pipeline() as pipe:
+				pipe.incr(seq_key)
+				pipe.expire(seq_key, self.ttl)
+				pipe.delete(key, self._ids_key(conversation_id))
+				pipe.execute()
+		except redis.RedisError:
+			logger.warning("Cache des messages récents indisponible", exc_info=True)
+
+
+def _build_cache():
+	size = settings.CHAT_RECENT_MESSAGES_SIZE
+	if settings.CHAT_CACHE_BACKEND == "redis" and redis is not None:
+		return RedisRecentMessages(size, settings.REDIS_HOST, settings.REDIS_PORT)
+	return LocalRecentMessages(size)
+
+
+recent_messages = _build_cache()
+
+
+def invalidate_after_commit(conversation_ids):
+	"""Invalider une fois la transaction validée : un remplissage concurrent relirait sinon l'état d'avant"""
+	conversation_ids = list(conversation_ids)
+	transaction.on_commit(lambda: [recent_messages.invalidate(pk) for pk in conversation_ids])
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_upload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['from_user', 'updated_at'], name='chat_contac_from_us_be7588_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['to_user', 'updated_at'], name='chat_contac_to_user_45a126_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupinvitation',
+            index=models.Index(fields=['from_user', 'updated_at'], name='chat_groupi_from_us_274efa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupinvitation',
+            index=models.Index(fields=['to_user', 'updated_at'], name='chat_groupi_to_user_842597_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['user', 'id'], name='chat_member_user_id_d91a45_idx'),
+        ),
+    ]
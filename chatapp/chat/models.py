@@ -1,5 +1,9 @@
+import uuid
+from pathlib import Path
+
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class Conversation(models.Model):
@@ -34,6 +38,7 @@ class Membership(models.Model):
 		unique_together = ("conversation", "user")
 		indexes = [
 			models.Index(fields=["user", "conversation"]),
+			models.Index(fields=["user", "id"]),
 		]
 
 	def __str__(self) -> str:
@@ -76,6 +81,8 @@ class Contact(models.Model):
 		indexes = [
 			models.Index(fields=['from_user', 'status']),
 			models.Index(fields=['to_user', 'status']),
+			models.Index(fields=['from_user', 'updated_at']),
+			models.Index(fields=['to_user', 'updated_at']),
 		]
 
 	def __str__(self):
@@ -100,9 +107,77 @@ class GroupInvitation(models.Model):
 		unique_together = ('conversation', 'to_user')
 		indexes = [
 			models.Index(fields=['to_user', 'status']),
+			models.Index(fields=['from_user', 'updated_at']),
+			models.Index(fields=['to_user', 'updated_at']),
 		]
 
 	def __str__(self):
 		return f"Invitation {self.conversation.name} pour {self.to_user.username}"
 
 
+
+
+class Upload(models.Model):
+	"""Envoi de pièce jointe en cours, reçu par morceaux (voir chat/upload_views.py)"""
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="uploads")
+	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="uploads")
+	filename = models.CharField(max_length=255)
+	size = models.BigIntegerField()
+	# Octets reçus et CRC32 courant de ces octets
+	offset = models.BigIntegerField(default=0)
+	crc32 = models.BigIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=["updated_at"]),
+		]
+
+	def __str__(self) -> str:
+		return f"Upload({self.filename}, {self.offset}/{self.size})"
+
+	@property
+	def part_path(self) -> Path:
+		return Path(settings.MEDIA_ROOT) / "chat_uploads" / f"{self.id}.part"
+
+
+class Task(models.Model):
+	"""Tâche différée, exécutée hors requête par `run_chat_worker` (voir chat/tasks.py)"""
+	STATUS_CHOICES = [
+		("pending", "En attente"),
+		("running", "En cours"),
+		("failed", "Échouée"),
+	]
+
+	name = models.CharField(max_length=100)
+	payload = models.JSONField(default=dict)
+	# Clé de dédoublonnage : une seule tâche en attente par (name, key)
+	key = models.CharField(max_length=200, blank=True)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+	attempts = models.PositiveIntegerField(default=0)
+	run_at = models.DateTimeField(default=timezone.now)
+	# Bail du worker qui l'exécute : passé ce délai, la tâche est reprise par un autre
+	locked_until = models.DateTimeField(null=True, blank=True)
+	claimed_by = models.CharField(max_length=32, blank=True)
+	last_error = models.TextField(blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=["status", "run_at"]),
+			models.Index(fields=["name", "key"]),
+		]
+
+	def __str__(self) -> str:
+		return f"Task({self.name}, {self.status})"
+
+
+class WsTokenGeneration(models.Model):
+	"""Génération courante des jetons WebSocket d'un utilisateur (voir chat/ws_auth.py)"""
+	user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="+")
+	generation = models.PositiveIntegerField(default=0)
+
+	def __str__(self) -> str:
+		return f"WsTokenGeneration({self.user_id}, {self.generation})"
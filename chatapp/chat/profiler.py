@@ -0,0 +1,309 @@
+"""Profileur par échantillonnage activable à chaud dans un worker en production.
+
+Pendant `seconds` secondes, la pile de chaque thread du processus est relevée
+toutes les `interval` secondes, puis les piles sont renvoyées agrégées au
+format « collapsed » (`racine;appelant;appelé N`), lu directement par
+flamegraph.pl, speedscope ou inferno. Dans les workers de `runchat` et
+`run_chat_worker` (`install_signal_handler`), les relevés suivent le temps CPU
+(minuterie SIGPROF) ; ailleurs, un thread les fait en temps réel. Rien n'est
+instrumenté en dehors des fenêtres de profilage : le coût permanent se limite
+à l'étiquetage décrit ci-dessous.
+
+Étiquettes : la racine de chaque pile nomme l'activité en cours, avec les
+noms des budgets SQL (chat/querybudget.py) :
+- `ws:<type>` pour un événement de consumer (`ProfiledConsumerMixin`) ;
+- `http:<nom d'URL>` pour une action DRF (`ProfiledViewMixin`) ou une vue
+  asynchrone (`_login_required`) ;
+- `http` pour le reste du traitement d'une requête : middlewares, vues non
+  étiquetées (`ProfileLabelMiddleware`) ;
+- `task:<nom>` pour une tâche différée (`run_chat_worker`) ;
+- `thread:<nom>` pour le reste (boucle inactive, autres threads).
+
+Une étiquette est attachée à la frame qui l'a posée, pas au thread : sur la
+boucle asyncio, seule la coroutine en cours d'exécution a ses frames dans la
+pile, l'échantillon revient donc à l'événement réellement actif même quand
+des centaines de consumers s'entrelacent. Les hops base de données de
+`chat.db` reprennent l'étiquette de l'appelant (`inherit`).
+
+Déclenchement :
+- vue d'administration `admin/profile/` (staff) : profile le worker qui sert
+  la requête ;
+- `manage.py profile_chat` : profile un ou tous les workers de `runchat` et
+  `run_chat_worker` (signal SIGUSR2, échange de fichiers dans `CHAT_PROFILE_DIR`).
+"""
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .querybudget import endpoint_name
+
+logger = logging.getLogger(__name__)
+
+# frame -> étiquette ; lu sans verrou par le thread d'échantillonnage (opérations atomiques sous le GIL)
+_labels = {}
+current_label = ContextVar("chat_profile_label", default=None)
+
+# Fonctions feuilles d'un thread qui attend (sélecteur, verrou, file vide)
+IDLE_LEAVES = {
+	"selectors:EpollSelector.select",
+	"selectors:PollSelector.select",
+	"selectors:KqueueSelector.select",
+	"selectors:SelectSelector.select",
+	"threading:Condition.wait",
+	"threading:Event.wait",
+	"threading:Thread._wait_for_tstate_lock",
+	"queue:Queue.get",
+	"concurrent.futures.thread:_worker",
+	"time:sleep",
+}
+
+
+class ProfilerBusy(Exception):
+	pass
+
+
+class label:
+	"""Étiqueter les échantillons pris pendant le bloc `with` (dans la frame appelante)"""
+	__slots__ = ("name", "frame", "token")
+
+	def __init__(self, name):
+		self.name = name
+		self.frame = sys._getframe(1)
+
+	def __enter__(self):
+		if self.name is not None:
+			_labels[self.frame] = self.name
+			self.token = current_label.set(self.name)
+		return self
+
+	def __exit__(self, *exc_info):
+		if self.name is not None:
+			_labels.pop(self.frame, None)
+			current_label.reset(self.token)
+		# Pas de référence à la frame au-delà du bloc
+		self.frame = None
+
+
+def inherit(func):
+	"""Reprendre dans le thread d'exécution l'étiquette du contexte appelant (sync_to_async copie le contexte)"""
+	def wrapper(*args, **kwargs):
+		with label(current_label.get()):
+			return func(*args, **kwargs)
+	return wrapper
+
+
+class ProfiledConsumerMixin:
+	"""Étiquette `ws:<type>` pour chaque événement traité par un consumer"""
+
+	async def dispatch(self, message):
+		with label(f"ws:{message['type']}"):
+			return await super().dispatch(message)
+
+
+def request_label(request):
+	name = endpoint_name(request)
+	return f"http:{name}" if name is not None else None
+
+
+class ProfileLabelMiddleware:
+	"""Étiquette `http` pour toute la requête ; celles des vues, plus internes, l'emportent.
+
+	À placer en tête de MIDDLEWARE pour que le temps des middlewares soit attribué.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if iscoroutinefunction(get_response):
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall__(request)
+		with label("http"):
+			return self.get_response(request)
+
+	async def __acall__(self, request):
+		with label("http"):
+			return await self.get_response(request)
+
+
+class ProfiledViewMixin:
+	"""Étiquette `http:<nom d'URL>` pour chaque action d'un ViewSet DRF"""
+
+	def dispatch(self, request, *args, **kwargs):
+		with label(request_label(request)):
+			return super().dispatch(request, *args, **kwargs)
+
+
+class Sampler:
+	def __init__(self, interval, idle=False):
+		self.interval = interval
+		self.idle = idle
+		self.stacks = Counter()
+		self.samples = 0
+		self._names = {}
+
+	def frame_name(self, frame):
+		code = frame.f_code
+		name = self._names.get(code)
+		if name is None:
+			name = f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+			self._names[code] = name
+		return name
+
+	def sample(self, frames, skip):
+		threads = {thread.ident: thread.name for thread in threading.enumerate()}
+		for ident, frame in frames.items():
+			if ident == skip:
+				continue
+			names = []
+			activity = None
+			while frame is not None:
+				names.append(self.frame_name(frame))
+				if activity is None:
+					# L'étiquette la plus interne l'emporte (hop base dans un événement...)
+					activity = _labels.get(frame)
+				frame = frame.f_back
+			if not self.idle and names[0] in IDLE_LEAVES:
+				continue
+			names.append(activity or f"thread:{threads.get(ident, ident)}")
+			self.stacks[";".join(reversed(names))] += 1
+		self.samples += 1
+
+	def run(self, seconds):
+		"""Relevés par ce thread, toutes les `interval` secondes de temps réel.
+
+		Biaisé : le relevé n'a lieu que quand un autre thread libère le GIL, ce que
+		la boucle asyncio fait surtout dans son sélecteur, donc quand elle est inactive.
+		"""
+		own_ident = threading.get_ident()
+		deadline = time.monotonic() + seconds
+		next_sample = time.monotonic()
+		while next_sample < deadline:
+			self.sample(sys._current_frames(), own_ident)
+			next_sample += self.interval
+			delay = next_sample - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				# Échantillonnage en retard (GIL disputé) : on ne rattrape pas
+				next_sample = time.monotonic()
+		return self
+
+	def run_on_signal(self, seconds):
+		"""Relevés sur SIGPROF, toutes les `interval` secondes de CPU consommé par le processus.
+
+		Le gestionnaire s'exécute dans le thread principal (boucle d'événements du
+		worker) entre deux instructions Python : sa pile est relevée là où le CPU
+		est réellement dépensé, et une boucle inactive ne coûte aucun relevé.
+		"""
+		global _signal_sampler
+		self.skip = threading.get_ident()
+		_signal_sampler = self
+		signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+		try:
+			time.sleep(seconds)
+		finally:
+			signal.setitimer(signal.ITIMER_PROF, 0)
+			_signal_sampler = None
+		return self
+
+
+_lock = threading.Lock()
+_signal_sampler = None
+
+
+def _on_sigprof(signum, frame):
+	sampler = _signal_sampler
+	if sampler is not None:
+		frames = sys._current_frames()
+		# Pile interrompue du thread principal, et non celle de ce gestionnaire
+		frames[threading.main_thread().ident] = frame
+		sampler.sample(frames, sampler.skip)
+
+
+def profile(seconds, interval=None, idle=False):
+	"""Échantillonner le processus courant pendant `seconds` secondes (bloquant) ; un seul profil à la fois"""
+	seconds = min(float(seconds), settings.CHAT_PROFILE_MAX_SECONDS)
+	interval = (interval or settings.CHAT_PROFILE_INTERVAL_MS) / 1000
+	if not _lock.acquire(blocking=False):
+		raise ProfilerBusy("Un profil est déjà en cours dans ce processus")
+	try:
+		sampler = Sampler(interval, idle)
+		if signal.getsignal(signal.SIGPROF) is _on_sigprof:
+			return sampler.run_on_signal(seconds)
+		return sampler.run(seconds)
+	finally:
+		_lock.release()
+
+
+def collapsed(stacks, prefix=None):
+	"""Piles au format collapsed, les plus fréquentes d'abord"""
+	head = f"{prefix};" if prefix else ""
+	return "".join(f"{head}{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Déclenchement par signal (workers de `runchat`) :
+#   <CHAT_PROFILE_DIR>/<pid>.pid      présent tant que le worker tourne
+#   <CHAT_PROFILE_DIR>/<pid>.request  paramètres (JSON), écrit avant SIGUSR2
+#   <CHAT_PROFILE_DIR>/<pid>.folded   résultat, écrit à la fin du profil
+
+def _path(pid, suffix):
+	return os.path.join(settings.CHAT_PROFILE_DIR, f"{pid}.{suffix}")
+
+
+def _profile_to_file(pid, options):
+	result = _path(pid, "folded")
+	try:
+		sampler = profile(options.get("seconds", 10), options.get("interval_ms"), options.get("idle", False))
+	except ProfilerBusy:
+		logger.warning("Profil demandé alors qu'un autre est en cours (pid %s)", pid)
+		return
+	with open(result + ".tmp", "w") as output:
+		output.write(collapsed(sampler.stacks))
+	# Remplacement atomique : le lecteur ne voit jamais un fichier partiel
+	os.replace(result + ".tmp", result)
+	logger.info("Profil écrit dans %s (%d échantillons)", result, sampler.samples)
+
+
+def _on_profile_signal(signum, frame):
+	pid = os.getpid()
+	try:
+		with open(_path(pid, "request")) as request:
+			options = json.load(request)
+		os.unlink(_path(pid, "request"))
+	except (OSError, ValueError):
+		options = {}
+	threading.Thread(target=_profile_to_file, args=(pid, options), name="chat-profiler", daemon=True).start()
+
+
+def install_signal_handler():
+	"""Rendre le processus courant profilable par `profile_chat` (SIGUSR2)"""
+	os.makedirs(settings.CHAT_PROFILE_DIR, exist_ok=True)
+	pid_file = _path(os.getpid(), "pid")
+	with open(pid_file, "w") as output:
+		output.write(" ".join(sys.argv))
+	signal.signal(signal.SIGUSR2, _on_profile_signal)
+	# Sans minuterie armée, SIGPROF n'est jamais émis : aucun coût hors profil
+	signal.signal(signal.SIGPROF, _on_sigprof)
+	return pid_file
+
+
+def remove_signal_handler(pid_file):
+	signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+	signal.signal(signal.SIGPROF, signal.SIG_DFL)
+	try:
+		os.unlink(pid_file)
+	except OSError:
+		pass
@@ -0,0 +1,162 @@
+"""Budgets de requêtes SQL par endpoint et par événement WebSocket.
+
+Chaque requête HTTP (middleware) ou événement de consumer (mixin) est mesuré :
+nombre de requêtes SQL et temps passé en base, y compris dans les threads
+de `sync_to_async` / `chat.db` (le recorder suit le contexte, pas le thread).
+Le résultat est comparé à `CHAT_QUERY_BUDGETS` :
+
+- clé : nom d'URL (`conversation-list`, `conversation-messages`...) ou
+  `ws:<type d'événement>` (`ws:websocket.receive`...) ; `default` pour le reste ;
+- valeur : nombre maximal de requêtes, ou `{"queries": n, "time_ms": t}`.
+
+`CHAT_QUERY_BUDGET_MODE` : `off` (aucune mesure), `warn` (log) ou `raise`
+(exception `QueryBudgetExceeded`, pour les tests).
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("chat_query_recorder", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+	pass
+
+
+class QueryRecorder:
+	def __init__(self, parent=None):
+		self.parent = parent
+		self.queries = []  # (sql, durée en secondes)
+
+	@property
+	def count(self):
+		return len(self.queries)
+
+	@property
+	def time_ms(self):
+		return sum(duration for _, duration in self.queries) * 1000
+
+	def add(self, sql, duration):
+		self.queries.append((sql, duration))
+		# Mesures imbriquées (test autour du middleware) : le parent voit tout
+		if self.parent is not None:
+			self.parent.add(sql, duration)
+
+
+def enabled():
+	return settings.CHAT_QUERY_BUDGET_MODE != "off"
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+	recorder = _current.get()
+	if recorder is None:
+		return execute(sql, params, many, context)
+	start = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		recorder.add(sql, time.perf_counter() - start)
+
+
+def install(connection):
+	"""Brancher la mesure sur une connexion (appelé à chaque connexion ouverte)"""
+	if enabled() and _execute_wrapper not in connection.execute_wrappers:
+		connection.execute_wrappers.append(_execute_wrapper)
+
+
+@contextmanager
+def record():
+	recorder = QueryRecorder(parent=_current.get())
+	token = _current.set(recorder)
+	try:
+		yield recorder
+	finally:
+		_current.reset(token)
+
+
+def get_budget(name):
+	"""(requêtes max, temps max en ms ou None) pour un endpoint ou un événement"""
+	budgets = settings.CHAT_QUERY_BUDGETS
+	budget = budgets.get(name, budgets.get("default"))
+	if budget is None:
+		return None, None
+	if isinstance(budget, int):
+		return budget, None
+	return budget.get("queries"), budget.get("time_ms")
+
+
+def check(name, recorder, mode=None):
+	"""Comparer une mesure au budget ; renvoie le message de dépassement ou None"""
+	mode = mode or settings.CHAT_QUERY_BUDGET_MODE
+	max_queries, max_time_ms = get_budget(name)
+	problems = []
+	if max_queries is not None and recorder.count > max_queries:
+		problems.append(f"{recorder.count} requêtes (budget {max_queries})")
+	if max_time_ms is not None and recorder.time_ms > max_time_ms:
+		problems.append(f"{recorder.time_ms:.1f} ms (budget {max_time_ms} ms)")
+	if not problems:
+		return None
+	message = f"Budget SQL dépassé pour {name} : " + ", ".join(problems)
+	if mode == "raise":
+		detail = "\n".join(f"  {sql}" for sql, _ in recorder.queries)
+		raise QueryBudgetExceeded(f"{message}\n{detail}")
+	logger.warning(message)
+	return message
+
+
+def endpoint_name(request):
+	match = getattr(request, "resolver_match", None)
+	return match.view_name if match is not None else None
+
+
+class QueryBudgetMiddleware:
+	"""Mesure chaque requête HTTP et la compare au budget de son nom d'URL.
+
+	À placer en dernier dans MIDDLEWARE : les requêtes de session et
+	d'utilisateur déclenchées par la vue (authentification DRF) sont comptées.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if iscoroutinefunction(get_response):
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall__(request)
+		with record() as recorder:
+			response = self.get_response(request)
+		return self._finish(request, response, recorder)
+
+	async def __acall__(self, request):
+		with record() as recorder:
+			response = await self.get_response(request)
+		return self._finish(request, response, recorder)
+
+	def _finish(self, request, response, recorder):
+		name = endpoint_name(request)
+		if name is not None:
+			check(name, recorder)
+		response["X-Query-Count"] = str(recorder.count)
+		response["X-Query-Time-Ms"] = f"{recorder.time_ms:.1f}"
+		return response
+
+
+class QueryBudgetConsumerMixin:
+	"""Mesure chaque événement traité par un consumer (`ws:<type>`)"""
+
+	async def dispatch(self, message):
+		if not enabled():
+			return await super().dispatch(message)
+		with record() as recorder:
+			result = await super().dispatch(message)
+		check(f"ws:{message['type']}", recorder)
+		return result
@@ -0,0 +1,50 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+from .codecs import MSGPACK_MEDIA_TYPE, json_dumps, json_loads, msgpack_dumps, msgpack_loads
+
+
+class FastJSONRenderer(BaseRenderer):
+	"""Rendu JSON compact via orjson (repli sur json standard)"""
+	media_type = "application/json"
+	format = "json"
+	charset = None
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		if data is None:
+			return b""
+		return json_dumps(data)
+
+
+class FastJSONParser(BaseParser):
+	media_type = "application/json"
+
+	def parse(self, stream, media_type=None, parser_context=None):
+		try:
+			return json_loads(stream.read())
+		except ValueError as exc:
+			raise ParseError(f"JSON parse error - {exc}")
+
+
+class MessagePackRenderer(BaseRenderer):
+	"""Rendu MessagePack, négocié via `Accept: application/msgpack`"""
+	media_type = MSGPACK_MEDIA_TYPE
+	format = "msgpack"
+	charset = None
+	render_style = "binary"
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		if data is None:
+			return b""
+		return msgpack_dumps(data)
+
+
+class MessagePackParser(BaseParser):
+	media_type = MSGPACK_MEDIA_TYPE
+
+	def parse(self, stream, media_type=None, parser_context=None):
+		try:
+			return msgpack_loads(stream.read())
+		except Exception as exc:
+			raise ParseError(f"MessagePack parse error - {exc}")
@@ -1,8 +1,50 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Prefetch
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from .models import Conversation, Membership, Message, Contact, GroupInvitation
 
 
+def requested_fields(request):
+	"""Liste des champs demandés via `?fields=a,b`, ou None"""
+	# Requête DRF (query_params) ou HttpRequest Django (GET) pour les vues asynchrones
+	params = getattr(request, "query_params", None) or getattr(request, "GET", None)
+	raw = params.get("fields") if params is not None else None
+	if not raw:
+		return None
+	return [f.strip() for f in raw.split(",") if f.strip()]
+
+
+class SparseFieldsMixin:
+	"""Sélection de champs clairsemée : `?fields=id,content` ou `fields=(...)` à l'instanciation.
+
+	La sélection ne porte que sur la sortie : les champs non demandés sont sautés par
+	`to_representation`, ce qui évite aussi leur coût de calcul (ex. `attachment_url`),
+	mais restent acceptés en écriture.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		self._sparse_fields = kwargs.pop("fields", None)
+		super().__init__(*args, **kwargs)
+
+	@cached_property
+	def _selected_fields(self):
+		# Résolue au premier rendu : le contexte d'un enfant (`many=True`) vient de son parent
+		fields = self._sparse_fields
+		if fields is None:
+			fields = requested_fields(self.context.get("request"))
+		return set(fields) if fields else None
+
+	@property
+	def _readable_fields(self):
+		# Champs parcourus par `to_representation`, et par lui seul
+		selected = self._selected_fields
+		for field in super()._readable_fields:
+			if selected is None or field.field_name in selected:
+				yield field
+
+
 class UserSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = get_user_model()
@@ -17,16 +59,43 @@ class MembershipSerializer(serializers.ModelSerializer):
 		fields = ("id", "user", "is_admin", "joined_at", "last_read_at")
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+def _members_preview_queryset(**filters):
+	return Membership.objects.filter(**filters).select_related("user").order_by("id")[:settings.CHAT_MEMBERS_PREVIEW_SIZE]
+
+
+class ConversationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+	"""Conversation avec le nombre de membres et un aperçu des premiers membres.
+
+	La liste complète est servie, paginée, par l'action `members/`.
+	"""
 	created_by = UserSerializer(read_only=True)
-	memberships = MembershipSerializer(many=True, read_only=True)
+	member_count = serializers.SerializerMethodField()
+	members_preview = serializers.SerializerMethodField()
 
 	class Meta:
 		model = Conversation
-		fields = ("id", "type", "name", "created_by", "created_at", "memberships")
+		fields = ("id", "type", "name", "created_by", "created_at", "member_count", "members_preview")
+
+	@staticmethod
+	def setup_queryset(queryset):
+		"""Charger `member_count` et `members_preview` pour toute la liste en deux requêtes"""
+		return queryset.select_related("created_by").annotate(member_count=Count("memberships")).prefetch_related(
+			Prefetch("memberships", queryset=_members_preview_queryset(), to_attr="members_preview")
+		)
+
+	# Repli pour une instance isolée (création) non passée par setup_queryset
+	def get_member_count(self, obj):
+		count = getattr(obj, "member_count", None)
+		return count if count is not None else obj.memberships.count()
+
+	def get_members_preview(self, obj):
+		preview = getattr(obj, "members_preview", None)
+		if preview is None:
+			preview = _members_preview_queryset(conversation=obj)
+		return MembershipSerializer(preview, many=True).data
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 	sender = UserSerializer(read_only=True)
 	sender_username = serializers.CharField(source='sender.username', read_only=True)
 	attachment = serializers.FileField(required=False, allow_null=True)
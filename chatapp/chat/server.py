@@ -0,0 +1,75 @@
+"""Worker daphne capable de s'arrêter sans couper les connexions en cours.
+
+Utilisé par la commande `runchat` : chaque worker reçoit le socket d'écoute
+déjà ouvert par le superviseur (descripteur hérité) et, sur SIGTERM :
+1. arrête d'accepter de nouvelles connexions (les autres workers continuent
+   d'accepter sur le même socket) ;
+2. demande aux WebSockets de chat de fermer avec un indice de reconnexion ;
+3. attend la fin des requêtes et messages en cours, au plus `drain_timeout`
+   secondes, puis s'arrête.
+
+Il accepte aussi la compression permessage-deflate proposée par les clients
+WebSocket (`ws_deflate`).
+"""
+import asyncio
+import logging
+import time
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.server import Server
+from twisted.internet import reactor
+
+from .draining import drain_consumers
+
+logger = logging.getLogger(__name__)
+
+
+def _accept_deflate(offers):
+	for offer in offers:
+		if isinstance(offer, PerMessageDeflateOffer):
+			return PerMessageDeflateOfferAccept(offer)
+	return None
+
+
+class DrainingServer(Server):
+	def __init__(self, *args, drain_timeout=30, ws_deflate=True, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.drain_timeout = drain_timeout
+		self.ws_deflate = ws_deflate
+		self.ports = []
+		self.draining = False
+		# Appelé par Server.run() une fois les factories créées, avant le démarrage du réacteur
+		self._ready_callable = self.ready_callable
+		self.ready_callable = self._on_ready
+
+	def _on_ready(self):
+		if self.ws_deflate:
+			self.ws_factory.setProtocolOptions(perMessageCompressionAccept=_accept_deflate)
+		if self._ready_callable:
+			self._ready_callable()
+
+	def listen_success(self, port):
+		self.ports.append(port)
+		super().listen_success(port)
+
+	def drain(self):
+		if self.draining:
+			return
+		self.draining = True
+		logger.info("Arrêt progressif du worker : plus de nouvelles connexions")
+		for port in self.ports:
+			port.stopListening()
+		asyncio.ensure_future(drain_consumers())
+		self._wait_for_connections(time.monotonic() + self.drain_timeout)
+
+	def _open_connections(self):
+		return [protocol for protocol, details in self.connections.items() if "disconnected" not in details]
+
+	def _wait_for_connections(self, deadline):
+		remaining = self._open_connections()
+		if remaining and time.monotonic() < deadline:
+			reactor.callLater(0.5, self._wait_for_connections, deadline)
+			return
+		if remaining:
+			logger.warning("%d connexions encore ouvertes à l'expiration du délai, arrêt forcé", len(remaining))
+		self.stop()
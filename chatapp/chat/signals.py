@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import querybudget
+from .membership_cache import invalidate_after_commit
+from .message_cache import invalidate_after_commit as invalidate_messages_after_commit, recent_messages
+from .models import Conversation, Membership, Message
+from .ws_auth import revoke_tokens
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+	# Les créations sont ajoutées explicitement au cache par les chemins d'envoi ;
+	# une modification (ex. depuis l'admin) rend la liste pré-sérialisée obsolète.
+	if not created:
+		recent_messages.invalidate(instance.conversation_id)
+
+
+# Pas de post_delete sur Message : il empêcherait la suppression rapide (un DELETE par lot) des
+# messages en cascade. Les suppressions invalident par conversation : ci-dessous pour les cascades,
+# dans MessageAdmin pour les suppressions directes.
+@receiver(pre_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+	invalidate_messages_after_commit([instance.pk])
+
+
+@receiver(pre_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+	# Ses messages partent en cascade : conversations relevées avant la suppression
+	invalidate_messages_after_commit(
+		Message.objects.filter(sender=instance).order_by().values_list("conversation_id", flat=True).distinct()
+	)
+
+
+# bulk_create et update() n'envoient pas ces signaux : ces chemins invalident eux-mêmes
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def membership_changed(sender, instance, **kwargs):
+	invalidate_after_commit([instance.user_id])
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+	querybudget.install(connection)
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, request, user, **kwargs):
+	if user is not None:
+		revoke_tokens(user.id)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+	# Mot de passe, désactivation... : les jetons WebSocket émis ne valent plus.
+	# La mise à jour de last_login à chaque connexion n'en révoque aucun.
+	if not created and not (update_fields and set(update_fields) <= {"last_login"}):
+		revoke_tokens(instance.pk)
@@ -0,0 +1,12 @@
+'use strict';
+{
+	// Filtre autocomplete de la liste admin : recharger la liste avec la valeur choisie
+	django.jQuery(document).on('change', '.chat-autocomplete-filter select', function() {
+		const container = this.closest('.chat-autocomplete-filter');
+		const params = new URLSearchParams(container.dataset.queryString);
+		if (this.value) {
+			params.set(this.name, this.value);
+		}
+		window.location.search = params.toString();
+	});
+}
@@ -0,0 +1,820 @@
+// Utilisateur connecté, fourni par le gabarit (attributs data- de <body>)
+const CURRENT_USER_ID = Number(document.body.dataset.userId);
+const CURRENT_USERNAME = document.body.dataset.username;
+
+let currentConversation = null;
+let ws = null;
+let unreadCounts = {};
+
+// Récupérer le token CSRF
+let csrfToken = null;
+
+async function getCSRFToken() {
+    if (csrfToken) return csrfToken;
+    
+    try {
+        const res = await fetch('/api/csrf-token/');
+        const data = await res.json();
+        csrfToken = data.csrfToken;
+        return csrfToken;
+    } catch (error) {
+        console.error('Erreur lors de la récupération du token CSRF:', error);
+        return null;
+    }
+}
+
+// Headers par défaut avec CSRF
+async function getHeaders() {
+    const token = await getCSRFToken();
+    return {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': token
+    };
+}
+
+// État de la colonne de gauche (rail + channels)
+let currentServer = 'direct'; // 'menus' | 'direct' | 'groups'
+function selectServer(kind) {
+    currentServer = kind;
+    document.querySelectorAll('.server-bubble').forEach(b => b.classList.remove('active'));
+    if (kind === 'menus') document.getElementById('server-menu').classList.add('active');
+    if (kind === 'direct') document.getElementById('server-direct').classList.add('active');
+    if (kind === 'groups') document.getElementById('server-groups').classList.add('active');
+    renderChannels();
+}
+
+// Charger les conversations
+async function loadConversations() {
+    try {
+        const headers = await getHeaders();
+        const [directRes, groupRes] = await Promise.all([
+            fetch('/api/conversations/by-type/?type=direct', {
+                headers: headers
+            }),
+            fetch('/api/conversations/by-type/?type=group', {
+                headers: headers
+            })
+        ]);
+        
+        const directConvs = await directRes.json();
+        const groupConvs = await groupRes.json();
+        
+        window.__directConvs = directConvs;
+        window.__groupConvs = groupConvs;
+        renderChannels();
+        
+        // Charger aussi les contacts pour la liste déroulante
+        loadContactsForDropdown();
+        // Charger les groupes et contacts pour l'invitation aux groupes
+        loadGroupsForInvite();
+        loadContactsForGroupInvite();
+    } catch (error) {
+        showNotification('Erreur lors du chargement des conversations', 'error');
+    }
+}
+
+function renderChannels() {
+    const list = document.getElementById('channel-list');
+    const actions = document.getElementById('channels-actions');
+    const title = document.getElementById('channels-title');
+    list.innerHTML = '';
+    actions.innerHTML = '';
+    if (currentServer === 'menus') {
+        title.textContent = 'Menus';
+        // Menus: Contacts + Invitations
+        const menus = [
+            { id: 'menu-contacts', label: 'Contacts', onClick: () => loadContactsPanel() },
+            { id: 'menu-invitations', label: 'Invitations', onClick: () => loadInvitationsPanel() }
+        ];
+        menus.forEach(menu => {
+            const item = document.createElement('div');
+            item.className = 'channel-item';
+            item.textContent = menu.label;
+            item.onclick = menu.onClick;
+            list.appendChild(item);
+        });
+    } else if (currentServer === 'direct') {
+        title.textContent = 'Conversations privées';
+        (window.__directConvs || []).forEach(conv => {
+            const otherUser = conv.members_preview?.find(m => m.user.id !== CURRENT_USER_ID)?.user;
+            const displayName = otherUser ? otherUser.username : `Direct ${conv.id}`;
+            const item = document.createElement('div');
+            item.className = 'channel-item';
+            item.innerHTML = `<span>@ ${displayName}</span><span class="badge" id="badge-${conv.id}" style="display:none;">0</span>`;
+            item.onclick = () => openChat(conv.id, displayName);
+            list.appendChild(item);
+        });
+        // Action: créer direct
+        const actionsHtml = `
+            <div style="display:flex; gap:8px; align-items:center;">
+                <select id="contact-select" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                    <option value="">-- Choisir un contact --</option>
+                </select>
+                <button class="btn" onclick="createDirectFromContact()">Créer</button>
+            </div>`;
+        actions.innerHTML = actionsHtml;
+    } else if (currentServer === 'groups') {
+        title.textContent = 'Groupes';
+        (window.__groupConvs || []).forEach(conv => {
+            const displayName = conv.name || `Groupe ${conv.id}`;
+            const item = document.createElement('div');
+            item.className = 'channel-item';
+            item.innerHTML = `<span># ${displayName}</span><span class="badge" id="badge-${conv.id}" style="display:none;">0</span>`;
+            item.onclick = () => openChat(conv.id, displayName);
+            list.appendChild(item);
+        });
+        const actionsHtml = `
+            <div style="display:flex; flex-direction:column; gap:8px;">
+                <div style="display:flex; gap:8px;">
+                    <input type="text" id="group-name" placeholder="Nom du groupe" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                    <button class="btn" onclick="createGroupConversation()">Créer</button>
+                </div>
+                <div style="display:flex; gap:8px;">
+                    <select id="group-select" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                        <option value="">-- Choisir un groupe --</option>
+                    </select>
+                    <select id="group-invite-select" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                        <option value="">-- Choisir un contact --</option>
+                    </select>
+                    <input type="text" id="group-invite-username" placeholder="Ou nom d'utilisateur" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                    <button class="btn" onclick="inviteToGroup()">Inviter</button>
+                </div>
+            </div>`;
+        actions.innerHTML = actionsHtml;
+    }
+}
+
+// Charger les contacts
+async function loadContacts() {
+    try {
+        const headers = await getHeaders();
+        const [pendingRes, acceptedRes] = await Promise.all([
+            fetch('/api/contacts/pending/', {
+                headers: headers
+            }),
+            fetch('/api/contacts/accepted/', {
+                headers: headers
+            })
+        ]);
+        
+        const pendingContacts = await pendingRes.json();
+        const acceptedContacts = await acceptedRes.json();
+        
+        displayPendingContacts(pendingContacts);
+        displayAcceptedContacts(acceptedContacts);
+    } catch (error) {
+        showNotification('Erreur lors du chargement des contacts', 'error');
+    }
+}
+
+function displayPendingContacts(contacts) {
+    const container = document.getElementById('pending-contacts');
+    container.innerHTML = '';
+    
+    contacts.forEach(contact => {
+        const div = document.createElement('div');
+        div.className = 'list-item';
+        div.innerHTML = `
+            <span>Demande de ${contact.from_user.username}</span>
+            <div>
+                <button class="btn btn-success" onclick="respondToContact(${contact.id}, 'accepted')">Accepter</button>
+                <button class="btn btn-danger" onclick="respondToContact(${contact.id}, 'blocked')">Refuser</button>
+            </div>
+        `;
+        container.appendChild(div);
+    });
+}
+
+function displayAcceptedContacts(contacts) {
+    const container = document.getElementById('accepted-contacts');
+    container.innerHTML = '';
+    
+    contacts.forEach(contact => {
+        const div = document.createElement('div');
+        div.className = 'list-item';
+        const otherUser = contact.from_user.username === CURRENT_USERNAME ? contact.to_user.username : contact.from_user.username;
+        div.innerHTML = `
+            <span>${otherUser}</span>
+            <div>
+                <button class="btn btn-danger" onclick="deleteContact(${contact.id})" style="background-color: #dc3545; color: white; padding: 4px 8px; font-size: 12px;">Supprimer</button>
+            </div>
+        `;
+        container.appendChild(div);
+    });
+}
+
+// Charger les invitations
+async function loadInvitations() {
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/group-invitations/pending/', {
+            headers: headers
+        });
+        const invitations = await res.json();
+        
+        displayInvitations(invitations);
+    } catch (error) {
+        showNotification('Erreur lors du chargement des invitations', 'error');
+    }
+}
+
+function displayInvitations(invitations) {
+    const container = document.getElementById('pending-invitations');
+    container.innerHTML = '';
+    
+    invitations.forEach(invitation => {
+        const div = document.createElement('div');
+        div.className = 'list-item';
+        div.innerHTML = `
+            <span>Invitation dans "${invitation.conversation.name}" de ${invitation.from_user.username}</span>
+            <div>
+                <button class="btn btn-success" onclick="respondToInvitation(${invitation.id}, 'accepted')">Accepter</button>
+                <button class="btn btn-danger" onclick="respondToInvitation(${invitation.id}, 'declined')">Refuser</button>
+            </div>
+        `;
+        container.appendChild(div);
+    });
+}
+
+// Fonctions de contact
+async function sendContactRequest() {
+    const username = document.getElementById('contact-username').value;
+    if (!username) return;
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/contacts/send-request/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({username})
+        });
+        
+        if (res.ok) {
+            showNotification('Demande envoyée !', 'success');
+            document.getElementById('contact-username').value = '';
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de l\'envoi', 'error');
+    }
+}
+
+async function deleteContact(contactId) {
+    if (!confirm('Êtes-vous sûr de vouloir supprimer ce contact ?')) {
+        return;
+    }
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch(`/api/contacts/${contactId}/delete/`, {
+            method: 'DELETE',
+            headers: headers
+        });
+        
+        if (res.ok) {
+            showNotification('Contact supprimé !', 'success');
+            // Recharger la liste des contacts
+            loadContacts();
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de la suppression', 'error');
+    }
+}
+
+async function respondToContact(contactId, status) {
+    try {
+        const headers = await getHeaders();
+        // Mapper les statuts aux URLs correctes
+        const actionMap = {
+            'accepted': 'accept',
+            'blocked': 'decline'
+        };
+        const action = actionMap[status] || status;
+        const res = await fetch(`/api/contacts/${contactId}/${action}/`, {
+            method: 'POST',
+            headers: headers
+        });
+        
+        if (res.ok) {
+            showNotification('Action effectuée !', 'success');
+            loadContacts();
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur', 'error');
+    }
+}
+
+// Fonctions d'invitation
+async function respondToInvitation(invitationId, status) {
+    try {
+        const headers = await getHeaders();
+        // Mapper les statuts aux URLs correctes
+        const actionMap = {
+            'accepted': 'accept',
+            'declined': 'decline'
+        };
+        const action = actionMap[status] || status;
+        const res = await fetch(`/api/group-invitations/${invitationId}/${action}/`, {
+            method: 'POST',
+            headers: headers
+        });
+        
+        if (res.ok) {
+            showNotification('Action effectuée !', 'success');
+            loadInvitations();
+            loadConversations(); // Recharger les conversations
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur', 'error');
+    }
+}
+
+// Fonctions de conversation
+async function createDirectConversation() {
+    const username = document.getElementById('direct-username').value;
+    if (!username) return;
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/conversations/create-direct-by-username/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({username})
+        });
+        
+        if (res.ok) {
+            showNotification('Conversation créée !', 'success');
+            document.getElementById('direct-username').value = '';
+            loadConversations();
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de la création', 'error');
+    }
+}
+
+async function createGroupConversation() {
+    const name = document.getElementById('group-name').value;
+    if (!name) return;
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/conversations/create-group/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({name})
+        });
+        
+        if (res.ok) {
+            showNotification('Groupe créé !', 'success');
+            document.getElementById('group-name').value = '';
+            loadConversations();
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de la création', 'error');
+    }
+}
+
+// Jeton WebSocket : authentifie les (re)connexions sans lecture de session côté serveur
+let wsToken = null, wsTokenExpiresAt = 0;
+async function getWsToken() {
+    if (!wsToken || Date.now() > wsTokenExpiresAt) {
+        try {
+            const res = await fetch('/api/ws-token/', { headers: await getHeaders() });
+            const data = await res.json();
+            wsToken = data.token;
+            // Marge d'une minute avant l'expiration côté serveur
+            wsTokenExpiresAt = Date.now() + (data.expires_in - 60) * 1000;
+        } catch (error) {
+            wsToken = null;  // repli sur le cookie de session
+        }
+    }
+    return wsToken;
+}
+
+// Fonctions de chat
+async function openChat(conversationId, title) {
+    currentConversation = conversationId;
+    document.getElementById('main-title').textContent = title;
+    
+    // Fermer la connexion WebSocket précédente
+    if (ws) {
+        ws.close();
+    }
+    
+    // Nouvelle connexion WebSocket
+    const protocol = window.location.protocol === "https:" ? "wss" : "ws";
+    // batch=1 : les rafales de messages arrivent regroupées en une trame (tableau)
+    const token = await getWsToken();
+    if (currentConversation !== conversationId) return;
+    const tokenParam = token ? `&token=${encodeURIComponent(token)}` : '';
+    ws = new WebSocket(`${protocol}://${window.location.host}/ws/chat/${conversationId}/?batch=1${tokenParam}`);
+    let reconnectDelay = null;
+    
+    ws.onopen = () => {
+        console.log('Connecté au chat');
+        loadMessages();
+    };
+    
+    ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (Array.isArray(data)) {
+            data.forEach(item => displayMessage(item.message));
+        } else if (data.reconnect) {
+            reconnectDelay = data.reconnect.retry_after_ms;
+        } else if (data.message) {
+            displayMessage(data.message);
+        } else if (data.event && data.event.type === 'members_joined') {
+            const names = data.event.users.map(u => u.username).join(', ');
+            showNotification(`${names} a rejoint la conversation`, 'info');
+        } else if (data.error) {
+            showNotification(data.error, 'error');
+        }
+    };
+    
+    ws.onclose = (event) => {
+        console.log('Déconnecté du chat');
+        // Redémarrage du serveur (1012) : reconnexion après un délai aléatoire pour étaler la charge
+        if (event.code === 1012 && currentConversation === conversationId) {
+            const delay = reconnectDelay ?? Math.random() * 5000;
+            setTimeout(() => {
+                if (currentConversation === conversationId) openChat(conversationId, title);
+            }, delay);
+        }
+    };
+}
+
+function closeChat() {
+    if (ws) { ws.close(); ws = null; }
+    currentConversation = null;
+    document.getElementById('main-title').textContent = 'Sélectionnez une conversation';
+    document.getElementById('chat-messages').innerHTML = '';
+}
+
+async function loadMessages() {
+    try {
+        const headers = await getHeaders();
+        const res = await fetch(`/api/conversations/${currentConversation}/messages/`, {
+            headers: headers
+        });
+        const messages = await res.json();
+        
+    const container = document.getElementById('chat-messages');
+        container.innerHTML = '';
+        messages.forEach(msg => displayMessage(msg));
+    } catch (error) {
+        showNotification('Erreur lors du chargement des messages', 'error');
+    }
+}
+
+function isImageFile(filename) {
+    if (!filename) return false;
+    const lower = filename.toLowerCase();
+    return [".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".svg"].some(ext => lower.endsWith(ext));
+}
+
+function displayMessage(msg) {
+    const container = document.getElementById('chat-messages');
+    const div = document.createElement('div');
+    const senderId = (msg.sender && typeof msg.sender === 'object' && msg.sender.id) ? msg.sender.id : (typeof msg.sender === 'number' ? msg.sender : null);
+    const isOwn = senderId === CURRENT_USER_ID;
+    div.className = `message ${isOwn ? 'own' : 'other'}`;
+    
+    // Gérer l'affichage du nom d'utilisateur
+    let senderName = 'Utilisateur';
+    if (msg.sender_username) {
+        senderName = msg.sender_username;
+    } else if (msg.sender && typeof msg.sender === 'object' && msg.sender.username) {
+        senderName = msg.sender.username;
+    } else if (msg.sender && typeof msg.sender === 'string') {
+        senderName = msg.sender;
+    }
+    
+    let attachmentHtml = '';
+    const url = msg.attachment_url;
+    if (url) {
+        if (isImageFile(url)) {
+            attachmentHtml = `<div style="margin-top:6px;"><img src="${url}" alt="fichier" style="max-width: 320px; border-radius: 6px;" /></div>`;
+        } else {
+            const filename = url.split('/').pop();
+            attachmentHtml = `<div style="margin-top:6px;"><a href="${url}" target="_blank" download rel="noopener">📎 Télécharger ${filename}</a></div>`;
+        }
+    }
+
+    div.innerHTML = `
+        <strong>${senderName}:</strong> ${msg.content || ''}
+        ${attachmentHtml}
+        <br><small>${new Date(msg.created_at).toLocaleTimeString()}</small>
+    `;
+    container.appendChild(div);
+    container.scrollTop = container.scrollHeight;
+}
+
+async function sendMessage() {
+    const input = document.getElementById('message-input');
+    const fileInput = document.getElementById('file-input');
+    const message = (input.value || '').trim();
+    const file = fileInput.files && fileInput.files[0] ? fileInput.files[0] : null;
+
+    if (!currentConversation) return;
+
+    // Si un fichier est présent, on utilise l'API REST (multipart)
+    if (file) {
+        try {
+            const token = await getCSRFToken();
+            const form = new FormData();
+            form.append('content', message);
+            form.append('attachment', file);
+            const res = await fetch(`/api/conversations/${currentConversation}/send/`, {
+                method: 'POST',
+                headers: { 'X-CSRFToken': token },
+                body: form
+            });
+            if (!res.ok) {
+                const err = await res.json().catch(() => ({}));
+                showNotification(err.detail || 'Erreur envoi du fichier', 'error');
+                return;
+            }
+            // La diffusion temps réel arrivera via WebSocket (broadcast côté serveur)
+            input.value = '';
+            fileInput.value = '';
+        } catch (e) {
+            showNotification('Erreur réseau lors de l\'upload', 'error');
+        }
+        return;
+    }
+
+    // Sinon, on garde le flux WebSocket pour le texte seul
+    if (!message || !ws || ws.readyState !== WebSocket.OPEN) return;
+    ws.send(JSON.stringify({message}));
+    input.value = '';
+}
+
+function handleKeyPress(event) {
+    if (event.key === 'Enter') {
+        sendMessage();
+    }
+}
+
+function showNotification(message, type) {
+    const notification = document.getElementById('notification');
+    notification.textContent = message;
+    notification.className = `notification ${type}`;
+    notification.style.display = 'block';
+    
+    setTimeout(() => {
+        notification.style.display = 'none';
+    }, 3000);
+}
+
+// Récupérer le token CSRF au chargement
+document.addEventListener('DOMContentLoaded', function() {
+    getCSRFToken();
+    loadConversations();
+    syncChanges();
+});
+
+// Retour au premier plan : une seule requête pour savoir ce qui a changé
+let syncWatermark = null;
+let syncConversationIds = null;
+async function syncChanges() {
+    try {
+        const headers = await getHeaders();
+        const initial = syncWatermark === null;
+        let changed = false, currentHasNew = false, data;
+        do {
+            const query = syncWatermark ? `?since=${encodeURIComponent(syncWatermark)}` : '';
+            const res = await fetch(`/api/sync/${query}`, { headers: headers });
+            if (!res.ok) return;
+            data = await res.json();
+            syncWatermark = data.watermark;
+            if (data.messages.some(msg => msg.conversation === currentConversation)) currentHasNew = true;
+            if (data.memberships.length || data.contacts.length || data.invitations.length) changed = true;
+        } while (data.has_more);
+
+        const ids = data.conversation_ids.slice().sort().join(',');
+        if (syncConversationIds !== null && ids !== syncConversationIds) changed = true;
+        syncConversationIds = ids;
+        if (initial) return;
+        if (changed) loadConversations();
+        if (currentHasNew) loadMessages();
+    } catch (error) {
+        console.log('Synchronisation impossible', error);
+    }
+}
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') syncChanges();
+});
+
+// Panneaux menus -> affichage dans la zone principale
+function loadContactsPanel() {
+    document.getElementById('main-title').textContent = 'Contacts';
+    const container = document.getElementById('chat-messages');
+    container.innerHTML = '';
+    // Récupérer et afficher
+    loadContacts().then(() => {
+        const pending = document.getElementById('pending-contacts');
+        const accepted = document.getElementById('accepted-contacts');
+    });
+    // Construire un mini rendu simple ici
+    container.innerHTML = `
+        <div>
+            <h3>Demandes reçues</h3>
+            <div id="pending-contacts" class="messages"></div>
+            <h3>Mes contacts</h3>
+            <div id="accepted-contacts" class="messages"></div>
+            <div style="display:flex; gap:8px; margin-top:12px;">
+                <input type="text" id="contact-username" placeholder="Nom d'utilisateur" style="flex:1; background:#1e1f22; color:#e3e5e8; border:1px solid #3a3c41; border-radius:8px; padding:8px;">
+                <button class="btn" onclick="sendContactRequest()">Ajouter</button>
+            </div>
+        </div>`;
+}
+
+function loadInvitationsPanel() {
+    document.getElementById('main-title').textContent = 'Invitations de groupe';
+    const container = document.getElementById('chat-messages');
+    container.innerHTML = `
+        <div>
+            <div id="pending-invitations" class="messages"></div>
+        </div>`;
+    loadInvitations();
+}
+// Fonctions pour la liste déroulante des contacts
+async function loadContactsForDropdown() {
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/contacts/accepted/', {
+            headers: headers
+        });
+        
+        if (res.ok) {
+            const contacts = await res.json();
+            const select = document.getElementById('contact-select');
+            select.innerHTML = '<option value="">-- Choisir un contact --</option>';
+            
+            contacts.forEach(contact => {
+                const option = document.createElement('option');
+                option.value = contact.to_user.username;
+                option.textContent = contact.to_user.username;
+                select.appendChild(option);
+            });
+        }
+    } catch (error) {
+        console.error('Erreur lors du chargement des contacts:', error);
+    }
+}
+
+// Fonction pour charger les groupes pour l'invitation
+async function loadGroupsForInvite() {
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/conversations/by-type/?type=group', {
+            headers: headers
+        });
+        
+        if (res.ok) {
+            const groups = await res.json();
+            const select = document.getElementById('group-select');
+            select.innerHTML = '<option value="">-- Choisir un groupe --</option>';
+            
+            groups.forEach(group => {
+                const option = document.createElement('option');
+                option.value = group.id;
+                option.textContent = group.name;
+                select.appendChild(option);
+            });
+        }
+    } catch (error) {
+        console.error('Erreur lors du chargement des groupes:', error);
+    }
+}
+
+// Fonction pour charger les contacts pour l'invitation aux groupes
+async function loadContactsForGroupInvite() {
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/contacts/accepted/', {
+            headers: headers
+        });
+        
+        if (res.ok) {
+            const contacts = await res.json();
+            const select = document.getElementById('group-invite-select');
+            select.innerHTML = '<option value="">-- Choisir un contact --</option>';
+            
+            contacts.forEach(contact => {
+                const option = document.createElement('option');
+                option.value = contact.to_user.username;
+                option.textContent = contact.to_user.username;
+                select.appendChild(option);
+            });
+        }
+    } catch (error) {
+        console.error('Erreur lors du chargement des contacts:', error);
+    }
+}
+
+function selectContact() {
+    const select = document.getElementById('contact-select');
+    const usernameInput = document.getElementById('direct-username');
+    if (select.value) {
+        usernameInput.value = select.value;
+    }
+}
+
+async function createDirectFromContact() {
+    const select = document.getElementById('contact-select');
+    if (!select.value) {
+        showNotification('Veuillez sélectionner un contact', 'error');
+        return;
+    }
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/conversations/create-direct-by-username/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ username: select.value })
+        });
+        
+        if (res.ok) {
+            const conversation = await res.json();
+            showNotification('Conversation créée !', 'success');
+            loadConversations();
+            select.value = ''; // Reset selection
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de la création', 'error');
+    }
+}
+
+// Fonction pour inviter des utilisateurs aux groupes
+async function inviteToGroup() {
+    const groupSelect = document.getElementById('group-select');
+    const contactSelect = document.getElementById('group-invite-select');
+    const usernameInput = document.getElementById('group-invite-username');
+    
+    const groupId = groupSelect.value;
+    const username = contactSelect.value || usernameInput.value;
+    
+    if (!groupId) {
+        showNotification('Veuillez sélectionner un groupe', 'error');
+        return;
+    }
+    
+    if (!username) {
+        showNotification('Veuillez sélectionner un contact ou entrer un nom d\'utilisateur', 'error');
+        return;
+    }
+    
+    try {
+        const headers = await getHeaders();
+        const res = await fetch('/api/group-invitations/invite/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ 
+                username: username,
+                conversation_id: groupId
+            })
+        });
+        
+        if (res.ok) {
+            showNotification('Invitation envoyée !', 'success');
+            contactSelect.value = '';
+            usernameInput.value = '';
+        } else {
+            const error = await res.json();
+            showNotification(error.detail, 'error');
+        }
+    } catch (error) {
+        showNotification('Erreur lors de l\'envoi de l\'invitation', 'error');
+    }
+}
+// Helpers pour rafraîchir les sélecteurs quand nécessaire
+function refreshSelectors() {
+    if (currentServer === 'direct') {
+        loadContactsForDropdown();
+    } else if (currentServer === 'groups') {
+        loadGroupsForInvite();
+        loadContactsForGroupInvite();
+    }
+}
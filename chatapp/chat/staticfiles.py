@@ -0,0 +1,114 @@
+"""Fichiers statiques : noms hachés, variantes précompressées et cache longue durée.
+
+`collectstatic` (avec `CompressedManifestStaticFilesStorage`) écrit chaque
+fichier sous un nom contenant un hash de son contenu (`main.3f2a9c1b0d4e.js`),
+puis une variante `.gz` et, si le paquet `brotli` est installé, `.br` des
+fichiers texte.
+
+`StaticFilesHandler` sert STATIC_ROOT : variante compressée selon
+`Accept-Encoding`, et `Cache-Control: immutable` pour les noms hachés (leur
+contenu ne change jamais, un nouveau déploiement change le nom). Les autres
+fichiers sont revalidés à chaque chargement. Sans `collectstatic` (développement),
+les fichiers sont servis depuis les applications comme avant.
+"""
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+	import brotli
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".mjs", ".map", ".svg", ".html", ".txt", ".json", ".xml", ".ico"}
+# En dessous, l'en-tête Content-Encoding coûte plus que le gain
+MIN_COMPRESS_SIZE = 256
+
+# (encodage HTTP, suffixe), par ordre de préférence
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _compress_file(path):
+	with open(path, "rb") as source:
+		data = source.read()
+	if len(data) < MIN_COMPRESS_SIZE:
+		return
+	variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+	if brotli is not None:
+		variants.append((".br", brotli.compress(data, quality=11)))
+	for suffix, compressed in variants:
+		# Variante inutile si elle ne fait pas gagner au moins 5 %
+		if len(compressed) < len(data) * 0.95:
+			with open(path + suffix, "wb") as target:
+				target.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+	"""Stockage à noms hachés qui écrit aussi les variantes .gz / .br"""
+
+	def post_process(self, paths, dry_run=False, **options):
+		names = set()
+		for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+			if not isinstance(processed, Exception):
+				names.update((name, hashed_name))
+			yield name, hashed_name, processed
+		if dry_run:
+			return
+		for name in names:
+			if name and os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+				_compress_file(self.path(name))
+
+
+class StaticFilesHandler(ASGIStaticFilesHandler):
+	"""Sert STATIC_ROOT avec variantes précompressées et en-têtes de cache"""
+
+	@cached_property
+	def hashed_names(self):
+		return set(getattr(staticfiles_storage, "hashed_files", {}).values())
+
+	def serve(self, request):
+		name = self.file_path(request.path)
+		try:
+			path = safe_join(settings.STATIC_ROOT, name)
+		except SuspiciousFileOperation:
+			raise Http404(name)
+		if not os.path.isfile(path):
+			# Développement : fichiers des applications, sans collectstatic
+			return super().serve(request)
+
+		immutable = name in self.hashed_names
+		stat = os.stat(path)
+		if not immutable and not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime):
+			return HttpResponseNotModified()
+
+		accepted = request.headers.get("Accept-Encoding", "")
+		encoding, variant = None, path
+		for candidate, suffix in ENCODINGS:
+			if candidate in accepted and os.path.isfile(path + suffix):
+				encoding, variant = candidate, path + suffix
+				break
+
+		content_type, _ = mimetypes.guess_type(name)
+		response = FileResponse(
+			open(variant, "rb"), content_type=content_type or "application/octet-stream", filename=os.path.basename(name)
+		)
+		if encoding:
+			response["Content-Encoding"] = encoding
+		if encoding or os.path.isfile(path + ".gz"):
+			response["Vary"] = "Accept-Encoding"
+		response["Last-Modified"] = http_date(stat.st_mtime)
+		if immutable:
+			response["Cache-Control"] = f"public, max-age={settings.CHAT_STATIC_MAX_AGE}, immutable"
+		else:
+			response["Cache-Control"] = "no-cache"
+		return response
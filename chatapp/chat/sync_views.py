@@ -0,0 +1,164 @@
+"""Synchronisation différentielle de toutes les conversations en une requête.
+
+`GET /api/sync/?since=<watermark>` renvoie ce qui a changé depuis le
+watermark : nouveaux messages de toutes les conversations de l'utilisateur,
+nouvelles adhésions, contacts et invitations modifiés. La réponse contient le
+watermark suivant ; tant que `has_more` est vrai, le client rappelle aussitôt
+avec ce watermark.
+
+Sans `since` (premier lancement) : toutes les adhésions, tous les contacts et
+toutes les invitations, mais aucun historique de messages. Le paramètre
+`after=<conversation>:<dernier id vu>,...` demande les messages postérieurs
+pour ces conversations, par exemple depuis un cache local du client.
+
+Chaque catégorie est lue par des requêtes de plage sur un index, bornées à
+`CHAT_SYNC_PAGE_SIZE` lignes : une plage `(conversation, id)` par conversation
+pour les messages, `id > x` ou `(updated_at, id) > (t, x)` pour le reste. Les
+départs de conversation sont visibles par différence avec `conversation_ids`
+(toutes les conversations actuelles) ; les suppressions de contacts ne sont
+pas suivies.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.views.decorators.http import require_GET
+
+from .async_views import _login_required, _render
+from .membership_cache import memberships
+from .models import Contact, GroupInvitation, Membership, Message
+from .serializers import ContactSerializer, GroupInvitationSerializer, MessageSerializer
+
+WATERMARK_SALT = "chat.sync"
+
+
+class _InvalidSyncParameter(ValueError):
+	pass
+
+
+def _parse_watermark(value):
+	if not value:
+		return {}
+	try:
+		watermark = signing.loads(value, salt=WATERMARK_SALT)
+	except signing.BadSignature:
+		raise _InvalidSyncParameter("Watermark invalide")
+	if "a" in watermark:
+		# Paires [conversation, id] : en JSON, les clés d'un objet deviendraient des chaînes
+		watermark["a"] = {conversation: last_id for conversation, last_id in watermark["a"]}
+	return watermark
+
+
+def _parse_after(value):
+	"""`12:340,15:20` -> {12: 340, 15: 20}"""
+	if not value:
+		return None
+	try:
+		return {int(conversation): int(last_id) for conversation, last_id in (item.split(":") for item in value.split(","))}
+	except ValueError:
+		raise _InvalidSyncParameter("after doit être de la forme <conversation>:<id>,...")
+
+
+def _changed_since(queryset, cursor):
+	"""Lignes modifiées après le curseur (updated_at, id), dans l'ordre du curseur"""
+	if cursor is not None:
+		updated_at, pk = datetime.fromisoformat(cursor[0]), cursor[1]
+		queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+	return queryset.order_by("updated_at", "id")
+
+
+async def _page(queryset, limit):
+	"""(lignes, il en reste) pour une page de `limit` lignes"""
+	rows = [row async for row in queryset[:limit + 1]]
+	return rows[:limit], len(rows) > limit
+
+
+def _update_cursor(rows):
+	return [rows[-1].updated_at.isoformat(), rows[-1].id]
+
+
+@require_GET
+@_login_required
+async def sync(request, user):
+	limit = settings.CHAT_SYNC_PAGE_SIZE
+	try:
+		watermark = _parse_watermark(request.GET.get("since"))
+		after = _parse_after(request.GET.get("after"))
+	except _InvalidSyncParameter as exc:
+		return _render(request, {"detail": str(exc)}, status=400)
+	# Pages suivantes d'une même synchronisation : le watermark garde la borne et la liste `after`
+	after = watermark.get("a", after)
+
+	conversation_ids = list(await memberships.aget(user.id))
+
+	# Borne haute figée à la première page : les pages suivantes parcourent la même plage d'ids
+	high = watermark.get("h")
+	if high is None:
+		high = await Message.objects.order_by("-id").values_list("id", flat=True).afirst() or 0
+	cursor = watermark.get("m", 0)
+	if after is not None:
+		starts = {pk: max(cursor, after[pk]) for pk in conversation_ids if pk in after}
+	elif "m" in watermark:
+		starts = dict.fromkeys(conversation_ids, cursor)
+	else:
+		# Premier lancement sans `after` : pas d'historique, seulement le watermark
+		starts = {}
+	# Une plage `(conversation, id)` par conversation, servie par l'index (conversation, id)
+	ranges = [Q(conversation_id=pk, id__gt=start, id__lte=high) for pk, start in starts.items()]
+	messages_qs = Message.objects.filter(Q.create(ranges, connector=Q.OR)) if ranges else Message.objects.none()
+	messages, more_messages = await _page(messages_qs.select_related("sender").order_by("id"), limit)
+
+	new_memberships, more_memberships = await _page(
+		Membership.objects.filter(user=user, id__gt=watermark.get("b", 0))
+		.select_related("conversation")
+		.order_by("id"),
+		limit,
+	)
+	contacts, more_contacts = await _page(
+		_changed_since(
+			Contact.objects.filter(Q(from_user=user) | Q(to_user=user)).select_related("from_user", "to_user"),
+			watermark.get("c"),
+		),
+		limit,
+	)
+	invitations, more_invitations = await _page(
+		_changed_since(
+			GroupInvitation.objects.filter(Q(from_user=user) | Q(to_user=user))
+			.select_related("conversation", "from_user", "to_user"),
+			watermark.get("i"),
+		),
+		limit,
+	)
+
+	next_watermark = {
+		"b": new_memberships[-1].id if new_memberships else watermark.get("b", 0),
+		"c": _update_cursor(contacts) if contacts else watermark.get("c"),
+		"i": _update_cursor(invitations) if invitations else watermark.get("i"),
+	}
+	if more_messages:
+		next_watermark.update(m=messages[-1].id, h=high)
+		if after is not None:
+			next_watermark["a"] = sorted(after.items())
+	else:
+		next_watermark["m"] = high
+
+	return _render(request, {
+		"messages": MessageSerializer(messages, many=True).data,
+		"memberships": [
+			{
+				"id": membership.id,
+				"conversation_id": membership.conversation_id,
+				"type": membership.conversation.type,
+				"name": membership.conversation.name,
+				"is_admin": membership.is_admin,
+				"joined_at": membership.joined_at,
+			}
+			for membership in new_memberships
+		],
+		"conversation_ids": conversation_ids,
+		"contacts": ContactSerializer(contacts, many=True).data,
+		"invitations": GroupInvitationSerializer(invitations, many=True).data,
+		"watermark": signing.dumps(next_watermark, salt=WATERMARK_SALT, compress=True),
+		"has_more": more_messages or more_memberships or more_contacts or more_invitations,
+	})
@@ -0,0 +1,294 @@
+"""File de tâches différées, exécutées hors requête par `manage.py run_chat_worker`.
+
+Déclaration (dans chat/jobs.py) :
+
+	@task(max_attempts=5)
+	def reconcile_counters(conversation_id): ...
+
+	@task(batch=True)
+	def notify_members_joined(payloads): ...  # une liste de payloads par appel
+
+	@task(every=3600)
+	def purge(): ...  # replanifiée après chaque exécution, même en échec
+
+Mise en file : `reconcile_counters.defer(conversation_id=12)`, éventuellement
+`delay=` (secondes) et `key=` (une seule tâche en attente par clé).
+
+Deux stockages (`CHAT_TASK_BACKEND`) :
+- `db` (défaut) : table `chat_task`. La tâche est insérée dans la transaction
+  courante : appelée dans le `transaction.atomic()` de l'écriture principale,
+  elle existe si et seulement si cette écriture a été validée (hors
+  transaction, elle est validée aussitôt, indépendamment).
+- `redis` : files Redis, alimentées après commit ; aucune écriture SQL en plus
+  dans la requête.
+
+Le worker réclame les tâches échues par lots sous un bail (`locked_until`) :
+une tâche dont le worker meurt est reprise à l'expiration du bail (en db, le
+worker dépassé ne peut alors plus la terminer ni la replanifier). Les échecs
+sont réessayés avec un délai exponentiel jusqu'à `max_attempts`, puis
+conservés avec le statut `failed`. Les tâches `batch=True` de même nom
+réclamées ensemble sont traitées en un seul appel.
+"""
+import logging
+import signal
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .codecs import json_dumps, json_loads
+from .models import Task
+from .profiler import label
+
+try:
+	import redis
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	redis = None
+
+logger = logging.getLogger(__name__)
+
+# `claimed_by` : jeton de la réclamation (stockage db), vide pour Redis
+TaskRecord = namedtuple("TaskRecord", ("id", "name", "payload", "attempts", "claimed_by"), defaults=("",))
+
+registry = {}
+
+
+class TaskSpec:
+	def __init__(self, func, name, max_attempts, retry_delay, batch, every):
+		self.func = func
+		self.name = name
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay
+		self.batch = batch
+		self.every = every
+
+	def __call__(self, *args, **kwargs):
+		# Appel direct : exécution immédiate, dans le processus courant
+		return self.func(*args, **kwargs)
+
+	def defer(self, delay=0, key="", **payload):
+		queue.enqueue(self.name, payload, timezone.now() + timedelta(seconds=delay), key)
+
+	def backoff(self, attempts):
+		return self.retry_delay * 2 ** (attempts - 1)
+
+
+def task(name=None, max_attempts=3, retry_delay=10, batch=False, every=None):
+	"""Déclarer une tâche différée (voir l'exemple en tête de module)"""
+	def decorator(func):
+		spec = TaskSpec(func, name or f"{func.__module__}.{func.__name__}", max_attempts, retry_delay, batch, every)
+		registry[spec.name] = spec
+		return spec
+	return decorator
+
+
+class DatabaseTaskQueue:
+	def enqueue(self, name, payload, run_at, key=""):
+		# Dans la transaction courante : la tâche suit le sort de l'écriture qui la crée
+		if key and Task.objects.filter(name=name, key=key, status="pending").exists():
+			return
+		Task.objects.create(name=name, payload=payload, run_at=run_at, key=key)
+
+	def claim(self, limit, lease):
+		"""Réclamer jusqu'à `limit` tâches échues (ou au bail expiré) ; sûr entre plusieurs workers"""
+		now = timezone.now()
+		due = Q(status="pending", run_at__lte=now) | Q(status="running", locked_until__lt=now)
+		ids = list(Task.objects.filter(due).order_by("run_at").values_list("id", flat=True)[:limit])
+		if not ids:
+			return []
+		token = uuid.uuid4().hex
+		# Mise à jour conditionnelle : une tâche réclamée entre-temps par un autre worker n'est plus échue
+		Task.objects.filter(due, pk__in=ids).update(
+			status="running", claimed_by=token, locked_until=now + timedelta(seconds=lease)
+		)
+		return [
+			TaskRecord(*row) for row in
+			Task.objects.filter(claimed_by=token, status="running").values_list(
+				"id", "name", "payload", "attempts", "claimed_by"
+			)
+		]
+
+	# Filtrées sur le jeton : une tâche dont le bail a expiré et qui a été
+	# réclamée par un autre worker ne lui est pas retirée par le premier
+	def complete(self, records):
+		# Un lot provient d'une seule réclamation : un seul jeton
+		Task.objects.filter(pk__in=[record.id for record in records], claimed_by=records[0].claimed_by).delete()
+
+	def retry(self, record, run_at, error):
+		Task.objects.filter(pk=record.id, claimed_by=record.claimed_by).update(
+			status="pending", attempts=record.attempts + 1, run_at=run_at, locked_until=None, claimed_by="", last_error=error
+		)
+
+	def fail(self, record, error):
+		Task.objects.filter(pk=record.id, claimed_by=record.claimed_by).update(
+			status="failed", attempts=record.attempts + 1, locked_until=None, last_error=error
+		)
+
+
+class RedisTaskQueue:
+	"""Tâches en JSON dans un hash, planifiées dans un sorted set (score = échéance)"""
+	DATA = "chat:tasks:data"
+	SCHEDULED = "chat:tasks:scheduled"
+	RUNNING = "chat:tasks:running"
+	FAILED = "chat:tasks:failed"
+
+	def __init__(self, host, port, db=0):
+		self.client = redis.Redis(host=host, port=port, db=db)
+
+	def _key_lock(self, name, key):
+		return f"chat:tasks:key:{name}:{key}"
+
+	def enqueue(self, name, payload, run_at, key=""):
+		# Après commit : une tâche ne doit pas voir un état que la transaction n'a pas validé
+		transaction.on_commit(lambda: self._push(name, payload, run_at, key))
+
+	def _push(self, name, payload, run_at, key):
+		task_id = self.client.incr("chat:tasks:id")
+		if key and not self.client.set(self._key_lock(name, key), task_id, nx=True):
+			return
+		with self.client.pipeline() as pipe:
+			pipe.hset(self.DATA, task_id, json_dumps({"name": name, "payload": payload, "attempts": 0, "key": key}))
+			pipe.zadd(self.SCHEDULED, {task_id: run_at.timestamp()})
+			pipe.execute()
+
+	def claim(self, limit, lease):
+		now = time.time()
+		# Baux expirés : retour dans la file
+		for task_id in self.client.zrangebyscore(self.RUNNING, "-inf", now):
+			if self.client.zrem(self.RUNNING, task_id):
+				self.client.zadd(self.SCHEDULED, {task_id: now})
+		records = []
+		for task_id in self.client.zrangebyscore(self.SCHEDULED, "-inf", now, start=0, num=limit):
+			# ZREM n'aboutit que pour un seul worker
+			if not self.client.zrem(self.SCHEDULED, task_id):
+				continue
+			self.client.zadd(self.RUNNING, {task_id: now + lease})
+			raw = self.client.hget(self.DATA, task_id)
+			if raw is None:
+				self.client.zrem(self.RUNNING, task_id)
+				continue
+			data = json_loads(raw)
+			if data["key"]:
+				self.client.delete(self._key_lock(data["name"], data["key"]))
+			records.append(TaskRecord(int(task_id), data["name"], data["payload"], data["attempts"]))
+		return records
+
+	def complete(self, records):
+		ids = [record.id for record in records]
+		with self.client.pipeline() as pipe:
+			pipe.zrem(self.RUNNING, *ids)
+			pipe.hdel(self.DATA, *ids)
+			pipe.execute()
+
+	def retry(self, record, run_at, error):
+		data = {"name": record.name, "payload": record.payload, "attempts": record.attempts + 1, "key": "", "error": error}
+		with self.client.pipeline() as pipe:
+			pipe.hset(self.DATA, record.id, json_dumps(data))
+			pipe.zrem(self.RUNNING, record.id)
+			pipe.zadd(self.SCHEDULED, {record.id: run_at.timestamp()})
+			pipe.execute()
+
+	def fail(self, record, error):
+		data = {"name": record.name, "payload": record.payload, "attempts": record.attempts + 1, "error": error}
+		with self.client.pipeline() as pipe:
+			pipe.hset(self.FAILED, record.id, json_dumps(data))
+			pipe.zrem(self.RUNNING, record.id)
+			pipe.hdel(self.DATA, record.id)
+			pipe.execute()
+
+
+def _build_queue():
+	if settings.CHAT_TASK_BACKEND == "redis":
+		if redis is None:
+			raise RuntimeError("CHAT_TASK_BACKEND=redis nécessite le paquet redis")
+		return RedisTaskQueue(settings.REDIS_HOST, settings.REDIS_PORT)
+	return DatabaseTaskQueue()
+
+
+queue = _build_queue()
+
+
+class Worker:
+	"""Réclame les tâches par lots et les exécute dans un pool de threads"""
+
+	def __init__(self, concurrency=4, batch_size=100, poll_interval=1.0, lease=300, log=logger.info):
+		self.concurrency = concurrency
+		self.batch_size = batch_size
+		self.poll_interval = poll_interval
+		self.lease = lease
+		self.log = log
+		self.stop_event = threading.Event()
+
+	def schedule_periodic(self):
+		for spec in registry.values():
+			if spec.every:
+				spec.defer(key="periodic")
+
+	def run_once(self, pool):
+		"""Réclamer et exécuter un lot ; renvoie le nombre de tâches traitées"""
+		records = queue.claim(self.batch_size, self.lease)
+		close_old_connections()
+		by_name = defaultdict(list)
+		for record in records:
+			by_name[record.name].append(record)
+		jobs = []
+		for name, group in by_name.items():
+			spec = registry.get(name)
+			if spec is not None and spec.batch:
+				jobs.append(pool.submit(self.execute, spec, group))
+			else:
+				jobs.extend(pool.submit(self.execute, spec, [record]) for record in group)
+		wait(jobs)
+		return len(records)
+
+	def execute(self, spec, records):
+		try:
+			if spec is None:
+				raise LookupError(f"Tâche inconnue : {records[0].name}")
+			with label(f"task:{spec.name}"):
+				if spec.batch:
+					spec.func([record.payload for record in records])
+				else:
+					spec.func(**records[0].payload)
+		except Exception:
+			error = traceback.format_exc()
+			logger.warning("Échec de la tâche %s", records[0].name, exc_info=True)
+			for record in records:
+				if spec is not None and record.attempts + 1 < spec.max_attempts:
+					queue.retry(record, timezone.now() + timedelta(seconds=spec.backoff(record.attempts + 1)), error)
+				else:
+					queue.fail(record, error)
+			# Une tâche périodique en échec définitif reste planifiée
+			if spec is not None and spec.every and records[0].attempts + 1 >= spec.max_attempts:
+				spec.defer(delay=spec.every, key="periodic")
+		else:
+			queue.complete(records)
+			if spec.every:
+				spec.defer(delay=spec.every, key="periodic")
+		finally:
+			close_old_connections()
+
+	def run(self, once=False):
+		self.schedule_periodic()
+		with ThreadPoolExecutor(self.concurrency, thread_name_prefix="chat-task") as pool:
+			while not self.stop_event.is_set():
+				processed = self.run_once(pool)
+				if processed:
+					self.log(f"{processed} tâche(s) traitée(s)")
+				elif once:
+					break
+				else:
+					self.stop_event.wait(self.poll_interval)
+
+	def install_signal_handlers(self):
+		# Arrêt propre : plus de nouvelles réclamations, les tâches en cours se terminent
+		for signum in (signal.SIGTERM, signal.SIGINT):
+			signal.signal(signum, lambda *_: self.stop_event.set())
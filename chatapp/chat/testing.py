@@ -0,0 +1,161 @@
+"""Outils de test : jeu de données de référence et vérification des budgets SQL.
+
+Exemple (unittest ou pytest-django) :
+
+	from chat.testing import QueryBudgetTestCase
+
+	class EndpointBudgetTests(QueryBudgetTestCase):
+		def test_endpoints_within_budget(self):
+			self.assertEndpointsWithinBudget()
+"""
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.urls import URLPattern, URLResolver, reverse
+
+from . import querybudget
+from .membership_cache import memberships
+from .message_cache import recent_messages
+from .models import Contact, Conversation, GroupInvitation, Membership, Message
+
+
+def seed_dataset(members=50, messages=300):
+	"""Un groupe de `members` membres, une conversation privée, des contacts et une invitation"""
+	User = get_user_model()
+	users = User.objects.bulk_create([User(username=f"budget_user_{i}") for i in range(members + 1)])
+	owner, friend, outsider = users[0], users[1], users[-1]
+
+	group = Conversation.objects.create(type="group", name="budget_group", created_by=owner)
+	Membership.objects.bulk_create(
+		[Membership(conversation=group, user=owner, is_admin=True)]
+		+ [Membership(conversation=group, user=user) for user in users[1:members]]
+	)
+	direct = Conversation.objects.create(type="direct", created_by=owner)
+	Membership.objects.bulk_create([
+		Membership(conversation=direct, user=owner, is_admin=True),
+		Membership(conversation=direct, user=friend),
+	])
+	Message.objects.bulk_create([
+		Message(conversation=group, sender=users[i % members], content=f"message {i}")
+		for i in range(messages)
+	])
+	contact = Contact.objects.create(from_user=owner, to_user=friend, status="accepted")
+	Contact.objects.bulk_create([
+		Contact(from_user=user, to_user=owner, status="pending") for user in users[2:members]
+	])
+	GroupInvitation.objects.create(conversation=group, from_user=owner, to_user=outsider)
+	# Invitation reçue par `owner`, l'utilisateur connecté des tests
+	other_group = Conversation.objects.create(type="group", name="budget_other_group", created_by=friend)
+	Membership.objects.create(conversation=other_group, user=friend, is_admin=True)
+	invitation = GroupInvitation.objects.create(conversation=other_group, from_user=friend, to_user=owner)
+	return {
+		"owner": owner,
+		"friend": friend,
+		"outsider": outsider,
+		"group": group,
+		"direct": direct,
+		"contact": contact,
+		"invitation": invitation,
+	}
+
+
+def clear_local_caches():
+	"""Vider les caches en mémoire du processus entre deux tests.
+
+	Les ids se répètent d'un test à l'autre (transactions annulées) et les
+	invalidations « après commit » ne s'exécutent pas dans un `TestCase`.
+	"""
+	for cache in (memberships, recent_messages):
+		if hasattr(cache, "clear"):
+			cache.clear()
+
+
+def _named_patterns(patterns):
+	for pattern in patterns:
+		if isinstance(pattern, URLResolver):
+			yield from _named_patterns(pattern.url_patterns)
+		elif isinstance(pattern, URLPattern) and pattern.name:
+			yield pattern
+
+
+@override_settings(CHAT_QUERY_BUDGET_MODE="warn")
+class QueryBudgetTestCase(TestCase):
+	"""Appelle chaque endpoint GET de l'API, et les endpoints POST de `post_endpoints`,
+	sur le jeu de données de référence et compare le nombre de requêtes aux budgets
+	de `CHAT_QUERY_BUDGETS`. Chaque appel est mesuré caches froids : c'est le pire cas
+	qu'un budget doit couvrir."""
+
+	# Endpoints POST mesurés, avec leur corps de requête
+	post_endpoints = {
+		"conversation-send": {"content": "budget"},
+		"conversation-mark-read": {},
+	}
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.data = seed_dataset()
+
+	def setUp(self):
+		clear_local_caches()
+		# Connexions ouvertes avant l'activation de la mesure
+		for connection in connections.all(initialized_only=True):
+			querybudget.install(connection)
+		self.client.force_login(self.data["owner"])
+
+	def endpoint_kwargs(self, pattern):
+		"""Paramètres d'URL utilisés pour un endpoint de détail"""
+		if "pk" not in pattern.pattern.converters and "(?P<pk>" not in str(pattern.pattern):
+			return {}
+		if pattern.name.startswith("contact-"):
+			return {"pk": self.data["contact"].pk}
+		if pattern.name.startswith("group-invitation-"):
+			return {"pk": self.data["invitation"].pk}
+		return {"pk": self.data["group"].pk}
+
+	def api_endpoints(self):
+		from . import urls
+
+		for pattern in _named_patterns(urls.urlpatterns):
+			if "format" in str(pattern.pattern):
+				continue
+			actions = getattr(pattern.callback, "actions", None)
+			if actions is not None and "get" not in actions:
+				continue
+			try:
+				url = reverse(pattern.name, kwargs=self.endpoint_kwargs(pattern))
+			except Exception:
+				continue
+			if url.startswith("/api/"):
+				yield pattern.name, url
+
+	def post_api_endpoints(self):
+		from . import urls
+
+		for pattern in _named_patterns(urls.urlpatterns):
+			if pattern.name in self.post_endpoints:
+				yield pattern.name, reverse(pattern.name, kwargs=self.endpoint_kwargs(pattern)), self.post_endpoints[pattern.name]
+
+	def assertWithinBudget(self, name, url, data=None, **extra):
+		"""Appel GET, ou POST si `data` est donné, caches froids"""
+		clear_local_caches()
+		with querybudget.record() as recorder:
+			if data is None:
+				response = self.client.get(url, **extra)
+			else:
+				response = self.client.post(url, data, **extra)
+		if response.status_code == 405:
+			return response
+		self.assertLess(response.status_code, 400, f"{url} : {response.status_code}")
+		try:
+			querybudget.check(name, recorder, mode="raise")
+		except querybudget.QueryBudgetExceeded as exc:
+			self.fail(str(exc))
+		return response
+
+	def assertEndpointsWithinBudget(self):
+		for name, url in self.api_endpoints():
+			with self.subTest(endpoint=name):
+				self.assertWithinBudget(name, url)
+		for name, url, data in self.post_api_endpoints():
+			with self.subTest(endpoint=name):
+				self.assertWithinBudget(name, url, data)
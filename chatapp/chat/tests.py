@@ -0,0 +1,792 @@
+import asyncio
+import base64
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
+
+from autobahn.twisted.websocket import WebSocketServerFactory
+from autobahn.websocket.compress import PerMessageBzip2Offer, PerMessageDeflateOffer
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.deletion import Collector
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from . import draining
+from .codecs import HAS_MSGPACK
+from .consumers import ChatConsumer
+from .layers import LocalBroker, UnixSocketChannelLayer
+from .membership_cache import MembershipInfo, memberships
+from .message_cache import LocalRecentMessages
+from .models import Conversation, GroupInvitation, Membership, Message, Task, Upload
+from .server import DrainingServer, _accept_deflate
+from .tasks import Worker, queue, task
+from .testing import QueryBudgetTestCase, clear_local_caches
+from .ws_auth import DatabaseTokenGenerations, RedisTokenGenerations, authenticate_token, generations, issue_token
+
+
+class EndpointBudgetTests(QueryBudgetTestCase):
+	def test_endpoints_within_budget(self):
+		self.assertEndpointsWithinBudget()
+
+	def test_budgets_name_existing_endpoints(self):
+		# Un budget au nom d'URL mal orthographié ne serait jamais appliqué
+		url_names = {name for name in get_resolver().reverse_dict if isinstance(name, str)}
+		for name in settings.CHAT_QUERY_BUDGETS:
+			if name != "default" and not name.startswith("ws:"):
+				self.assertIn(name, url_names)
+
+	def test_every_budget_is_measured(self):
+		measured = {name for name, _ in self.api_endpoints()} | {name for name, _, _ in self.post_api_endpoints()}
+		for name in settings.CHAT_QUERY_BUDGETS:
+			if name != "default" and not name.startswith("ws:"):
+				self.assertIn(name, measured)
+
+
+@override_settings(CHAT_SYNC_PAGE_SIZE=5)
+class SyncTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		User = get_user_model()
+		cls.user = User.objects.create_user("sync_user")
+		other = User.objects.create_user("sync_other")
+		cls.conversation = Conversation.objects.create(type="group", name="sync", created_by=cls.user)
+		Membership.objects.create(conversation=cls.conversation, user=cls.user, is_admin=True)
+		cls.hidden = Conversation.objects.create(type="group", name="sync_hidden", created_by=other)
+		Membership.objects.create(conversation=cls.hidden, user=other, is_admin=True)
+
+	def setUp(self):
+		clear_local_caches()
+		self.client.force_login(self.user)
+
+	def post_messages(self, count):
+		for i in range(count):
+			Message.objects.create(conversation=self.conversation, sender=self.user, content=f"m{i}")
+			Message.objects.create(conversation=self.hidden, sender=self.user, content=f"hidden {i}")
+
+	def sync_all(self, **params):
+		"""Messages de toutes les pages d'une synchronisation, et le watermark final"""
+		messages, pages = [], 0
+		while True:
+			data = self.client.get(reverse("sync"), params).json()
+			messages += [message["content"] for message in data["messages"]]
+			pages += 1
+			params = {"since": data["watermark"]}
+			if not data["has_more"]:
+				return messages, data["watermark"], pages
+
+	def test_after_pages_through_every_message(self):
+		self.post_messages(12)
+		messages, _, pages = self.sync_all(after=f"{self.conversation.pk}:0")
+		self.assertEqual(messages, [f"m{i}" for i in range(12)])
+		self.assertEqual(pages, 3)
+
+	def test_watermark_pages_through_new_messages(self):
+		_, watermark, _ = self.sync_all()
+		self.post_messages(12)
+		messages, watermark, _ = self.sync_all(since=watermark)
+		self.assertEqual(messages, [f"m{i}" for i in range(12)])
+		self.assertEqual(self.sync_all(since=watermark)[0], [])
+
+
+class MembershipCacheTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = get_user_model().objects.create_user("cache_user")
+		cls.conversation = Conversation.objects.create(type="group", name="cache", created_by=cls.user)
+		Membership.objects.create(conversation=cls.conversation, user=cls.user, is_admin=True)
+
+	def setUp(self):
+		clear_local_caches()
+		self.client.force_login(self.user)
+
+	def test_removed_member_loses_access(self):
+		url = reverse("conversation-detail", args=[self.conversation.pk])
+		self.assertEqual(self.client.get(url).status_code, 200)
+		with self.captureOnCommitCallbacks(execute=True):
+			Membership.objects.filter(conversation=self.conversation, user=self.user).delete()
+		self.assertEqual(self.client.get(url).status_code, 404)
+
+	def test_failed_invalidation_fails_the_write(self):
+		with mock.patch.object(memberships, "prepare", side_effect=ConnectionError):
+			with self.assertRaises(ConnectionError):
+				self.client.post(reverse("conversation-create-group"), {"name": "cache_failed"})
+		self.assertFalse(Conversation.objects.filter(name="cache_failed").exists())
+
+
+class FakeRedis:
+	"""Sous-ensemble de redis.Redis en mémoire, expirations comprises (horloge `time.time`)"""
+
+	def __init__(self):
+		self.data = {}
+		self.expires = {}
+
+	def _expire_due(self, key):
+		if key in self.expires and self.expires[key] <= time.time():
+			del self.data[key], self.expires[key]
+
+	def get(self, key):
+		self._expire_due(key)
+		value = self.data.get(key)
+		return None if value is None else str(value).encode()
+
+	def incr(self, key):
+		self._expire_due(key)
+		self.data[key] = int(self.data.get(key, 0)) + 1
+		return self.data[key]
+
+	def expire(self, key, seconds):
+		if key in self.data:
+			self.expires[key] = time.time() + seconds
+
+	def pipeline(self):
+		return FakePipeline(self)
+
+
+class FakePipeline:
+	def __init__(self, client):
+		self.client = client
+		self.calls = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		pass
+
+	def __getattr__(self, name):
+		return lambda *args: self.calls.append((name, args))
+
+	def execute(self):
+		return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+class WsTokenTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = get_user_model().objects.create_user("token_user")
+
+	def test_revocation_survives_restart(self):
+		token = issue_token(self.user)
+		self.assertEqual(authenticate_token(token).pk, self.user.pk)
+		DatabaseTokenGenerations().revoke(self.user.pk)
+		# Autre instance : un autre worker, ou le même redémarré
+		self.assertIsNone(authenticate_token(token))
+		self.assertEqual(DatabaseTokenGenerations().get(self.user.pk), 1)
+
+	def test_redis_revocation_survives_key_expiry(self):
+		redis_generations = RedisTokenGenerations("localhost", 6379)
+		redis_generations.client = FakeRedis()
+		start = time.time()
+		with mock.patch("chat.ws_auth.generations", redis_generations), mock.patch("time.time") as clock:
+			clock.return_value = start
+			redis_generations.revoke(self.user.pk)
+			clock.return_value = start + 3600
+			token = issue_token(self.user)
+			# Jeton encore dans sa durée de validité, mais plus d'une durée après la première révocation
+			clock.return_value = start + settings.CHAT_WS_TOKEN_MAX_AGE + 1800
+			redis_generations.revoke(self.user.pk)
+			self.assertIsNone(authenticate_token(token))
+
+	def test_logout_revokes_tokens(self):
+		self.client.force_login(self.user)
+		token = issue_token(self.user)
+		self.client.post(reverse("logout"))
+		self.assertIsNone(authenticate_token(token))
+
+	def test_failed_revocation_fails_logout(self):
+		self.client.force_login(self.user)
+		with mock.patch.object(generations, "revoke", side_effect=ConnectionError):
+			with self.assertRaises(ConnectionError):
+				self.client.post(reverse("logout"))
+		self.assertIn("_auth_user_id", self.client.session)
+
+
+class AsyncViewAuthTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = get_user_model().objects.create_user("basic_user", password="secret")
+		cls.conversation = Conversation.objects.create(type="group", name="basic", created_by=cls.user)
+		Membership.objects.create(conversation=cls.conversation, user=cls.user, is_admin=True)
+
+	def setUp(self):
+		clear_local_caches()
+
+	def basic(self, password):
+		return {"HTTP_AUTHORIZATION": "Basic " + base64.b64encode(f"basic_user:{password}".encode()).decode()}
+
+	def test_basic_authentication(self):
+		response = self.client.post(
+			reverse("conversation-send", args=[self.conversation.pk]), {"content": "hello"}, **self.basic("secret")
+		)
+		self.assertEqual(response.status_code, 201)
+		response = self.client.get(reverse("conversation-messages", args=[self.conversation.pk]), **self.basic("secret"))
+		self.assertEqual([message["content"] for message in response.json()], ["hello"])
+
+	def test_basic_authentication_refused(self):
+		response = self.client.get(reverse("conversation-unread-count"), **self.basic("wrong"))
+		self.assertEqual(response.status_code, 403)
+		self.assertEqual(response.json()["detail"], "Invalid username/password.")
+
+	def test_session_requires_csrf(self):
+		client = self.client_class(enforce_csrf_checks=True)
+		client.force_login(self.user)
+		response = client.post(reverse("conversation-mark-read", args=[self.conversation.pk]))
+		self.assertEqual(response.status_code, 403)
+		self.assertTrue(response.json()["detail"].startswith("CSRF Failed"))
+
+
+calls = []
+
+
+@task(name="tests.flaky", max_attempts=2, retry_delay=10)
+def flaky(**payload):
+	raise RuntimeError("échec")
+
+
+@task(name="tests.batched", batch=True)
+def batched(payloads):
+	calls.append(payloads)
+
+
+@task(name="tests.periodic", every=60)
+def periodic():
+	calls.append("periodic")
+
+
+@task(name="tests.periodic_flaky", max_attempts=1, every=60)
+def periodic_flaky():
+	raise RuntimeError("échec")
+
+
+class InlinePool:
+	"""Exécute les tâches soumises aussitôt, dans la transaction du test"""
+
+	def submit(self, fn, *args):
+		future = Future()
+		future.set_result(fn(*args))
+		return future
+
+
+@mock.patch("chat.tasks.close_old_connections", lambda: None)
+class WorkerTests(TestCase):
+	def setUp(self):
+		calls.clear()
+
+	def run_once(self, failing=False):
+		if not failing:
+			return Worker().run_once(InlinePool())
+		with self.assertLogs("chat.tasks", "WARNING"):
+			return Worker().run_once(InlinePool())
+
+	def test_retries_with_backoff_then_fails(self):
+		flaky.defer(n=1)
+		self.assertEqual(self.run_once(failing=True), 1)
+		record = Task.objects.get(name="tests.flaky")
+		self.assertEqual((record.status, record.attempts), ("pending", 1))
+		self.assertGreater(record.run_at, timezone.now() + timedelta(seconds=5))
+		self.assertEqual(self.run_once(), 0)
+
+		Task.objects.filter(pk=record.pk).update(run_at=timezone.now())
+		self.assertEqual(self.run_once(failing=True), 1)
+		record.refresh_from_db()
+		self.assertEqual((record.status, record.attempts), ("failed", 2))
+		self.assertIn("RuntimeError: échec", record.last_error)
+
+	def test_unknown_task_fails(self):
+		Task.objects.create(name="tests.missing")
+		self.run_once(failing=True)
+		self.assertEqual(Task.objects.get(name="tests.missing").status, "failed")
+
+	def test_batch_runs_in_one_call(self):
+		for n in range(3):
+			batched.defer(n=n)
+		self.assertEqual(self.run_once(), 3)
+		self.assertEqual(calls, [[{"n": 0}, {"n": 1}, {"n": 2}]])
+		self.assertFalse(Task.objects.exists())
+
+	def test_key_deduplicates_pending_tasks(self):
+		batched.defer(key="k", n=1)
+		batched.defer(key="k", n=2)
+		batched.defer(key="other", n=3)
+		self.assertEqual(Task.objects.count(), 2)
+		self.run_once()
+		# Une fois exécutée, la clé peut de nouveau être mise en file
+		batched.defer(key="k", n=4)
+		self.assertEqual(list(Task.objects.values_list("payload", flat=True)), [{"n": 4}])
+
+	def test_periodic_task_is_rescheduled(self):
+		periodic.defer(key="periodic")
+		self.run_once()
+		self.assertEqual(calls, ["periodic"])
+		record = Task.objects.get(name="tests.periodic")
+		self.assertEqual((record.key, record.status), ("periodic", "pending"))
+		self.assertGreater(record.run_at, timezone.now() + timedelta(seconds=50))
+
+
+	def test_failed_periodic_task_is_rescheduled(self):
+		periodic_flaky.defer(key="periodic")
+		self.run_once(failing=True)
+		self.assertEqual(
+			sorted(Task.objects.filter(name="tests.periodic_flaky").values_list("status", flat=True)), ["failed", "pending"]
+		)
+
+	def test_expired_lease_reclaimed_by_another_worker(self):
+		flaky.defer(n=1)
+		first, = queue.claim(10, lease=300)
+		# Bail expiré : un second worker reprend la tâche
+		Task.objects.filter(pk=first.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+		second, = queue.claim(10, lease=300)
+		queue.complete([first])
+		queue.retry(first, timezone.now(), "erreur")
+		queue.fail(first, "erreur")
+		record = Task.objects.get(pk=first.id)
+		self.assertEqual((record.status, record.claimed_by, record.attempts), ("running", second.claimed_by, 0))
+		queue.complete([second])
+		self.assertFalse(Task.objects.exists())
+
+
+class AcceptInvitationsTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		User = get_user_model()
+		cls.user = User.objects.create_user("invited_user")
+		owner = User.objects.create_user("invite_owner")
+		cls.groups = [Conversation.objects.create(type="group", name=f"invite {n}", created_by=owner) for n in range(2)]
+		cls.invitations = [
+			GroupInvitation.objects.create(conversation=group, from_user=owner, to_user=cls.user) for group in cls.groups
+		]
+		# Déjà membre du premier groupe
+		Membership.objects.create(conversation=cls.groups[0], user=cls.user)
+
+	def setUp(self):
+		clear_local_caches()
+		self.client.force_login(self.user)
+
+	def test_accept_bulk_announces_new_memberships_only(self):
+		response = self.client.post(
+			reverse("group-invitation-accept-invitations-bulk"),
+			{"ids": [invitation.pk for invitation in self.invitations]},
+			content_type="application/json",
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(Membership.objects.filter(user=self.user).count(), 2)
+		self.assertEqual(
+			[payload["conversation_id"] for payload in Task.objects.values_list("payload", flat=True)],
+			[self.groups[1].pk],
+		)
+
+
+class RecentMessagesTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		User = get_user_model()
+		cls.user = User.objects.create_user("recent_user")
+		cls.other = User.objects.create_user("recent_other")
+		cls.conversation = Conversation.objects.create(type="group", name="recent", created_by=cls.user)
+		Membership.objects.create(conversation=cls.conversation, user=cls.user, is_admin=True)
+		Membership.objects.create(conversation=cls.conversation, user=cls.other)
+
+	def setUp(self):
+		clear_local_caches()
+		self.client.force_login(self.user)
+
+	def contents(self):
+		response = self.client.get(reverse("conversation-messages", args=[self.conversation.pk]))
+		return [message["content"] for message in response.json()]
+
+	def test_messages_are_fast_deleted(self):
+		# Un receiver de suppression sur Message imposerait une requête et un signal par message
+		self.assertTrue(Collector(using="default").can_fast_delete(Message.objects.all()))
+
+	def test_deleted_sender_leaves_the_cache(self):
+		Message.objects.create(conversation=self.conversation, sender=self.user, content="kept")
+		Message.objects.create(conversation=self.conversation, sender=self.other, content="removed")
+		self.assertEqual(self.contents(), ["kept", "removed"])
+		with self.captureOnCommitCallbacks(execute=True):
+			self.other.delete()
+		self.assertEqual(self.contents(), ["kept"])
+
+
+class LocalRecentMessagesTests(SimpleTestCase):
+	def test_append_after_fill_is_idempotent(self):
+		cache = LocalRecentMessages(size=10)
+		# Remplissage fait entre l'insertion du message 2 et son ajout au cache
+		cache.fill(1, [b'{"id":1}', b'{"id":2}'], cache.begin_fill(1))
+		cache.append(1, b'{"id":2}')
+		cache.append(1, b'{"id":3}')
+		self.assertEqual(cache.get(1), [b'{"id":1}', b'{"id":2}', b'{"id":3}'])
+
+	def test_sequences_are_bounded(self):
+		cache = LocalRecentMessages(size=10, max_conversations=2)
+		token = cache.begin_fill(1)
+		for conversation_id in range(1, 21):
+			cache.invalidate(conversation_id)
+		self.assertLessEqual(len(cache._seq), cache.max_sequences)
+		# Séquence de la conversation 1 évincée : le remplissage commencé avant reste refusé
+		cache.fill(1, [b'{"id":1}'], token)
+		self.assertIsNone(cache.get(1))
+		cache.fill(1, [b'{"id":2}'], cache.begin_fill(1))
+		self.assertEqual(cache.get(1), [b'{"id":2}'])
+
+
+@unittest.skipUnless(HAS_MSGPACK, "UnixSocketChannelLayer nécessite msgpack")
+class UnixSocketChannelLayerTests(SimpleTestCase):
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+		self.path = os.path.join(directory, "layer.sock")
+
+	async def start_broker(self):
+		broker = LocalBroker(self.path)
+		task = asyncio.ensure_future(broker.serve())
+		while not os.path.exists(self.path):
+			await asyncio.sleep(0.01)
+		return broker, task
+
+	async def stop_broker(self, broker, task):
+		task.cancel()
+		# Connexions clientes coupées, comme à l'arrêt du processus du broker
+		for writer in list(broker.processes.values()):
+			writer.close()
+		await asyncio.gather(task, return_exceptions=True)
+
+	async def nothing_received(self, layer, channel):
+		with self.assertRaises(asyncio.TimeoutError):
+			await asyncio.wait_for(layer.receive(channel), 0.1)
+
+	async def test_group_send_and_discard(self):
+		broker, task = await self.start_broker()
+		first, second = UnixSocketChannelLayer(self.path), UnixSocketChannelLayer(self.path)
+		c1, c2 = await first.new_channel(), await second.new_channel()
+		await first.group_add("room", c1)
+		await second.group_add("room", c2)
+		await first.group_send("room", {"type": "chat.message", "n": 1})
+		self.assertEqual(await asyncio.wait_for(first.receive(c1), 1), {"type": "chat.message", "n": 1})
+		self.assertEqual(await asyncio.wait_for(second.receive(c2), 1), {"type": "chat.message", "n": 1})
+
+		await second.group_discard("room", c2)
+		await first.group_send("room", {"type": "chat.message", "n": 2})
+		self.assertEqual((await asyncio.wait_for(first.receive(c1), 1))["n"], 2)
+		await self.nothing_received(second, c2)
+		await first.close()
+		await second.close()
+		await self.stop_broker(broker, task)
+
+	async def test_process_local_channels_are_pushed(self):
+		broker, task = await self.start_broker()
+		sender, receiver = UnixSocketChannelLayer(self.path), UnixSocketChannelLayer(self.path)
+		channel = await receiver.new_channel()
+		self.assertTrue(channel.startswith(f"specific.{receiver.client_prefix}!"))
+		receiving = asyncio.ensure_future(receiver.receive(channel))
+		await asyncio.sleep(0.05)
+		await sender.send(channel, {"type": "direct"})
+		self.assertEqual(await asyncio.wait_for(receiving, 1), {"type": "direct"})
+		# Poussé au processus propriétaire, jamais mis en file par le broker
+		self.assertFalse(broker.queues)
+
+		await sender.send("worker", {"type": "job"})
+		self.assertEqual(await asyncio.wait_for(receiver.receive("worker"), 1), {"type": "job"})
+		await sender.close()
+		await receiver.close()
+		await self.stop_broker(broker, task)
+
+	async def test_channel_full(self):
+		broker, task = await self.start_broker()
+		layer = UnixSocketChannelLayer(self.path, capacity=2)
+		await layer.send("worker", {"type": "job"})
+		await layer.send("worker", {"type": "job"})
+		with self.assertRaises(ChannelFull):
+			await layer.send("worker", {"type": "job"})
+		await layer.close()
+		await self.stop_broker(broker, task)
+
+	async def test_concurrent_callers_share_one_connection(self):
+		broker, task = await self.start_broker()
+		layer = UnixSocketChannelLayer(self.path)
+		connections = await asyncio.gather(*(layer._connection(register=True) for _ in range(10)))
+		self.assertEqual(len({id(conn) for conn in connections}), 1)
+		self.assertEqual(list(broker.processes), [layer.client_prefix])
+		await layer.close()
+		await self.stop_broker(broker, task)
+
+	async def test_reconnects_after_broker_restart(self):
+		broker, task = await self.start_broker()
+		layer, other = UnixSocketChannelLayer(self.path), UnixSocketChannelLayer(self.path)
+		channel = await layer.new_channel()
+		receiving = asyncio.ensure_future(layer.receive(channel))
+		await asyncio.sleep(0.05)
+		await self.stop_broker(broker, task)
+
+		broker, task = await self.start_broker()
+		# Réenregistrement automatique auprès du nouveau broker
+		for _ in range(100):
+			if layer.client_prefix in broker.processes:
+				break
+			await asyncio.sleep(0.02)
+		await other.group_add("room", channel)
+		await other.group_send("room", {"type": "after.restart"})
+		self.assertEqual(await asyncio.wait_for(receiving, 1), {"type": "after.restart"})
+		await layer.close()
+		await other.close()
+		await self.stop_broker(broker, task)
+
+
+class GroupInvitationBulkTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		User = get_user_model()
+		cls.admin = User.objects.create_user("bulk_admin")
+		cls.member = User.objects.create_user("bulk_member")
+		cls.invited = User.objects.create_user("bulk_invited")
+		cls.newcomer = User.objects.create_user("bulk_newcomer")
+		cls.other_admin = User.objects.create_user("bulk_other_admin")
+		cls.group = Conversation.objects.create(type="group", name="bulk", created_by=cls.admin)
+		Membership.objects.create(conversation=cls.group, user=cls.admin, is_admin=True)
+		Membership.objects.create(conversation=cls.group, user=cls.other_admin, is_admin=True)
+		Membership.objects.create(conversation=cls.group, user=cls.member)
+		cls.invitation = GroupInvitation.objects.create(conversation=cls.group, from_user=cls.admin, to_user=cls.invited)
+
+	def setUp(self):
+		clear_local_caches()
+
+	def invite(self, user, usernames, conversation_id=None):
+		self.client.force_login(user)
+		return self.client.post(
+			reverse("group-invitation-invite-users-bulk"),
+			{"conversation_id": conversation_id or self.group.pk, "usernames": usernames},
+			content_type="application/json",
+		)
+
+	def statuses(self, response):
+		return [result["status"] for result in response.json()["results"]]
+
+	def test_invite_partial_success(self):
+		response = self.invite(self.admin, ["bulk_newcomer", "bulk_member", "bulk_invited", "ghost", "bulk_newcomer"])
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.statuses(response), ["invited", "already_member", "already_invited", "not_found"])
+		invitation = GroupInvitation.objects.get(conversation=self.group, to_user=self.newcomer)
+		self.assertEqual(response.json()["results"][0]["invitation"], invitation.pk)
+
+	def test_invite_concurrent_invitation_is_not_an_error(self):
+		bulk_create = GroupInvitation.objects.bulk_create
+
+		def concurrent_bulk_create(objs, **kwargs):
+			# Un autre admin invite le même utilisateur entre la vérification et l'insertion
+			GroupInvitation.objects.create(conversation=self.group, from_user=self.other_admin, to_user=self.newcomer)
+			return bulk_create(objs, **kwargs)
+
+		with mock.patch.object(GroupInvitation.objects, "bulk_create", concurrent_bulk_create):
+			response = self.invite(self.admin, ["bulk_newcomer"])
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.statuses(response), ["already_invited"])
+
+	def test_invite_requires_admin(self):
+		self.assertEqual(self.invite(self.member, ["bulk_newcomer"]).status_code, 403)
+		self.assertEqual(self.invite(self.admin, ["bulk_newcomer"], conversation_id=999999).status_code, 404)
+		self.assertFalse(GroupInvitation.objects.filter(to_user=self.newcomer).exists())
+
+	def test_invite_rejects_invalid_lists(self):
+		self.assertEqual(self.invite(self.admin, []).status_code, 400)
+		self.assertEqual(self.invite(self.admin, "bulk_newcomer").status_code, 400)
+
+	def bulk(self, action, ids):
+		self.client.force_login(self.invited)
+		return self.client.post(reverse(f"group-invitation-{action}-invitations-bulk"), {"ids": ids}, content_type="application/json")
+
+	def test_accept_and_decline_partial_success(self):
+		# Invitation d'un autre utilisateur : introuvable pour l'appelant
+		foreign = GroupInvitation.objects.create(conversation=self.group, from_user=self.admin, to_user=self.newcomer)
+		response = self.bulk("accept", [self.invitation.pk, foreign.pk, 999999, self.invitation.pk])
+		self.assertEqual(self.statuses(response), ["accepted", "not_found", "not_found"])
+		self.assertTrue(Membership.objects.filter(conversation=self.group, user=self.invited).exists())
+		foreign.refresh_from_db()
+		self.assertEqual(foreign.status, "pending")
+
+		response = self.bulk("decline", [foreign.pk, 999999])
+		self.assertEqual(self.statuses(response), ["not_found", "not_found"])
+		self.assertEqual(self.bulk("decline", ["x"]).status_code, 400)
+
+	def test_decline_bulk(self):
+		response = self.bulk("decline", [self.invitation.pk])
+		self.assertEqual(self.statuses(response), ["declined"])
+		self.invitation.refresh_from_db()
+		self.assertEqual(self.invitation.status, "declined")
+		self.assertFalse(Membership.objects.filter(conversation=self.group, user=self.invited).exists())
+
+
+class UploadTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = get_user_model().objects.create_user("upload_user")
+		cls.conversation = Conversation.objects.create(type="group", name="upload", created_by=cls.user)
+		Membership.objects.create(conversation=cls.conversation, user=cls.user, is_admin=True)
+
+	def setUp(self):
+		clear_local_caches()
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+		overrides = override_settings(MEDIA_ROOT=media_root)
+		overrides.enable()
+		self.addCleanup(overrides.disable)
+		self.client.force_login(self.user)
+
+	def start(self, size):
+		response = self.client.post(
+			reverse("upload-create"),
+			{"conversation_id": self.conversation.pk, "filename": "notes.txt", "size": size},
+			content_type="application/json",
+		)
+		self.assertEqual(response.status_code, 201)
+		return response.json()["id"]
+
+	def put(self, upload_id, offset, chunk, **headers):
+		return self.client.put(
+			reverse("upload-detail", args=[upload_id]) + f"?offset={offset}",
+			chunk, content_type="application/octet-stream", headers=headers,
+		)
+
+	def complete(self, upload_id, crc32):
+		return self.client.post(
+			reverse("upload-complete", args=[upload_id]), {"content": "fichier", "crc32": crc32}, content_type="application/json"
+		)
+
+	def test_resumable_upload(self):
+		data = b"0123456789"
+		upload_id = self.start(len(data))
+		# Morceau corrompu : refusé, l'offset ne bouge pas
+		response = self.put(upload_id, 0, data[:4], **{"X-Chunk-CRC32": str(zlib.crc32(b"autre"))})
+		self.assertEqual((response.status_code, response.json()["offset"]), (400, 0))
+		response = self.put(upload_id, 0, data[:4], **{"X-Chunk-CRC32": str(zlib.crc32(data[:4]))})
+		self.assertEqual(response.json()["offset"], 4)
+		# Morceau déjà acquitté renvoyé après une coupure : 409 avec l'offset à reprendre
+		response = self.put(upload_id, 0, data[:4])
+		self.assertEqual((response.status_code, response.json()["offset"]), (409, 4))
+		self.assertEqual(self.client.get(reverse("upload-detail", args=[upload_id])).json()["offset"], 4)
+		# Finalisation d'un envoi incomplet refusée
+		self.assertEqual(self.complete(upload_id, zlib.crc32(data)).status_code, 409)
+
+		response = self.put(upload_id, 4, data[4:])
+		self.assertEqual(response.json()["crc32"], zlib.crc32(data))
+		self.assertEqual(self.complete(upload_id, zlib.crc32(b"autre")).status_code, 400)
+		response = self.complete(upload_id, zlib.crc32(data))
+		self.assertEqual(response.status_code, 201)
+		message = Message.objects.get(pk=response.json()["id"])
+		with message.attachment.open("rb") as attachment:
+			self.assertEqual(attachment.read(), data)
+		self.assertFalse(Upload.objects.exists())
+		self.assertEqual(self.complete(upload_id, zlib.crc32(data)).status_code, 404)
+
+	def test_concurrent_complete(self):
+		data = b"abc"
+		upload_id = self.start(len(data))
+		self.put(upload_id, 0, data)
+
+		async def other_complete_wins(*args):
+			# L'autre finalisation réclame l'envoi entre les vérifications et la réclamation
+			await Upload.objects.filter(pk=upload_id).adelete()
+			return False
+
+		with mock.patch("chat.upload_views._contact_refused", other_complete_wins):
+			response = self.complete(upload_id, zlib.crc32(data))
+		self.assertEqual(response.status_code, 409)
+		self.assertFalse(Message.objects.exists())
+
+
+class SparseFieldsTests(TestCase):
+	def setUp(self):
+		clear_local_caches()
+		self.client.force_login(get_user_model().objects.create_user("sparse_user"))
+
+	def test_fields_select_output_only(self):
+		response = self.client.post(
+			reverse("conversation-list") + "?fields=id", {"type": "group", "name": "clairsemée"}, content_type="application/json"
+		)
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(list(response.json()), ["id"])
+		conversation = Conversation.objects.get(pk=response.json()["id"])
+		self.assertEqual((conversation.type, conversation.name), ("group", "clairsemée"))
+
+		response = self.client.get(reverse("conversation-list") + "?fields=id,name")
+		self.assertEqual(response.json(), [{"id": conversation.pk, "name": "clairsemée"}])
+
+
+class WsUser:
+	id = 1
+	is_authenticated = True
+
+
+@override_settings(CHAT_WS_BATCH_WINDOW_MS=20, CHAT_WS_BATCH_MAX=3)
+@mock.patch("chat.consumers.memberships.aget", mock.AsyncMock(return_value={1: MembershipInfo(False, "group")}))
+class ChatConsumerBatchTests(SimpleTestCase):
+	async def connect(self, query=""):
+		communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/1/{query}")
+		communicator.scope.update(user=WsUser(), url_route={"kwargs": {"room_name": "1"}})
+		connected, _ = await communicator.connect()
+		self.assertTrue(connected)
+		return communicator
+
+	async def broadcast(self, *messages):
+		for message in messages:
+			await get_channel_layer().group_send("chat_1", {"type": "chat_message", "message": message})
+
+	async def test_unbatched_clients_get_one_frame_per_message(self):
+		communicator = await self.connect()
+		await self.broadcast({"id": 1}, {"id": 2})
+		self.assertEqual(await communicator.receive_json_from(), {"message": {"id": 1}})
+		self.assertEqual(await communicator.receive_json_from(), {"message": {"id": 2}})
+		await communicator.disconnect()
+
+	async def test_batch_window_coalesces_messages(self):
+		communicator = await self.connect("?batch=1")
+		await self.broadcast({"id": 1}, {"id": 2})
+		self.assertEqual(await communicator.receive_json_from(), [{"message": {"id": 1}}, {"message": {"id": 2}}])
+		self.assertTrue(await communicator.receive_nothing(0.05))
+		await communicator.disconnect()
+
+	async def test_full_batch_is_flushed_immediately(self):
+		with override_settings(CHAT_WS_BATCH_WINDOW_MS=60000):
+			communicator = await self.connect("?batch=1")
+		await self.broadcast({"id": 1}, {"id": 2}, {"id": 3}, {"id": 4})
+		self.assertEqual(len(await communicator.receive_json_from()), 3)
+		# Le quatrième attend la fin de la fenêtre
+		self.assertTrue(await communicator.receive_nothing(0.05))
+		await communicator.disconnect()
+
+	async def test_pending_batch_is_flushed_before_close(self):
+		communicator = await self.connect("?batch=1")
+		await self.broadcast({"id": 1})
+		# Fermeture du worker pendant la fenêtre : le lot part avant l'indice de reconnexion
+		await draining.drain_consumers()
+		self.assertEqual(await communicator.receive_json_from(), [{"message": {"id": 1}}])
+		self.assertIn("reconnect", await communicator.receive_json_from())
+		self.assertEqual((await communicator.receive_output())["code"], draining.SERVICE_RESTART)
+
+
+class DeflateNegotiationTests(SimpleTestCase):
+	def test_accepts_permessage_deflate(self):
+		offer = PerMessageDeflateOffer()
+		accept = _accept_deflate([PerMessageBzip2Offer(), offer])
+		self.assertIs(accept.offer, offer)
+		self.assertEqual(accept.get_extension_string(), "permessage-deflate")
+
+	def test_refuses_other_offers(self):
+		self.assertIsNone(_accept_deflate([]))
+		self.assertIsNone(_accept_deflate([PerMessageBzip2Offer()]))
+
+	def test_server_installs_negotiation(self):
+		for ws_deflate in (True, False):
+			server = DrainingServer(application=None, endpoints=["tcp:port=0"], ws_deflate=ws_deflate)
+			server.ws_factory = WebSocketServerFactory()
+			server._on_ready()
+			self.assertEqual(server.ws_factory.perMessageCompressionAccept is _accept_deflate, ws_deflate)
@@ -0,0 +1,217 @@
+"""Envoi de pièces jointes par morceaux, reprenable.
+
+1. `POST /api/uploads/` `{"conversation_id", "filename", "size"}` : ouvre un envoi
+   et renvoie son `id`, l'`offset` courant (0) et la taille de morceau conseillée.
+2. `PUT /api/uploads/<id>/?offset=<n>` avec les octets bruts du morceau : écrit à
+   la position `n` et renvoie le nouvel `offset` et le CRC32 courant. Un `offset`
+   différent de celui du serveur est refusé (409) avec l'offset attendu : le
+   client reprend de là, sans renvoyer ce qui est déjà acquitté. L'en-tête
+   facultatif `X-Chunk-CRC32` fait vérifier le morceau avant de l'acquitter.
+3. `GET /api/uploads/<id>/` : état de l'envoi (reprise après coupure).
+4. `POST /api/uploads/<id>/complete/` `{"content", "crc32"}` : crée le message avec
+   la pièce jointe (fichier déplacé, pas recopié) et le diffuse. L'envoi est
+   supprimé avant le déplacement : une finalisation concurrente reçoit un 409.
+
+`DELETE /api/uploads/<id>/` abandonne l'envoi. Les morceaux sont lus depuis le
+flux de la requête et écrits directement dans un fichier partiel, hors de la
+boucle d'événements : un envoi ne garde jamais le fichier en mémoire.
+"""
+import os
+import zlib
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from django.views.decorators.http import require_http_methods, require_POST
+
+from .async_views import _contact_refused, _login_required, _membership, _not_found, _publish, _render, _request_data
+from .models import Message, Upload
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class _PartFile(File):
+	"""Fichier partiel exposé comme un fichier temporaire : le stockage le déplace au lieu de le copier"""
+
+	def temporary_file_path(self):
+		return self.file.name
+
+
+def _upload_state(upload):
+	return {
+		"id": str(upload.id),
+		"conversation_id": upload.conversation_id,
+		"filename": upload.filename,
+		"size": upload.size,
+		"offset": upload.offset,
+		"crc32": upload.crc32,
+		"chunk_size": settings.CHAT_UPLOAD_CHUNK_SIZE,
+	}
+
+
+async def _get_upload(user, upload_id):
+	"""Envoi en cours de l'utilisateur, ou None (inconnu ou expiré)"""
+	expired_before = timezone.now() - timedelta(hours=settings.CHAT_UPLOAD_EXPIRY_HOURS)
+	return await Upload.objects.filter(pk=upload_id, user=user, updated_at__gte=expired_before).afirst()
+
+
+def _upload_not_found(request):
+	return _render(request, {"detail": "Envoi introuvable ou expiré"}, status=404)
+
+
+def _delete_part(upload):
+	try:
+		os.unlink(upload.part_path)
+	except FileNotFoundError:
+		pass
+
+
+@require_POST
+@_login_required
+async def create_upload(request, user):
+	try:
+		data = _request_data(request)
+		conversation_id = int(data.get("conversation_id"))
+		size = int(data.get("size"))
+	except (ValueError, TypeError):
+		return _render(request, {"detail": "conversation_id, filename et size requis"}, status=400)
+	filename = get_valid_filename(os.path.basename(str(data.get("filename") or "")))[:255]
+	if not filename:
+		return _render(request, {"detail": "conversation_id, filename et size requis"}, status=400)
+	if not 0 < size <= settings.CHAT_UPLOAD_MAX_SIZE:
+		return _render(request, {"detail": f"Taille invalide (au plus {settings.CHAT_UPLOAD_MAX_SIZE} octets)"}, status=400)
+	if await _membership(user, conversation_id) is None:
+		return _not_found(request)
+
+	upload = await Upload.objects.acreate(conversation_id=conversation_id, user=user, filename=filename, size=size)
+	os.makedirs(upload.part_path.parent, exist_ok=True)
+	return _render(request, _upload_state(upload), status=201)
+
+
+def _write_chunk(request, upload, length, expected_crc):
+	"""Écrire le morceau à la position `upload.offset` ; renvoie le nouveau CRC32 ou None si le morceau est corrompu"""
+	crc = upload.crc32
+	chunk_crc = 0
+	remaining = length
+	# O_CREAT sans O_TRUNC : le fichier partiel survit aux reprises
+	fd = os.open(upload.part_path, os.O_WRONLY | os.O_CREAT, 0o666)
+	try:
+		position = upload.offset
+		while remaining:
+			block = request.read(min(READ_BLOCK_SIZE, remaining))
+			if not block:
+				break
+			# Écriture positionnée : renvoyer un morceau déjà écrit réécrit les mêmes octets
+			os.pwrite(fd, block, position)
+			position += len(block)
+			remaining -= len(block)
+			crc = zlib.crc32(block, crc)
+			chunk_crc = zlib.crc32(block, chunk_crc)
+	finally:
+		os.close(fd)
+	if remaining or (expected_crc is not None and chunk_crc != expected_crc):
+		return None
+	return crc
+
+
+async def _put_chunk(request, upload):
+	try:
+		offset = int(request.GET.get("offset", ""))
+		length = int(request.headers.get("Content-Length") or 0)
+		expected_crc = int(request.headers["X-Chunk-CRC32"]) if "X-Chunk-CRC32" in request.headers else None
+	except ValueError:
+		return _render(request, {"detail": "offset, Content-Length ou X-Chunk-CRC32 invalide"}, status=400)
+	if offset != upload.offset:
+		return _render(request, {"detail": "Offset inattendu", "offset": upload.offset}, status=409)
+	if not 0 < length <= settings.CHAT_UPLOAD_CHUNK_SIZE or offset + length > upload.size:
+		return _render(request, {
+			"detail": f"Morceau invalide (1 à {settings.CHAT_UPLOAD_CHUNK_SIZE} octets, sans dépasser la taille annoncée)"
+		}, status=400)
+
+	crc = await sync_to_async(_write_chunk, thread_sensitive=False)(request, upload, length, expected_crc)
+	if crc is None:
+		return _render(request, {"detail": "Morceau incomplet ou corrompu", "offset": upload.offset}, status=400)
+	# Acquittement conditionnel : un morceau concurrent au même offset ne compte qu'une fois
+	updated = await Upload.objects.filter(pk=upload.pk, offset=offset).aupdate(
+		offset=F("offset") + length, crc32=crc, updated_at=timezone.now()
+	)
+	if not updated:
+		await upload.arefresh_from_db(fields=["offset"])
+		return _render(request, {"detail": "Offset inattendu", "offset": upload.offset}, status=409)
+	upload.offset, upload.crc32 = offset + length, crc
+	return _render(request, _upload_state(upload))
+
+
+@require_http_methods(["GET", "PUT", "DELETE"])
+@_login_required
+async def upload_detail(request, user, upload_id):
+	upload = await _get_upload(user, upload_id)
+	if upload is None:
+		return _upload_not_found(request)
+	if request.method == "PUT":
+		return await _put_chunk(request, upload)
+	if request.method == "DELETE":
+		await upload.adelete()
+		await sync_to_async(_delete_part, thread_sensitive=False)(upload)
+		return _render(request, {"status": "deleted"})
+	return _render(request, _upload_state(upload))
+
+
+def _attach_part(message, upload):
+	with open(upload.part_path, "rb") as part:
+		message.attachment.save(upload.filename, _PartFile(part), save=False)
+
+
+@require_POST
+@_login_required
+async def complete_upload(request, user, upload_id):
+	upload = await _get_upload(user, upload_id)
+	if upload is None:
+		return _upload_not_found(request)
+	try:
+		data = _request_data(request)
+		expected_crc = int(data["crc32"]) if data.get("crc32") is not None else None
+	except (ValueError, TypeError):
+		return _render(request, {"detail": "Corps de requête invalide"}, status=400)
+	if upload.offset != upload.size:
+		return _render(request, {"detail": "Envoi incomplet", "offset": upload.offset}, status=409)
+	if expected_crc is not None and expected_crc != upload.crc32:
+		return _render(request, {"detail": "Somme de contrôle différente", "crc32": upload.crc32}, status=400)
+
+	membership = await _membership(user, upload.conversation_id)
+	if membership is None:
+		return _not_found(request)
+	if await _contact_refused(user, upload.conversation_id, membership):
+		return _render(request, {
+			"detail": "Impossible d'envoyer un message : vous n'êtes plus en contact avec cet utilisateur"
+		}, status=403)
+
+	# Réclamation atomique : de deux finalisations concurrentes, une seule déplace le fichier
+	claimed, _ = await Upload.objects.filter(pk=upload.pk, offset=upload.size).adelete()
+	if not claimed:
+		return _render(request, {"detail": "Envoi déjà finalisé"}, status=409)
+	message = Message(conversation_id=upload.conversation_id, sender=user, content=(data.get("content", "") or "").strip())
+	try:
+		await sync_to_async(_attach_part, thread_sensitive=False)(message, upload)
+	except BaseException:
+		# L'envoi n'existe plus : son fichier partiel ne serait jamais purgé
+		await sync_to_async(_delete_part, thread_sensitive=False)(upload)
+		raise
+	await message.asave()
+
+	payload = await _publish(message)
+	return _render(request, payload, status=201)
+
+
+def purge_stale_uploads():
+	"""Supprimer les envois expirés et leurs fichiers partiels ; renvoie leur nombre"""
+	expired_before = timezone.now() - timedelta(hours=settings.CHAT_UPLOAD_EXPIRY_HOURS)
+	stale = list(Upload.objects.filter(updated_at__lt=expired_before))
+	for upload in stale:
+		_delete_part(upload)
+	Upload.objects.filter(pk__in=[upload.pk for upload in stale]).delete()
+	return len(stale)
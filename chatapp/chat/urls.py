@@ -3,6 +3,7 @@ from django.shortcuts import render, redirect
 from rest_framework.routers import DefaultRouter
 from .views import ConversationViewSet, get_csrf_token, get_all_users, test_page
 from .contact_views import ContactViewSet, GroupInvitationViewSet
+from . import async_views, sync_views, upload_views
 
 router = DefaultRouter()
 router.register(r"conversations", ConversationViewSet, basename="conversation")
@@ -19,5 +20,17 @@ urlpatterns = [
 	path("test/", test_page, name="test"),
 	path("api/csrf-token/", get_csrf_token, name="csrf_token"),
 	path("api/users/all/", get_all_users, name="all_users"),
+	# Actions critiques servies en async natif ; déclarées avant le routeur DRF
+	path("api/conversations/unread-count/", async_views.unread_count, name="conversation-unread-count"),
+	path("api/conversations/<int:pk>/messages/", async_views.list_messages, name="conversation-messages"),
+	path("api/conversations/<int:pk>/send/", async_views.send_message, name="conversation-send"),
+	path("api/conversations/<int:pk>/mark-read/", async_views.mark_read, name="conversation-mark-read"),
+	path("api/ws-token/", async_views.ws_token, name="ws-token"),
+	# Synchronisation différentielle de toutes les conversations
+	path("api/sync/", sync_views.sync, name="sync"),
+	# Pièces jointes envoyées par morceaux, reprenables
+	path("api/uploads/", upload_views.create_upload, name="upload-create"),
+	path("api/uploads/<uuid:upload_id>/", upload_views.upload_detail, name="upload-detail"),
+	path("api/uploads/<uuid:upload_id>/complete/", upload_views.complete_upload, name="upload-complete"),
 	path("api/", include(router.urls)),
 ]
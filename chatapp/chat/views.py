@@ -1,38 +1,63 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404, render
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action, api_view
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.middleware.csrf import get_token
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 
-from .models import Conversation, Membership, Message, Contact
-from .serializers import ConversationSerializer, MessageSerializer
+from .membership_cache import invalidate_after_commit, memberships
+from .models import Conversation, Membership, Contact
+from .profiler import ProfiledViewMixin
+from .codecs import HAS_MSGPACK
+from .renderers import FastJSONParser, MessagePackParser
+from .serializers import ConversationSerializer, MembershipSerializer, requested_fields
 
 
 class IsAuthenticated(permissions.IsAuthenticated):
 	pass
 
 
+class MemberCursorPagination(CursorPagination):
+	page_size = 100
+	page_size_query_param = "page_size"
+	max_page_size = 500
+	ordering = "id"
+
+
 @method_decorator(csrf_exempt, name="dispatch")
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ProfiledViewMixin, viewsets.ModelViewSet):
 	permission_classes = [IsAuthenticated]
 	serializer_class = ConversationSerializer
-	parser_classes = (MultiPartParser, FormParser, JSONParser)
+	parser_classes = (MultiPartParser, FormParser, FastJSONParser) + ((MessagePackParser,) if HAS_MSGPACK else ())
 
 	def get_queryset(self):
-		return Conversation.objects.filter(memberships__user=self.request.user).distinct()
+		# Conversations de l'utilisateur lues dans le cache des appartenances :
+		# ni jointure ni distinct, et le nombre de membres reste exact
+		queryset = Conversation.objects.filter(pk__in=list(memberships.get(self.request.user.id)))
+		return ConversationSerializer.setup_queryset(queryset)
+
+	def get_membership(self, pk):
+		"""MembershipInfo de l'utilisateur pour la conversation `pk`, ou None"""
+		try:
+			return memberships.get(self.request.user.id).get(int(pk))
+		except (TypeError, ValueError):
+			return None
 
+	# Écritures d'appartenances en transaction : voir invalidate_after_commit
+	@transaction.atomic
 	def perform_create(self, serializer):
 		conversation = serializer.save(created_by=self.request.user)
 		Membership.objects.get_or_create(conversation=conversation, user=self.request.user, defaults={"is_admin": True})
 
 	@action(detail=False, methods=["post"], url_path="create-direct")
+	@transaction.atomic
 	def create_direct(self, request):
 		User = get_user_model()
 		target_user_id = request.data.get("user_id")
@@ -53,84 +78,29 @@ class ConversationViewSet(viewsets.ModelViewSet):
 				Membership(conversation=conv, user=request.user, is_admin=True),
 				Membership(conversation=conv, user=target_user, is_admin=False),
 			])
-		return Response(ConversationSerializer(conv).data, status=status.HTTP_201_CREATED)
+			invalidate_after_commit([request.user.id, target_user.id])
+		return Response(ConversationSerializer(conv, fields=requested_fields(request)).data, status=status.HTTP_201_CREATED)
 
 	@action(detail=True, methods=["post"], url_path="join")
 	def join(self, request, pk=None):
-		conversation = self.get_object()
-		Membership.objects.get_or_create(conversation=conversation, user=request.user)
+		# Seuls les membres voient la conversation : rien à créer, aucune requête
+		if self.get_membership(pk) is None:
+			raise Http404
 		return Response({"status": "joined"})
 
-	@action(detail=True, methods=["get"], url_path="messages")
-	def list_messages(self, request, pk=None):
-		conversation = self.get_object()
-		if not Membership.objects.filter(conversation=conversation, user=request.user).exists():
-			return Response({"detail": "Accès refusé"}, status=status.HTTP_403_FORBIDDEN)
-		messages = Message.objects.filter(conversation=conversation).select_related("sender")[:200]
-		return Response(MessageSerializer(messages, many=True).data)
-
-	@action(detail=True, methods=["post"], url_path="send")
-	def send_message(self, request, pk=None):
-		conversation = self.get_object()
-		if not Membership.objects.filter(conversation=conversation, user=request.user).exists():
-			return Response({"detail": "Accès refusé"}, status=status.HTTP_403_FORBIDDEN)
-		
-		# Pour les conversations privées, vérifier que les utilisateurs sont toujours en contact
-		if conversation.type == "direct":
-			# Récupérer l'autre utilisateur de la conversation
-			other_membership = Membership.objects.filter(
-				conversation=conversation
-			).exclude(user=request.user).first()
-			
-			if other_membership:
-				other_user = other_membership.user
-				# Vérifier si les utilisateurs sont toujours en contact
-				contact_exists = Contact.objects.filter(
-					Q(from_user=request.user, to_user=other_user, status='accepted') |
-					Q(from_user=other_user, to_user=request.user, status='accepted')
-				).exists()
-				
-				if not contact_exists:
-					return Response({
-						"detail": "Impossible d'envoyer un message : vous n'êtes plus en contact avec cet utilisateur"
-					}, status=status.HTTP_403_FORBIDDEN)
-		
-		content = (request.data.get("content", "") or "").strip()
-		attachment = request.FILES.get("attachment")
-		if not content and not attachment:
-			return Response({"detail": "content ou attachment requis"}, status=status.HTTP_400_BAD_REQUEST)
-		message = Message.objects.create(conversation=conversation, sender=request.user, content=content, attachment=attachment)
-		# Notify via channel layer group
-		from asgiref.sync import async_to_sync
-		from channels.layers import get_channel_layer
-		channel_layer = get_channel_layer()
-		async_to_sync(channel_layer.group_send)(
-			f"chat_{conversation.id}",
-			{"type": "chat_message", "message": MessageSerializer(message).data},
+	@action(detail=True, methods=["get"], url_path="members")
+	def members(self, request, pk=None):
+		"""Membres de la conversation, paginés par curseur (`?cursor=...&page_size=...`)"""
+		if self.get_membership(pk) is None:
+			return Response({"detail": "Conversation introuvable"}, status=status.HTTP_404_NOT_FOUND)
+		paginator = MemberCursorPagination()
+		page = paginator.paginate_queryset(
+			Membership.objects.filter(conversation_id=pk).select_related("user"), request, view=self
 		)
-		return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
-
-	@action(detail=True, methods=["post"], url_path="mark-read")
-	def mark_read(self, request, pk=None):
-		conversation = self.get_object()
-		m = Membership.objects.filter(conversation=conversation, user=request.user).first()
-		if not m:
-			return Response({"detail": "Accès refusé"}, status=status.HTTP_403_FORBIDDEN)
-		m.last_read_at = timezone.now()
-		m.save(update_fields=["last_read_at"])
-		return Response({"status": "ok", "last_read_at": m.last_read_at})
-
-	@action(detail=False, methods=["get"], url_path="unread-count")
-	def unread_count(self, request):
-		# return total unread messages across conversations
-		qs = Membership.objects.filter(user=request.user).select_related("conversation")
-		counts = {}
-		for mem in qs:
-			last_ts = mem.last_read_at or timezone.datetime.fromtimestamp(0, tz=timezone.utc)
-			counts[mem.conversation_id] = Message.objects.filter(conversation=mem.conversation, created_at__gt=last_ts).count()
-		return Response({"by_conversation": counts, "total": sum(counts.values())})
+		return paginator.get_paginated_response(MembershipSerializer(page, many=True).data)
 
 	@action(detail=False, methods=["post"], url_path="create-group")
+	@transaction.atomic
 	def create_group(self, request):
 		"""Créer une conversation de groupe par nom"""
 		name = request.data.get("name")
@@ -151,9 +121,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
 			user=request.user,
 			is_admin=True
 		)
-		return Response(ConversationSerializer(conversation).data, status=status.HTTP_201_CREATED)
+		return Response(ConversationSerializer(conversation, fields=requested_fields(request)).data, status=status.HTTP_201_CREATED)
 
 	@action(detail=False, methods=["post"], url_path="create-direct-by-username")
+	@transaction.atomic
 	def create_direct_by_username(self, request):
 		"""Créer une conversation privée par nom d'utilisateur"""
 		username = request.data.get("username")
@@ -191,18 +162,16 @@ class ConversationViewSet(viewsets.ModelViewSet):
 				Membership(conversation=conv, user=request.user, is_admin=True),
 				Membership(conversation=conv, user=target_user, is_admin=False),
 			])
+			invalidate_after_commit([request.user.id, target_user.id])
 		
-		return Response(ConversationSerializer(conv).data, status=status.HTTP_201_CREATED)
+		return Response(ConversationSerializer(conv, fields=requested_fields(request)).data, status=status.HTTP_201_CREATED)
 
 	@action(detail=False, methods=["get"], url_path="by-type")
 	def conversations_by_type(self, request):
 		"""Lister les conversations par type (direct/group)"""
 		conv_type = request.query_params.get("type", "direct")
-		conversations = Conversation.objects.filter(
-			memberships__user=request.user,
-			type=conv_type
-		).prefetch_related('memberships__user').distinct().order_by('-created_at')
-		return Response(ConversationSerializer(conversations, many=True).data)
+		conversations = self.get_queryset().filter(type=conv_type).order_by('-created_at')
+		return Response(ConversationSerializer(conversations, many=True, fields=requested_fields(request)).data)
 
 
 @api_view(['GET'])
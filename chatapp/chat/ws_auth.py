@@ -0,0 +1,133 @@
+"""Authentification WebSocket par jeton signé, sans accès base.
+
+`GET /api/ws-token/` délivre un jeton signé (`id`, `username`, génération)
+valable `CHAT_WS_TOKEN_MAX_AGE` secondes. Le client ouvre
+`ws/chat/<id>/?token=<jeton>` : `TokenAuthMiddleware` vérifie la signature,
+l'âge et la génération du jeton et place l'utilisateur dans le scope sans lire
+les tables de sessions ni d'utilisateurs. Un client le réutilise pour toutes
+ses reconnexions (redéploiement, changement de conversation).
+
+Révocation : `revoke_tokens(user_id)` incrémente la génération de
+l'utilisateur, ce qui invalide tous ses jetons déjà émis. Elle est appelée à la
+déconnexion et à chaque modification du compte (mot de passe, désactivation...) ;
+si elle échoue, l'exception remonte et fait échouer la déconnexion ou
+l'écriture plutôt que de laisser des jetons valides.
+
+Les générations sont partagées par tous les workers et survivent à leur
+redémarrage : dans Redis (`CHAT_CACHE_BACKEND=redis`), sinon dans la table
+`WsTokenGeneration` (une lecture par clé primaire à chaque poignée de main).
+
+Sans jeton, ou si le jeton est refusé ou la génération illisible (Redis
+indisponible), la poignée de main passe par l'authentification par cookie de
+session habituelle (`AuthMiddlewareStack`).
+"""
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db.models import F
+
+from .models import WsTokenGeneration
+
+try:
+	import redis
+except ImportError:  # pragma: no cover - dépendance optionnelle
+	redis = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = "chat.ws-token"
+
+
+class DatabaseTokenGenerations:
+	def get(self, user_id):
+		return WsTokenGeneration.objects.filter(user_id=user_id).values_list("generation", flat=True).first() or 0
+
+	def revoke(self, user_id):
+		_, created = WsTokenGeneration.objects.get_or_create(user_id=user_id, defaults={"generation": 1})
+		if not created:
+			WsTokenGeneration.objects.filter(user_id=user_id).update(generation=F("generation") + 1)
+
+
+class RedisTokenGenerations:
+	def __init__(self, host, port, db=0):
+		self.client = redis.Redis(host=host, port=port, db=db)
+
+	def _key(self, user_id):
+		return f"chat:wstoken:{user_id}:generation"
+
+	def get(self, user_id):
+		"""Génération courante, ou None si Redis est indisponible"""
+		try:
+			return int(self.client.get(self._key(user_id)) or 0)
+		except redis.RedisError:
+			logger.warning("Générations des jetons WebSocket indisponibles", exc_info=True)
+			return None
+
+	def revoke(self, user_id):
+		"""Une RedisError remonte : la révocation ne doit pas être perdue en silence"""
+		# Sans expiration : un compteur expiré repartirait de 0 et redonnerait, à la révocation
+		# suivante, une génération déjà portée par des jetons encore valides
+		self.client.incr(self._key(user_id))
+
+
+def _build_generations():
+	if settings.CHAT_CACHE_BACKEND == "redis" and redis is not None:
+		return RedisTokenGenerations(settings.REDIS_HOST, settings.REDIS_PORT)
+	return DatabaseTokenGenerations()
+
+
+generations = _build_generations()
+
+
+def issue_token(user):
+	return signing.dumps({"u": user.id, "n": user.get_username(), "g": generations.get(user.id) or 0}, salt=TOKEN_SALT)
+
+
+async def aissue_token(user):
+	# Redis ou base : hors de la boucle d'événements
+	return await sync_to_async(issue_token)(user)
+
+
+def revoke_tokens(user_id):
+	generations.revoke(user_id)
+
+
+def authenticate_token(token):
+	"""Utilisateur porté par un jeton valide et non révoqué, ou None"""
+	if not token:
+		return None
+	try:
+		claims = signing.loads(token, salt=TOKEN_SALT, max_age=settings.CHAT_WS_TOKEN_MAX_AGE)
+	except signing.BadSignature:
+		return None
+	if generations.get(claims["u"]) != claims["g"]:
+		return None
+	User = get_user_model()
+	# Instance non relue : seuls l'id et le nom servent aux consumers et aux sérialiseurs
+	return User(**{"pk": claims["u"], User.USERNAME_FIELD: claims["n"]})
+
+
+def _query_token(scope):
+	query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+	return (query.get("token") or [None])[0]
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+	"""Authentifie par `?token=` ; sinon délègue à l'authentification par session"""
+
+	def __init__(self, inner):
+		super().__init__(inner)
+		self.session_auth = AuthMiddlewareStack(inner)
+
+	async def __call__(self, scope, receive, send):
+		user = await database_sync_to_async(authenticate_token)(_query_token(scope))
+		if user is None:
+			return await self.session_auth(scope, receive, send)
+		return await super().__call__(dict(scope, user=user), receive, send)
@@ -1,17 +1,18 @@
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatproject.settings")
 from django.core.asgi import get_asgi_application
-from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator, OriginValidator
 
 # Initialize Django first to ensure apps are loaded
 django_asgi_app = get_asgi_application()
-http_app = ASGIStaticFilesHandler(django_asgi_app)
+# Fichiers statiques : variantes précompressées et cache longue durée (chat/staticfiles.py)
+from chat.staticfiles import StaticFilesHandler
+http_app = StaticFilesHandler(django_asgi_app)
 
 # Import routing only after Django setup
 from chat.routing import websocket_urlpatterns
+from chat.ws_auth import TokenAuthMiddleware
 
 # Allow WebSocket origins based on ALLOWED_HOSTS and explicit origins
 from django.conf import settings
@@ -26,7 +27,8 @@ application = ProtocolTypeRouter({
 	"http": http_app,
 	"websocket": AllowedHostsOriginValidator(
 		OriginValidator(
-			AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+			# Jeton signé (?token=) sans accès base, sinon cookie de session
+			TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
 			explicit_allowed_origins,
 		)
 	),
@@ -1,4 +1,6 @@
 import os
+import sys
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -9,6 +11,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'remplace_par_un_secret')
 
+# `manage.py test` : caches et channel layer en mémoire par défaut, sans serveur Redis
+TESTING = sys.argv[1:2] == ["test"]
+
 DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '127.0.0.1,localhost').split(',')
@@ -26,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+	# Étiquette les échantillons du profileur (chat/profiler.py), en premier
+	"chat.profiler.ProfileLabelMiddleware",
 	"django.middleware.security.SecurityMiddleware",
 	"django.contrib.sessions.middleware.SessionMiddleware",
 	"django.middleware.common.CommonMiddleware",
@@ -35,6 +42,37 @@ MIDDLEWARE = [
 	"django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Budgets de requêtes SQL (chat/querybudget.py) : off, warn (log) ou raise
+CHAT_QUERY_BUDGET_MODE = os.getenv('CHAT_QUERY_BUDGET_MODE', 'warn' if DEBUG else 'off')
+if CHAT_QUERY_BUDGET_MODE != 'off':
+	MIDDLEWARE.append("chat.querybudget.QueryBudgetMiddleware")
+
+# Nombre maximal de requêtes par nom d'URL ou événement WebSocket ("ws:<type>"),
+# ou {"queries": n, "time_ms": t}. Les budgets HTTP incluent session et utilisateur, et valent
+# caches froids : le chargement des appartenances (chat/membership_cache.py) y est compté.
+CHAT_QUERY_BUDGETS = {
+	"default": 10,
+	"conversation-list": 5,
+	"conversation-detail": 5,
+	"conversation-conversations-by-type": 5,
+	"conversation-members": 4,
+	"conversation-messages": 4,
+	"conversation-send": 6,
+	"conversation-mark-read": 4,
+	"conversation-unread-count": 3,
+	"sync": 8,
+	# Génération des jetons lue en base sans Redis (chat/ws_auth.py)
+	"ws-token": 3,
+	"contact-list": 3,
+	"contact-accepted-contacts": 3,
+	"contact-pending-requests": 3,
+	"group-invitation-list": 3,
+	"group-invitation-pending-invitations": 3,
+	"ws:websocket.connect": 1,
+	"ws:websocket.receive": 4,
+	"ws:chat_message": 0,
+}
+
 ROOT_URLCONF = "chatproject.urls"
 
 TEMPLATES = [
@@ -60,22 +98,105 @@ DATABASES = {
 	"default": {
 		"ENGINE": "django.db.backends.sqlite3",
 		"NAME": BASE_DIR / "db.sqlite3",
+		# Pas de connexions persistantes par défaut : sous ASGI, les threads des vues changent
+		"CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', '0')),
+		"CONN_HEALTH_CHECKS": True,
 	}
 }
+# Même base, connexions persistantes : utilisé par les seuls threads de l'exécuteur du chat (chat/db.py)
+DATABASES["chat_executor"] = {
+	**DATABASES["default"],
+	"CONN_MAX_AGE": int(os.getenv('CHAT_DB_EXECUTOR_CONN_MAX_AGE', '60')),
+	"TEST": {"MIRROR": "default"},
+}
+DATABASE_ROUTERS = ["chat.db.ExecutorRouter"]
 
-CHANNEL_LAYERS = {
-	"default": {
-		"BACKEND": "channels_redis.core.RedisChannelLayer",
-		"CONFIG": {
-			"hosts": [(os.getenv('REDIS_HOST', '127.0.0.1'), int(os.getenv('REDIS_PORT', '6379')))],
+# Taille du pool de threads dédié aux accès base de données du ChatConsumer
+CHAT_DB_EXECUTOR_WORKERS = int(os.getenv('CHAT_DB_EXECUTOR_WORKERS', '8'))
+
+REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+
+# Channel layer : "redis" (défaut) ou "local" (broker sur socket Unix, une seule machine, sans Redis)
+if os.getenv('CHANNEL_LAYER', 'memory' if TESTING else 'redis') == 'memory':
+	CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+elif os.getenv('CHANNEL_LAYER', 'redis') == 'local':
+	CHANNEL_LAYERS = {
+		"default": {
+			"BACKEND": "chat.layers.UnixSocketChannelLayer",
+			"CONFIG": {
+				"path": os.getenv('CHANNEL_LAYER_SOCKET', str(BASE_DIR / "channel-layer.sock")),
+			},
 		},
-	},
+	}
+else:
+	CHANNEL_LAYERS = {
+		"default": {
+			"BACKEND": "channels_redis.core.RedisChannelLayer",
+			"CONFIG": {
+				"hosts": [(REDIS_HOST, REDIS_PORT)],
+			},
+		},
+	}
+
+# Cache des derniers messages par conversation : "redis" (partagé) ou "local" (mémoire du processus)
+CHAT_CACHE_BACKEND = os.getenv('CHAT_CACHE_BACKEND', 'local' if TESTING else 'redis')
+# Taille de la page d'historique, et donc du cache des messages récents
+CHAT_RECENT_MESSAGES_SIZE = int(os.getenv('CHAT_RECENT_MESSAGES_SIZE', '200'))
+# WebSocket : fenêtre de regroupement des messages pour les clients `?batch=1`
+# (latence ajoutée maximale, en ms), taille maximale d'un lot, compression permessage-deflate
+CHAT_WS_BATCH_WINDOW_MS = int(os.getenv('CHAT_WS_BATCH_WINDOW_MS', '25'))
+CHAT_WS_BATCH_MAX = int(os.getenv('CHAT_WS_BATCH_MAX', '100'))
+CHAT_WS_DEFLATE = os.getenv('CHAT_WS_DEFLATE', 'True').lower() == 'true'
+# Durée de validité des jetons d'authentification WebSocket (chat/ws_auth.py), en secondes
+CHAT_WS_TOKEN_MAX_AGE = int(os.getenv('CHAT_WS_TOKEN_MAX_AGE', str(12 * 3600)))
+# Nombre de membres inclus dans chaque conversation (liste complète : action members/)
+CHAT_MEMBERS_PREVIEW_SIZE = int(os.getenv('CHAT_MEMBERS_PREVIEW_SIZE', '5'))
+# Synchronisation (api/sync/) : lignes maximales par catégorie et par réponse
+CHAT_SYNC_PAGE_SIZE = int(os.getenv('CHAT_SYNC_PAGE_SIZE', '500'))
+
+REST_FRAMEWORK = {
+	"DEFAULT_RENDERER_CLASSES": [
+		"chat.renderers.FastJSONRenderer",
+		# MessagePack n'est proposé que si le paquet msgpack est installé
+		*(["chat.renderers.MessagePackRenderer"] if find_spec("msgpack") else []),
+		"rest_framework.renderers.BrowsableAPIRenderer",
+	],
+	"DEFAULT_PARSER_CLASSES": [
+		"chat.renderers.FastJSONParser",
+		*(["chat.renderers.MessagePackParser"] if find_spec("msgpack") else []),
+		"rest_framework.parsers.FormParser",
+		"rest_framework.parsers.MultiPartParser",
+	],
 }
 
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
+STORAGES = {
+	"default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+	# Noms hachés + variantes .gz/.br : `collectstatic` obligatoire avec DEBUG=False
+	"staticfiles": {"BACKEND": "chat.staticfiles.CompressedManifestStaticFilesStorage"},
+}
+# Durée de cache des fichiers statiques à nom haché, en secondes (un an)
+CHAT_STATIC_MAX_AGE = int(os.getenv('CHAT_STATIC_MAX_AGE', str(365 * 24 * 3600)))
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+
+# Pièces jointes par morceaux (chat/upload_views.py) : taille maximale d'un morceau
+# et d'un fichier, en octets ; durée de vie d'un envoi inactif, en heures
+CHAT_UPLOAD_CHUNK_SIZE = int(os.getenv('CHAT_UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+CHAT_UPLOAD_MAX_SIZE = int(os.getenv('CHAT_UPLOAD_MAX_SIZE', str(100 * 1024 * 1024)))
+CHAT_UPLOAD_EXPIRY_HOURS = int(os.getenv('CHAT_UPLOAD_EXPIRY_HOURS', '24'))
+# Tâches différées (chat/tasks.py) : stockage "db" (table chat_task) ou "redis",
+# et nombre de threads de `run_chat_worker`
+CHAT_TASK_BACKEND = os.getenv('CHAT_TASK_BACKEND', 'db')
+CHAT_TASK_WORKERS = int(os.getenv('CHAT_TASK_WORKERS', '4'))
+# Profileur par échantillonnage (chat/profiler.py) : intervalle par défaut en
+# millisecondes, durée maximale d'un profil en secondes, et répertoire d'échange
+# entre `profile_chat` et les workers de `runchat`
+CHAT_PROFILE_INTERVAL_MS = int(os.getenv('CHAT_PROFILE_INTERVAL_MS', '5'))
+CHAT_PROFILE_MAX_SECONDS = int(os.getenv('CHAT_PROFILE_MAX_SECONDS', '60'))
+CHAT_PROFILE_DIR = os.getenv('CHAT_PROFILE_DIR', str(BASE_DIR / "profiles"))
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
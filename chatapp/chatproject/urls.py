@@ -3,7 +3,11 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from chat.admin import profile_worker
+
 urlpatterns = [
+    # Avant admin.site.urls, dont la vue « catch-all » répondrait 404
+    path("admin/profile/", admin.site.admin_view(profile_worker), name="chat-profile"),
     path("admin/", admin.site.urls),
     path("accounts/", include("django.contrib.auth.urls")),
     path("", include("chat.urls")),
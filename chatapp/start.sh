@@ -1,2 +1,5 @@
 #daphne -b 0.0.0.0 -p 8001 chatproject.asgi:application
-python3 -m daphne -b 0.0.0.0 -p 8001 chatproject.asgi:application
+# Un worker daphne par cœur sur le port 8001 ; `kill -HUP <pid>` recharge sans coupure
+# Fichiers statiques à noms hachés et variantes compressées (obligatoire avec DEBUG=False)
+python3 manage.py collectstatic --noinput
+python3 manage.py runchat --bind 0.0.0.0 --port 8001